@@ -0,0 +1,44 @@
+# coding=utf-8
+"""Binary encoding versus id strings: size, encoding and decoding times.
+
+Run it like "python benchmarks/bench_binary.py".
+"""
+from __future__ import print_function
+
+import time
+
+from whatami import What, parse_whatid
+from whatami.binary import what2bytes, bytes2what
+
+
+def pipeline(i):
+    scaler = What('scaler', {'with_mean': True, 'with_std': i % 2 == 0})
+    rfc = What('rfc', {'n_trees': 100 + i, 'criterion': 'gini', 'max_depth': None,
+                       'class_weight': {'a': 1.5, 'b': 0.25}, 'seed': i})
+    return What('pipeline', {'steps': [scaler, rfc], 'cv': (5, 'stratified'), 'features': list(range(20))})
+
+
+def timed(func, values):
+    start = time.time()
+    results = [func(value) for value in values]
+    return results, time.time() - start
+
+
+def bench_binary(num_whats=2000):
+    whats = [pipeline(i) for i in range(num_whats)]
+    ids, id_taken = timed(lambda what: what.id(), whats)
+    encoded, encode_taken = timed(what2bytes, whats)
+    parsed, parse_taken = timed(parse_whatid, ids)
+    decoded, decode_taken = timed(bytes2what, encoded)
+    assert parsed == decoded
+
+    print('%d pipelines' % num_whats)
+    print('  size:     id %d bytes, binary %d bytes' % (len(ids[0]), len(encoded[0])))
+    print('  id:       %.3fs (%.1f us/what)' % (id_taken, 1E6 * id_taken / num_whats))
+    print('  encode:   %.3fs (%.1f us/what)' % (encode_taken, 1E6 * encode_taken / num_whats))
+    print('  parse id: %.3fs (%.1f us/what)' % (parse_taken, 1E6 * parse_taken / num_whats))
+    print('  decode:   %.3fs (%.1f us/what)' % (decode_taken, 1E6 * decode_taken / num_whats))
+
+
+if __name__ == '__main__':
+    bench_binary()
@@ -0,0 +1,48 @@
+# coding=utf-8
+"""Checking which configurations are done: bloom filter versus probing the filesystem.
+
+Run it like "python benchmarks/bench_bloom.py".
+"""
+from __future__ import print_function
+
+import os.path as op
+import shutil
+import tempfile
+import time
+
+import numpy as np  # noqa, bulk operations are vectorized when numpy is around
+
+from whatami.bloom import WhatamiBloomFilter
+
+
+def bench_bloom(num_ids=10 ** 6, num_probes=10 ** 5):
+    ids = ['rfc(n_trees=%d,seed=%d)' % (i, i % 7) for i in range(num_ids)]
+    dest = tempfile.mkdtemp()
+    try:
+        start = time.time()
+        bloom = WhatamiBloomFilter.from_ids(ids, capacity=num_ids, error_rate=0.001, path=op.join(dest, 'seen'))
+        build_taken = time.time() - start
+        start = time.time()
+        found = bloom.contains_many(ids)
+        query_taken = time.time() - start
+        assert all(found)
+        new_ids = ['gbm(n_trees=%d)' % i for i in range(num_probes)]
+        false_positives = sum(bloom.contains_many(new_ids))
+        bloom.close()
+
+        start = time.time()
+        for whatid in new_ids:
+            op.exists(op.join(dest, whatid))
+        probe_taken = time.time() - start
+    finally:
+        shutil.rmtree(dest)
+
+    print('%d ids, %d bits (%.1f MB), %d hashes' % (num_ids, bloom.num_bits, bloom.num_bits / 8e6, bloom.num_hashes))
+    print('  build:             %.2fs (%.2f us/id)' % (build_taken, 1E6 * build_taken / num_ids))
+    print('  bulk query:        %.2fs (%.2f us/id)' % (query_taken, 1E6 * query_taken / num_ids))
+    print('  false positives:   %.4f' % (false_positives / float(num_probes)))
+    print('  filesystem probes: %.2f us/id' % (1E6 * probe_taken / num_probes))
+
+
+if __name__ == '__main__':
+    bench_bloom()
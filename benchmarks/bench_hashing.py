@@ -0,0 +1,40 @@
+# coding=utf-8
+"""Hashing many small arrays: pooled `hasher` versus a new hasher per call.
+
+Run it like "python benchmarks/bench_hashing.py".
+"""
+from __future__ import print_function
+
+import time
+
+import numpy as np
+
+from whatami.minijoblib.hashing import hasher, NumpyHasher
+from whatami.plugins import numpy_plugin
+
+
+def bench_small_arrays(num_arrays=100000, size=16):
+    arrays = [np.random.RandomState(i).rand(size) for i in range(num_arrays)]
+
+    start = time.time()
+    fresh = [NumpyHasher(hash_name='md5').hash(array) for array in arrays]
+    fresh_taken = time.time() - start
+
+    start = time.time()
+    pooled = [hasher(array) for array in arrays]
+    pooled_taken = time.time() - start
+
+    start = time.time()
+    for array in arrays:
+        numpy_plugin(array)
+    plugin_taken = time.time() - start
+
+    assert fresh == pooled
+    print('%d arrays of %d float64' % (num_arrays, size))
+    print('  new hasher per array: %.2fs (%.1f us/array)' % (fresh_taken, 1E6 * fresh_taken / num_arrays))
+    print('  pooled hasher:        %.2fs (%.1f us/array)' % (pooled_taken, 1E6 * pooled_taken / num_arrays))
+    print('  numpy_plugin:         %.2fs (%.1f us/array)' % (plugin_taken, 1E6 * plugin_taken / num_arrays))
+
+
+if __name__ == '__main__':
+    bench_small_arrays()
@@ -0,0 +1,35 @@
+# coding=utf-8
+"""Time to "import whatami", as reported by "python -X importtime" (python 3.7+).
+
+Run it like "python benchmarks/bench_import.py".
+"""
+from __future__ import print_function
+
+import subprocess
+import sys
+
+
+def bench_import(module='whatami', top=10, repeats=5):
+    timings = []
+    for _ in range(repeats):
+        stderr = subprocess.check_output([sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+                                         stderr=subprocess.STDOUT).decode('utf-8')
+        # lines look like "import time:  self [us] | cumulative | imported package"
+        rows = []
+        for line in stderr.splitlines():
+            if line.startswith('import time:') and 'imported package' not in line:
+                self_us, cumulative_us, name = line[len('import time:'):].split('|')
+                rows.append((int(cumulative_us), int(self_us), name.rstrip()))
+        timings.append(rows)
+    best = min(timings, key=lambda rows: [cumulative for cumulative, _, name in rows if name.strip() == module])
+    total = [cumulative for cumulative, _, name in best if name.strip() == module][0]
+    print('import %s: %.1f ms (best of %d)' % (module, total / 1E3, repeats))
+    print('heavier imports (cumulative ms):')
+    for cumulative, _, name in sorted(best, reverse=True)[:top]:
+        print('  %8.1f %s' % (cumulative / 1E3, name))
+    heavy = sorted(set(name.strip() for _, _, name in best) & {'numpy', 'pandas', 'toolz', 'cytoolz', 'arpeggio'})
+    print('deferred dependencies imported: %s' % (', '.join(heavy) if heavy else 'none'))
+
+
+if __name__ == '__main__':
+    bench_import()
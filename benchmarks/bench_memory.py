@@ -0,0 +1,42 @@
+# coding=utf-8
+"""Memory used per What, for constructed, parsed and binary-decoded configurations.
+
+Run it like "python benchmarks/bench_memory.py".
+"""
+from __future__ import print_function
+
+import gc
+import tracemalloc
+
+from whatami import What, parse_whatid
+from whatami.binary import what2bytes, bytes2what
+
+
+def construct(i):
+    # names and keys coming from elsewhere (e.g. files or columns) are not interned by python
+    name, keys = ''.join(['r', 'f', 'c']), [''.join(['n_', 'trees']), ''.join(['n_', 'jobs'])]
+    return What(name, {keys[0]: i, keys[1]: 4}, non_id_keys=[keys[1]])
+
+
+def measure(name, make, num_whats):
+    gc.collect()
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    whats = [make(i) for i in range(num_whats)]
+    used = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    print('  %-12s %.1f bytes/what' % (name + ':', used / float(num_whats)))
+    return whats
+
+
+def bench_memory(num_whats=100000):
+    print('%d configurations with 2 keys, one of them a non-id key' % num_whats)
+    measure('constructed', construct, num_whats)
+    ids = [construct(i).id(nonids_too=True) for i in range(num_whats // 10)]
+    measure('parsed', lambda i: parse_whatid(ids[i]), num_whats // 10)
+    encoded = [what2bytes(construct(i), nonids_too=True) for i in range(num_whats)]
+    measure('decoded', lambda i: bytes2what(encoded[i]), num_whats)
+
+
+if __name__ == '__main__':
+    bench_memory()
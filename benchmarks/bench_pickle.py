@@ -0,0 +1,45 @@
+# coding=utf-8
+"""Pickling batches of configurations (as sent to process pools): What.__reduce__ versus default slots pickling.
+
+Run it like "python benchmarks/bench_pickle.py".
+"""
+from __future__ import print_function
+
+import pickle
+import time
+
+from whatami import What
+
+
+class SlotsPickledWhat(What):
+    """A What pickled as python does by default for objects with __slots__."""
+    __slots__ = ()
+    __reduce__ = object.__reduce__
+
+
+def config(what_class, i):
+    rfc = what_class('rfc', {'n_trees': 100 + i, 'criterion': 'gini', 'n_jobs': 4, 'verbose': False},
+                     non_id_keys=('n_jobs', 'verbose'))
+    scaler = what_class('scaler', {'with_mean': True})
+    return what_class('pipeline', {'steps': [scaler, rfc], 'seed': i})
+
+
+def bench_pickle(num_whats=20000, protocol=pickle.HIGHEST_PROTOCOL):
+    print('%d pipelines, pickle protocol %d' % (num_whats, protocol))
+    for name, what_class in (('default', SlotsPickledWhat), ('__reduce__', What)):
+        whats = [config(what_class, i) for i in range(num_whats)]
+        start = time.time()
+        pickled = pickle.dumps(whats, protocol=protocol)
+        dumps_taken = time.time() - start
+        start = time.time()
+        loaded = pickle.loads(pickled)
+        loads_taken = time.time() - start
+        assert [what.id() for what in loaded] == [what.id() for what in whats]
+        print('  %-10s: %.1f bytes/what, dumps %.2fs (%.1f us/what), loads %.2fs (%.1f us/what)' %
+              (name, len(pickled) / float(num_whats),
+               dumps_taken, 1E6 * dumps_taken / num_whats, loads_taken, 1E6 * loads_taken / num_whats))
+
+
+if __name__ == '__main__':
+    bench_pickle(protocol=2)
+    bench_pickle()
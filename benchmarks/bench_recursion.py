@@ -0,0 +1,76 @@
+# coding=utf-8
+"""Cost of the recursion bookkeeping (memo, cycle detection and depth limits) on deep object graphs.
+
+Run it like "python benchmarks/bench_recursion.py".
+"""
+from __future__ import print_function
+
+import time
+from functools import partial
+
+from whatami import What, whatareyou
+from whatami.plugins import WhatamiPluginManager, anyobject0x_plugin
+
+
+class Node(object):
+    def __init__(self, value, children=()):
+        self.value = value
+        self.children = list(children)
+
+
+def deep_chain(depth):
+    node = Node(0)
+    for i in range(1, depth):
+        node = Node(i, [node])
+    return node
+
+
+def wide_tree(depth, arity):
+    if depth == 0:
+        return Node('leaf')
+    return Node(depth, [wide_tree(depth - 1, arity) for _ in range(arity)])
+
+
+def _time(what, repeats):
+    what.id()
+    start = time.time()
+    for _ in range(repeats):
+        what.id()
+    return (time.time() - start) / repeats
+
+
+def _no_bookkeeping(cls, v):
+    return cls._chain().build_string(v)
+
+
+def bench_recursion(repeats=20):
+    graphs = (('deep chain (depth 50)', deep_chain(50)),
+              ('tree (depth 6, arity 3)', wide_tree(6, 3)),
+              ('nested Whats (depth 100)', None))
+    with WhatamiPluginManager.scope():
+        WhatamiPluginManager.insert(partial(anyobject0x_plugin, deep=True), before=anyobject0x_plugin)
+        for name, graph in graphs:
+            if graph is None:
+                what = What('leaf', {})
+                for i in range(100):
+                    what = What('node', {'i': i, 'child': what})
+            else:
+                what = whatareyou(graph)
+            with_bookkeeping = _time(what, repeats)
+            WhatamiPluginManager.limit_recursion(max_depth=10000)
+            with_max_depth = _time(what, repeats)
+            WhatamiPluginManager.limit_recursion()
+            original = WhatamiPluginManager.__dict__['build_string']
+            WhatamiPluginManager.build_string = classmethod(_no_bookkeeping)
+            try:
+                without_bookkeeping = _time(what, repeats)
+            finally:
+                WhatamiPluginManager.build_string = original
+            print('%s' % name)
+            print('  no bookkeeping:        %.2f ms/id' % (1E3 * without_bookkeeping))
+            print('  cycle detection, memo: %.2f ms/id' % (1E3 * with_bookkeeping))
+            print('  ...and max_depth:      %.2f ms/id' % (1E3 * with_max_depth))
+
+
+if __name__ == '__main__':
+    bench_recursion()
@@ -0,0 +1,66 @@
+# coding=utf-8
+"""Registering and resolving nicknames one by one versus in bulk, for in-memory and SQLite registries.
+
+Run it like "python benchmarks/bench_registry.py".
+"""
+from __future__ import print_function
+
+import os.path as op
+import shutil
+import tempfile
+import time
+
+from whatami import What
+from whatami.registry import WhatamiRegistry, SQLiteWhatamiRegistry
+
+
+def _timed(func):
+    start = time.time()
+    result = func()
+    return time.time() - start, result
+
+
+def bench_registry(registry, whats, pairs):
+    num_entries = len(pairs)
+    one_by_one, _ = _timed(lambda: [registry.register(whatid, nickname) for whatid, nickname in pairs])
+    registry.reset()
+    bulk, _ = _timed(lambda: registry.register_many(pairs))
+    lookups, nicks = _timed(lambda: [registry.nick_or_id(what) for what in whats])
+    bulk_lookups, bulk_nicks = _timed(lambda: registry.nick_or_id_many(whats))
+    assert nicks == bulk_nicks
+    print('  register:         %.2fs (%.2f us/entry)' % (one_by_one, 1E6 * one_by_one / num_entries))
+    print('  register_many:    %.2fs (%.2f us/entry)' % (bulk, 1E6 * bulk / num_entries))
+    print('  nick_or_id:       %.2fs (%.2f us/what)' % (lookups, 1E6 * lookups / len(whats)))
+    print('  nick_or_id_many:  %.2fs (%.2f us/what)' % (bulk_lookups, 1E6 * bulk_lookups / len(whats)))
+
+
+def bench(num_entries=10 ** 6, num_whats=10 ** 5):
+    pairs = [("pipeline(scaler=scaler(with_mean=True),model=rfc(n_trees=%d,seed=%d))" % (i, i % 7), 'p%d' % i)
+             for i in range(num_entries)]
+    # Whats repeat, like in a sweep results table; ids get computed once per distinct object
+    models = [What('pipeline', {'scaler': What('scaler', {'with_mean': True}),
+                                'model': What('rfc', {'n_trees': i, 'seed': i % 7})})
+              for i in range(0, 2 * num_whats, 20)]
+    whats = [models[i % len(models)] for i in range(num_whats)]
+
+    for digest_ids in (False, True):
+        print('WhatamiRegistry(digest_ids=%r), %d entries' % (digest_ids, num_entries))
+        bench_registry(WhatamiRegistry(digest_ids=digest_ids), whats, pairs)
+
+    dest = tempfile.mkdtemp()
+    try:
+        print('SQLiteWhatamiRegistry, %d entries (register one by one: first %d)' % (num_entries, num_whats))
+        registry = SQLiteWhatamiRegistry(op.join(dest, 'registry.sqlite'))
+        bench_registry(registry, whats, pairs[:num_whats])
+        registry.reset()
+        bulk, _ = _timed(lambda: registry.register_many(pairs))
+        lookups, _ = _timed(lambda: registry.nick_or_id_many(whats))
+        print('  register_many:    %.2fs (%.2f us/entry, all)' % (bulk, 1E6 * bulk / num_entries))
+        print('  nick_or_id_many:  %.2fs (%.2f us/what, all)' % (lookups, 1E6 * lookups / num_whats))
+        registry.close()
+    finally:
+        shutil.rmtree(dest)
+
+
+if __name__ == '__main__':
+    bench()
@@ -5,5 +5,6 @@ from .what import *
 from .parsers import *
 from .whatutils import *
 from .registry import *
+from .binary import *
 
 __version__ = '5.1.16dev0'
@@ -0,0 +1,193 @@
+# coding=utf-8
+"""asyncio helpers to compute ids, digests and cached results without blocking the event loop.
+
+Rendering an id can be expensive (e.g. hashing large arrays or data frames in plugins, or reading
+files to digest them). These coroutines run that work in an executor (by default, the default
+executor of the loop, a pool of threads; hashlib releases the GIL on large buffers) and deduplicate
+concurrent requests, so that when many tasks ask for the same id or result at the same time,
+only one computation runs and all of them get its result.
+
+This module needs python 3.5 or newer, and it is not imported by `whatami` itself.
+
+Examples
+--------
+>>> import asyncio
+>>> from whatami import What
+>>> @async_memoized
+... async def train(data, n_trees=10):
+...     print('training')
+...     return sum(data) * n_trees
+>>> async def main():
+...     what = What('rfc', {'data': list(range(1000)), 'n_trees': 10})
+...     print(await what.aid(maxlength=20) == what.id(maxlength=20))
+...     return await asyncio.gather(train([1, 2]), train([1, 2], n_trees=10), train(data=[1, 2]))
+>>> asyncio.new_event_loop().run_until_complete(main())
+True
+training
+[30, 30, 30]
+"""
+
+# Authors: Santi Villalba <sdvillal@gmail.com>
+# Licence: BSD 3 clause
+
+import asyncio
+import os.path as op
+try:
+    from contextvars import copy_context
+except ImportError:  # pragma: no cover
+    copy_context = None
+from functools import partial, update_wrapper
+
+from whatami.cache import WhatamiLRUCache, call_what, _MISSING
+from whatami.plugins import WhatamiPluginManager, file_digest, _ACTIVE_CHAIN
+from whatami.what import What, is_whatable
+
+
+class SingleFlight(object):
+    """Runs at most one computation per key at a time, sharing its result with all concurrent callers.
+
+    Once a computation finishes, its key is forgotten; caching results is left to the caller.
+    Cancelling a caller does not cancel the shared computation, unless it is the last one waiting.
+    """
+
+    def __init__(self):
+        super(SingleFlight, self).__init__()
+        self._in_flight = {}  # (loop, key) -> [task, number of waiters]
+
+    def __len__(self):
+        return len(self._in_flight)
+
+    def __contains__(self, key):
+        return (id(asyncio.get_event_loop()), key) in self._in_flight
+
+    async def run(self, key, compute):
+        """Returns the result of awaiting compute(), or of the computation already running for key."""
+        flight_key = id(asyncio.get_event_loop()), key
+        flight = self._in_flight.get(flight_key)
+        if flight is None:
+            task = asyncio.ensure_future(compute())
+            flight = self._in_flight[flight_key] = [task, 0]
+            task.add_done_callback(lambda _: self._in_flight.pop(flight_key, None))
+        task = flight[0]
+        flight[1] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if flight[1] == 1 and not task.done():
+                task.cancel()
+            raise
+        finally:
+            flight[1] -= 1
+
+
+# Concurrent id, digest and file digest computations
+_FLIGHTS = SingleFlight()
+
+
+def _as_what(what):
+    if isinstance(what, What):
+        return what
+    return what.what() if callable(what.what) else what.what
+
+
+def _in_context(func):
+    """Returns a function that calls func in a copy of the current context (plugin scopes included)."""
+    if copy_context is not None:
+        return partial(copy_context().run, func)
+    # python < 3.7, just carry the active plugin chain
+    chain = _ACTIVE_CHAIN.get()
+
+    def in_context():
+        token = _ACTIVE_CHAIN.set(chain)
+        try:
+            return func()
+        finally:
+            _ACTIVE_CHAIN.reset(token)
+    return in_context
+
+
+async def _offload(executor, func, *args, **kwargs):
+    """Runs func in executor, in the current context, so that `WhatamiPluginManager.scope` is honored."""
+    return await asyncio.get_event_loop().run_in_executor(executor, _in_context(partial(func, *args, **kwargs)))
+
+
+async def aid(what, nonids_too=False, maxlength=0, abbreviate=False, executor=None):
+    """Returns the id of what (a What or whatable), rendered in executor; see `What.id`.
+
+    Concurrent requests for the id of the same object (and parameters, and plugins configuration)
+    share a single computation. Plugin scopes active in the caller are honored.
+    """
+    what = _as_what(what)
+    # N.B. the What is referenced by the running computation, so its python id is not reused meanwhile
+    key = 'id', id(what), nonids_too, maxlength, abbreviate, WhatamiPluginManager._config_key()
+    return await _FLIGHTS.run(key, partial(_offload, executor, what.id,
+                                           nonids_too=nonids_too, maxlength=maxlength, abbreviate=abbreviate))
+
+
+async def adigest_id(what, executor=None):
+    """Returns the digest of what (a What or whatable), computed in executor; see `What.digest_id`."""
+    what = _as_what(what)
+    key = 'digest', id(what), WhatamiPluginManager._config_key()
+    return await _FLIGHTS.run(key, partial(_offload, executor, what.digest_id))
+
+
+async def afile_digest(path, hash_name='md5', executor=None):
+    """Returns the digest of the contents of a file, read in executor; see `whatami.plugins.file_digest`."""
+    key = 'file', op.realpath(path), hash_name
+    return await _FLIGHTS.run(key, partial(_offload, executor, file_digest, path, hash_name=hash_name))
+
+
+def async_memoized(func=None, cache=None, max_entries=128, max_bytes=None, non_id_keys=None, sizeof=None,
+                   executor=None):
+    """Decorator to keep the results of a function in a cache keyed by the id of each call, for asyncio code.
+
+    The decorated function is a coroutine function. Ids of the calls (see `whatami.cache.call_what`)
+    are computed in executor, and so are the calls to func if it is a regular function.
+    Concurrent calls with the same id share a single computation.
+
+    Parameters
+    ----------
+    func : function or coroutine function
+      The function to decorate.
+
+    cache : object with methods get(what, default) and put(what, value), default None
+      Where to keep the results. If None, a new `whatami.cache.WhatamiLRUCache` with max_entries,
+      max_bytes and sizeof. Other caches (e.g. a `whatami.cache.WhatamiDiskCache`) are accessed in executor.
+
+    non_id_keys : list of strings, default None
+      Arguments that do not make part of the ids of the calls.
+
+    executor : concurrent.futures.Executor, default None
+      Where to run the blocking work; if None, the default executor of the event loop.
+    """
+    if func is None:
+        return partial(async_memoized, cache=cache, max_entries=max_entries, max_bytes=max_bytes,
+                       non_id_keys=non_id_keys, sizeof=sizeof, executor=executor)
+    if cache is None:
+        cache = WhatamiLRUCache(max_entries=max_entries, max_bytes=max_bytes, sizeof=sizeof)
+    in_memory = isinstance(cache, WhatamiLRUCache)
+    flights = SingleFlight()
+
+    async def compute(key, args, kwargs):
+        if asyncio.iscoroutinefunction(func):
+            value = await func(*args, **kwargs)
+        else:
+            value = await _offload(executor, func, *args, **kwargs)
+        if in_memory:
+            cache.put(key, value)
+        else:
+            await _offload(executor, cache.put, key, value)
+        return value
+
+    async def memoized_func(*args, **kwargs):
+        key = await _offload(executor, lambda: call_what(func, args, kwargs, non_id_keys=non_id_keys).id())
+        value = cache.get(key, _MISSING) if in_memory else await _offload(executor, cache.get, key, _MISSING)
+        if value is not _MISSING:
+            return value
+        return await flights.run(key, partial(compute, key, args, kwargs))
+
+    memoized_func = update_wrapper(memoized_func, func)
+    memoized_func.cache = cache
+    if is_whatable(func):
+        memoized_func.what = func.what
+    return memoized_func
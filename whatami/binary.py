@@ -0,0 +1,380 @@
+# coding=utf-8
+"""A compact, canonical, binary encoding of `whatami.What` configurations.
+
+Id strings are the human-friendly representation of configurations, but they are verbose
+and parsing them back is slow. The binary form encodes the same values as the id string
+(so decoding a binary form and parsing the id string give equal configurations), but it is
+smaller and much faster to decode, making it a better fit for storage and inter-process transport.
+
+The encoding is canonical: configuration keys, dictionary items and set elements are sorted,
+and non-id keys are left out, so equal configurations always encode to the same bytes and
+`binary_digest` can identify configurations without going through id strings.
+
+Each value is a one byte tag followed by its payload:
+
+  - None, True, False: just the tag
+  - int: zigzag varint; ints in [0, 64) are embedded in the tag
+  - float: its repr if shorter than 8 characters, a big-endian IEEE 754 double otherwise
+  - string: varint length + utf-8 bytes; lengths under 64 are embedded in the tag
+  - tuple, list, set, frozenset: varint length + elements (sets sorted by encoded element)
+  - dict: varint length + key-value pairs (sorted by encoded key)
+  - class: the fully qualified name as a string, as in `<class 'fqn'>`
+  - What: name, out_name (only for Whats with out_name), varint number of keys + key-value pairs sorted by key;
+    names and keys are encoded as varint length + utf-8 bytes
+
+Values of any other type (e.g. numpy arrays, functions or whatables) are encoded as the
+value resulting from parsing back their id string, unless they are whatables (that are
+encoded as their What). Note that collection summaries (see
+`WhatamiPluginManager.summarize_collections`) do not apply to the binary form.
+"""
+
+# Authors: Santi Villalba <sdvillal@gmail.com>
+# Licence: BSD 3 clause
+
+from __future__ import absolute_import
+
+import hashlib
+import struct
+
+from future.utils import PY2
+
+from whatami.misc import maybe_import
+from whatami.what import What, is_whatable, _intern
+
+
+# --- Format
+
+_VERSION = b'\x01'
+
+_NONE = b'N'
+_TRUE = b'T'
+_FALSE = b'F'
+_INT = b'i'
+_FLOAT = b'f'
+_DECIMAL = b'g'
+_STRING = b's'
+_TUPLE = b't'
+_LIST = b'l'
+_SET = b'e'
+_FROZENSET = b'z'
+_DICT = b'd'
+_CLASS = b'c'
+_WHAT = b'w'
+_NAMED_WHAT = b'W'
+_SMALL_INT = 0x80  # to 0xBF
+_SHORT_STRING = 0xC0  # to 0xFF
+
+_DOUBLE = struct.Struct('>d')
+
+_SMALL_INTS = [struct.pack('B', _SMALL_INT + n) for n in range(64)]
+_SHORT_STRINGS = [struct.pack('B', _SHORT_STRING + n) for n in range(64)]
+
+_INT_TYPES = (int, long) if PY2 else (int,)  # noqa
+_STRING_TYPES = (str, unicode) if PY2 else (str,)  # noqa
+
+
+# --- Encoding
+
+def _varint(n):
+    """Encodes a non-negative int as a little-endian base 128 varint."""
+    if n < 0x80:
+        return struct.pack('B', n)
+    out = bytearray()
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def _string(s):
+    if not isinstance(s, bytes):
+        s = s.encode('utf-8')
+    return _varint(len(s)) + s
+
+
+# Encodings of values parsed back from id strings; parsing is slow and the same strings (e.g. functions) recur
+_ENCODED_IDS = {}
+_ENCODED_IDS_MAX_SIZE = 4096
+
+
+def _encode_from_id(v, out):
+    """Encodes the value resulting from parsing back the id string of v."""
+    from whatami.plugins import WhatamiPluginManager
+    string = WhatamiPluginManager.build_string(v)
+    encoded = _ENCODED_IDS.get(string)
+    if encoded is None:
+        from whatami.parsers import parse_whatid
+        encoded = _encode_one(parse_whatid('v(v=%s)' % string).conf['v'], set(), False)
+        if len(_ENCODED_IDS) >= _ENCODED_IDS_MAX_SIZE:
+            _ENCODED_IDS.clear()
+        _ENCODED_IDS[string] = encoded
+    out.append(encoded)
+
+
+def _encode(v, out, active, nonids_too):
+    vtype = type(v)
+    if v is None:
+        out.append(_NONE)
+    elif vtype is bool:
+        out.append(_TRUE if v else _FALSE)
+    elif vtype in _INT_TYPES:
+        if 0 <= v < 64:
+            out.append(_SMALL_INTS[v])
+        else:
+            out.append(_INT)
+            out.append(_varint(v << 1 if v >= 0 else ((-v) << 1) - 1))
+    elif vtype is float:
+        decimal = repr(v)
+        if len(decimal) < 8:
+            out.append(_DECIMAL)
+            out.append(_string(decimal))
+        else:
+            out.append(_FLOAT)
+            out.append(_DOUBLE.pack(v))
+    elif vtype in _STRING_TYPES:
+        if not isinstance(v, bytes):
+            v = v.encode('utf-8')
+        if len(v) < 64:
+            out.append(_SHORT_STRINGS[len(v)])
+            out.append(v)
+        else:
+            out.append(_STRING)
+            out.append(_string(v))
+    elif vtype in (tuple, list, set, frozenset, dict) or isinstance(v, What):
+        key = id(v)
+        if key in active:
+            raise ValueError('cycle detected while encoding a %s' % vtype.__name__)
+        active.add(key)
+        try:
+            if isinstance(v, What):
+                _encode_what(v, out, active, nonids_too)
+            elif vtype is dict:
+                out.append(_DICT)
+                out.append(_varint(len(v)))
+                items = sorted((_encode_one(k, active, nonids_too), _encode_one(x, active, nonids_too))
+                               for k, x in v.items())
+                for k, x in items:
+                    out.append(k)
+                    out.append(x)
+            elif vtype in (set, frozenset):
+                out.append(_SET if vtype is set else _FROZENSET)
+                out.append(_varint(len(v)))
+                out.extend(sorted(_encode_one(x, active, nonids_too) for x in v))
+            else:
+                out.append(_TUPLE if vtype is tuple else _LIST)
+                out.append(_varint(len(v)))
+                for x in v:
+                    _encode(x, out, active, nonids_too)
+        finally:
+            active.discard(key)
+    elif not isinstance(v, type) and is_whatable(v):
+        what = v.what() if callable(v.what) else v.what
+        _encode(what, out, active, nonids_too)
+    elif isinstance(v, type):
+        from whatami.plugins import WhatamiPluginManager
+        string = WhatamiPluginManager.build_string(v)
+        if string.startswith("<class '") and string.endswith("'>"):
+            out.append(_CLASS)
+            out.append(_string(string[len("<class '"):-len("'>")]))
+        else:
+            _encode_from_id(v, out)
+    else:
+        _encode_from_id(v, out)
+
+
+def _encode_one(v, active, nonids_too):
+    out = []
+    _encode(v, out, active, nonids_too)
+    return b''.join(out)
+
+
+def _encode_what(what, out, active, nonids_too):
+    # N.B. nested Whats render without their non-id keys, as in their id strings
+    if what.out_name is None:
+        out.append(_WHAT)
+        out.append(_string(what.name))
+    else:
+        out.append(_NAMED_WHAT)
+        out.append(_string(what.name))
+        out.append(_string(what.out_name))
+    keys = sorted(k for k in what.conf if nonids_too or k not in what.non_id_keys)
+    out.append(_varint(len(keys)))
+    for k in keys:
+        out.append(_string(k))
+        _encode(what.conf[k], out, active, False)
+
+
+def what2bytes(what, nonids_too=False):
+    """Returns the canonical binary encoding of a What (or whatable) object.
+
+    Parameters
+    ----------
+    what : What or whatable
+      The configuration to encode.
+
+    nonids_too : boolean, default False
+      Non-ids keys of the top configuration are ignored if nonids_too is False.
+
+    Returns
+    -------
+    A bytes object, that can be decoded back using `bytes2what`.
+
+    Examples
+    --------
+    >>> what = What('rfc', {'n_trees': 100, 'criterion': 'gini', 'max_depth': None, 'verbose': True},
+    ...             non_id_keys=['verbose'])
+    >>> encoded = what2bytes(what)
+    >>> len(encoded) < len(what.id())
+    True
+    >>> print(bytes2what(encoded).id())
+    rfc(criterion='gini',max_depth=None,n_trees=100)
+    """
+    if not isinstance(what, What):
+        if not is_whatable(what):
+            raise ValueError('only What and whatable objects can be encoded, not %s' % type(what).__name__)
+        what = what.what() if callable(what.what) else what.what
+    out = [_VERSION]
+    _encode_what(what, out, {id(what)}, nonids_too)
+    return b''.join(out)
+
+
+# --- Decoding
+
+def _read_varint(data, i):
+    n = data[i]
+    if n < 0x80:
+        return n, i + 1
+    n &= 0x7f
+    shift = 7
+    while True:
+        i += 1
+        byte = data[i]
+        n |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return n, i + 1
+        shift += 7
+
+
+def _read_string(data, i):
+    n, i = _read_varint(data, i)
+    return data[i:i + n].decode('utf-8'), i + n
+
+
+def _read_class(fqn):
+    # Same as the parser: import if possible, a dictionary that does not roundtrip otherwise
+    module, _, clazz = fqn.rpartition('.')
+    try:
+        return getattr(maybe_import(module), clazz)
+    except (ImportError, AttributeError, ValueError):
+        return {'class': fqn}
+
+
+def _decode(data, i):
+    tag = data[i]
+    i += 1
+    if tag >= _SHORT_STRING:
+        end = i + tag - _SHORT_STRING
+        return data[i:end].decode('utf-8'), end
+    if tag >= _SMALL_INT:
+        return tag - _SMALL_INT, i
+    if tag == _NONE_ORD:
+        return None, i
+    if tag == _TRUE_ORD:
+        return True, i
+    if tag == _FALSE_ORD:
+        return False, i
+    if tag == _INT_ORD:
+        n, i = _read_varint(data, i)
+        return (n >> 1) if not n & 1 else -((n + 1) >> 1), i
+    if tag == _FLOAT_ORD:
+        return _DOUBLE.unpack_from(data, i)[0], i + 8
+    if tag == _DECIMAL_ORD:
+        decimal, i = _read_string(data, i)
+        return float(decimal), i
+    if tag == _STRING_ORD:
+        return _read_string(data, i)
+    if tag == _WHAT_ORD or tag == _NAMED_WHAT_ORD:
+        name, i = _read_string(data, i)
+        out_name = None
+        if tag == _NAMED_WHAT_ORD:
+            out_name, i = _read_string(data, i)
+        n, i = _read_varint(data, i)
+        conf = {}
+        for _ in range(n):
+            k, i = _read_string(data, i)
+            conf[_intern(k)], i = _decode(data, i)
+        return What(name, conf, out_name=out_name), i
+    if tag == _CLASS_ORD:
+        fqn, i = _read_string(data, i)
+        return _read_class(fqn), i
+    if tag in _COLLECTION_ORDS:
+        n, i = _read_varint(data, i)
+        if tag == _DICT_ORD:
+            dictionary = {}
+            for _ in range(n):
+                k, i = _decode(data, i)
+                dictionary[k], i = _decode(data, i)
+            return dictionary, i
+        elements = []
+        for _ in range(n):
+            x, i = _decode(data, i)
+            elements.append(x)
+        return _COLLECTION_ORDS[tag](elements), i
+    raise ValueError('unknown tag %r at position %d' % (bytes(bytearray([tag])), i - 1))
+
+
+(_NONE_ORD, _TRUE_ORD, _FALSE_ORD, _INT_ORD, _FLOAT_ORD, _DECIMAL_ORD, _STRING_ORD, _CLASS_ORD,
+ _WHAT_ORD, _NAMED_WHAT_ORD, _DICT_ORD) = (ord(tag) for tag in (_NONE, _TRUE, _FALSE, _INT, _FLOAT, _DECIMAL,
+                                                                _STRING, _CLASS, _WHAT, _NAMED_WHAT, _DICT))
+_COLLECTION_ORDS = {ord(_TUPLE): tuple, ord(_LIST): list, ord(_SET): set, ord(_FROZENSET): frozenset,
+                    _DICT_ORD: dict}
+
+
+def bytes2what(data):
+    """Decodes a What object from its binary encoding (see `what2bytes`).
+
+    Parameters
+    ----------
+    data : bytes-like
+      The binary encoding of a What, as returned by `what2bytes`.
+
+    Returns
+    -------
+    A `whatami.What` object, with no non-id keys.
+    """
+    if PY2 or isinstance(data, memoryview):
+        data = bytearray(data)
+    if not data[:1] == _VERSION:
+        raise ValueError('unsupported binary what version (%r)' % bytes(data[:1]))
+    if data[1] not in (_WHAT_ORD, _NAMED_WHAT_ORD):
+        raise ValueError('the binary encoding does not contain a What')
+    what, end = _decode(data, 1)
+    if end != len(data):
+        raise ValueError('%d trailing bytes after the encoded What' % (len(data) - end))
+    return what
+
+
+def binary_digest(what, hash_name='sha1'):
+    """Returns the hexdigest of the binary encoding of a What (or whatable) object.
+
+    Equal configurations have equal digests. These are different to the digests of id strings.
+
+    Parameters
+    ----------
+    what : What, whatable or bytes
+      The configuration to digest; bytes are taken to be already encoded by `what2bytes`.
+
+    hash_name : string, default 'sha1'
+      The name of any hash algorithm supported by hashlib.
+
+    Examples
+    --------
+    >>> binary_digest(What('rfc', {'n_trees': 100})) == binary_digest(What('rfc', {'n_trees': 100}))
+    True
+    >>> binary_digest(What('rfc', {'n_trees': 100})) == binary_digest(What('rfc', {'n_trees': 101}))
+    False
+    """
+    if not isinstance(what, (bytes, bytearray)):
+        what = what2bytes(what)
+    return hashlib.new(hash_name, what).hexdigest()
@@ -0,0 +1,286 @@
+# coding=utf-8
+"""A Bloom filter of seen whatami ids, to quickly tell which configurations have (probably) been done already.
+
+Queries never give false negatives: if an id was added, it is reported as seen. They can give
+false positives, at a rate fixed when the filter is created. So a filter can cheaply discard most
+of the work already done, before confirming what remains against the real results store.
+
+Filters can live in memory or in memory-mapped files, so they persist and can be shared, and
+filters with the same parameters (e.g. built by different workers) can be merged.
+
+Filters are opt-in, `whatami` itself does not import this module.
+
+Examples
+--------
+>>> seen = WhatamiBloomFilter(capacity=1000, error_rate=0.001)
+>>> seen.add(What('rfc', {'n_trees': 10}))
+>>> What('rfc', {'n_trees': 10}) in seen, 'rfc(n_trees=10)' in seen, What('rfc', {'n_trees': 20}) in seen
+(True, True, False)
+>>> seen.add_many('rfc(n_trees=%d)' % n for n in range(100))
+>>> seen.contains_many(['rfc(n_trees=50)', 'rfc(n_trees=500)'])
+[True, False]
+"""
+
+# Authors: Santi Villalba <sdvillal@gmail.com>
+# Licence: BSD 3 clause
+
+from __future__ import absolute_import, division
+
+import hashlib
+import math
+import mmap
+import struct
+import sys
+from itertools import islice
+
+from future.utils import string_types
+
+from whatami.misc import maybe_import
+from whatami.what import What
+from whatami.whatutils import what2id
+
+
+_MAGIC = b'WHATBLM1'
+# magic, number of bits, number of hashes, keys (0: ids, 1: digests), number of added keys
+_HEADER = struct.Struct('>8sQIIQ')
+_KEY_KINDS = ('id', 'digest')
+
+_MASK64 = (1 << 64) - 1
+_TWO_HASHES = struct.Struct('>QQ')
+
+# Keys are added and queried in chunks of this size when using numpy
+_CHUNK_SIZE = 2 ** 16
+
+
+def _optimal_parameters(capacity, error_rate):
+    """Returns (num_bits, num_hashes) for a filter holding capacity keys with the given false positive rate."""
+    if capacity <= 0:
+        raise ValueError('capacity must be positive, not %r' % capacity)
+    if not 0 < error_rate < 1:
+        raise ValueError('error_rate must be between 0 and 1, not %r' % error_rate)
+    num_bits = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+    num_hashes = max(1, int(round(num_bits / capacity * math.log(2))))
+    return num_bits, num_hashes
+
+
+class WhatamiBloomFilter(object):
+    """A Bloom filter of whatami ids (or digests), in memory or memory-mapped from a file.
+
+    The positions of each key are derived, by double hashing, from the md5 of its utf-8 encoding.
+
+    Parameters
+    ----------
+    capacity : int, default 10 ** 6
+      The number of keys expected; the false positive rate grows over error_rate beyond it.
+
+    error_rate : float, default 0.001
+      The desired false positive rate when holding capacity keys.
+
+    path : string, default None
+      If not None, the filter lives in this file, that must not exist; use `open` to load existing filters.
+
+    keys : 'id' or 'digest', default 'id'
+      What to add and query for What and whatable objects, their `id()` or their `digest_id()`.
+      Strings are always taken to be already ids or digests.
+    """
+
+    def __init__(self, capacity=10 ** 6, error_rate=0.001, path=None, keys='id'):
+        super(WhatamiBloomFilter, self).__init__()
+        if keys not in _KEY_KINDS:
+            raise ValueError('keys must be one of %r, not %r' % (_KEY_KINDS, keys))
+        num_bits, num_hashes = _optimal_parameters(capacity, error_rate)
+        self._setup(num_bits, num_hashes, keys, 0, path, create=True)
+
+    def _setup(self, num_bits, num_hashes, keys, count, path, create, readonly=False):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.keys = keys
+        self.count = count
+        self.path = path
+        self.readonly = readonly
+        self._mmap = None
+        self._array = None
+        num_bytes = (num_bits + 7) // 8
+        if path is None:
+            self._bits = bytearray(num_bytes)
+            return
+        if create:
+            with open(path, 'xb' if sys.version_info[0] > 2 else 'wb') as writer:
+                writer.write(self._header())
+                writer.truncate(_HEADER.size + num_bytes)
+        with open(path, 'rb' if readonly else 'r+b') as fileobj:
+            self._mmap = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ if readonly else mmap.ACCESS_WRITE)
+        if len(self._mmap) != _HEADER.size + num_bytes:
+            self._mmap.close()
+            raise ValueError('the bloom filter file %s is corrupt (wrong size)' % path)
+        self._bits = memoryview(self._mmap)[_HEADER.size:]
+
+    def _header(self):
+        return _HEADER.pack(_MAGIC, self.num_bits, self.num_hashes, _KEY_KINDS.index(self.keys), self.count)
+
+    @classmethod
+    def open(cls, path, readonly=False):
+        """Opens a filter stored in path."""
+        with open(path, 'rb') as reader:
+            header = reader.read(_HEADER.size)
+        if len(header) != _HEADER.size or not header.startswith(_MAGIC):
+            raise ValueError('%s is not a whatami bloom filter file' % path)
+        _, num_bits, num_hashes, keys, count = _HEADER.unpack(header)
+        bloom = cls.__new__(cls)
+        bloom._setup(num_bits, num_hashes, _KEY_KINDS[keys], count, path, create=False, readonly=readonly)
+        return bloom
+
+    @classmethod
+    def from_ids(cls, ids, capacity=10 ** 6, error_rate=0.001, path=None, keys='id'):
+        """Returns a new filter with all the ids (or What / whatable objects) from the ids iterable added."""
+        bloom = cls(capacity=capacity, error_rate=error_rate, path=path, keys=keys)
+        bloom.add_many(ids)
+        return bloom
+
+    # --- Keys and positions
+
+    def _key(self, what):
+        if isinstance(what, string_types):
+            key = what
+        elif self.keys == 'digest':
+            if not isinstance(what, What):
+                what = what.what() if callable(what.what) else what.what
+            key = what.digest_id()
+        else:
+            key = what2id(what)
+        return key.encode('utf-8') if not isinstance(key, bytes) else key
+
+    def _positions(self, key):
+        h1, h2 = _TWO_HASHES.unpack(hashlib.md5(key).digest())
+        num_bits = self.num_bits
+        return [((h1 + i * h2) & _MASK64) % num_bits for i in range(self.num_hashes)]
+
+    def _positions_array(self, keys):
+        digests = np.frombuffer(b''.join(hashlib.md5(key).digest() for key in keys), dtype='>u8').reshape(-1, 2)
+        h1, h2 = digests[:, :1].astype(np.uint64), digests[:, 1:].astype(np.uint64)
+        with np.errstate(over='ignore'):
+            return (h1 + np.arange(self.num_hashes, dtype=np.uint64) * h2) % np.uint64(self.num_bits)
+
+    def _bytes_and_masks(self, keys):
+        """Returns the arrays of byte indices and bit masks for the positions of each key."""
+        positions = self._positions_array(keys)
+        return positions >> np.uint64(3), np.left_shift(np.uint8(1), (positions & np.uint64(7)).astype(np.uint8))
+
+    def _bits_array(self):
+        if self._array is None:
+            self._array = np.frombuffer(self._bits, dtype=np.uint8)
+        return self._array
+
+    # --- Adding and querying
+
+    def _check_writable(self):
+        if self.readonly:
+            raise ValueError('this bloom filter is read only')
+
+    def add(self, what):
+        """Adds what (a What, whatable, id or digest) to the filter."""
+        self._check_writable()
+        bits = self._bits
+        new = False
+        for position in self._positions(self._key(what)):
+            byte, mask = position >> 3, 1 << (position & 7)
+            if not bits[byte] & mask:
+                bits[byte] |= mask
+                new = True
+        self.count += new
+
+    def __contains__(self, what):
+        bits = self._bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(self._key(what)))
+
+    def _chunks(self, whats):
+        whats = iter(whats)
+        while True:
+            chunk = [self._key(what) for what in islice(whats, _CHUNK_SIZE)]
+            if not chunk:
+                return
+            yield chunk
+
+    def add_many(self, whats):
+        """Adds all the Whats, whatables, ids or digests in the whats iterable."""
+        self._check_writable()
+        if 'numpy' not in sys.modules:
+            for what in whats:
+                self.add(what)
+            return
+        bits = self._bits_array()
+        for keys in self._chunks(whats):
+            byte, mask = self._bytes_and_masks(keys)
+            self.count += int((~(bits[byte] & mask).astype(bool)).any(axis=1).sum())
+            np.bitwise_or.at(bits, byte, mask)
+
+    def contains_many(self, whats):
+        """Returns a list of booleans telling, for each What, whatable, id or digest in whats, if it was added."""
+        if 'numpy' not in sys.modules:
+            return [what in self for what in whats]
+        bits = self._bits_array()
+        contained = []
+        for keys in self._chunks(whats):
+            byte, mask = self._bytes_and_masks(keys)
+            contained.extend((bits[byte] & mask).astype(bool).all(axis=1).tolist())
+        return contained
+
+    def __len__(self):
+        """The approximate number of distinct keys added."""
+        return self.count
+
+    def false_positive_rate(self):
+        """Returns the expected false positive rate given the number of keys added so far."""
+        return (1 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** self.num_hashes
+
+    # --- Merging
+
+    def merge(self, other):
+        """Adds all the keys in other, a filter with the same parameters, to this filter; returns self."""
+        self._check_writable()
+        if (self.num_bits, self.num_hashes, self.keys) != (other.num_bits, other.num_hashes, other.keys):
+            raise ValueError('only bloom filters with the same number of bits, hashes and keys can be merged')
+        if 'numpy' in sys.modules:
+            np.bitwise_or(self._bits_array(), other._bits_array(), out=self._bits_array())
+        else:
+            bits, other_bits = self._bits, other._bits
+            for i in range(len(bits)):
+                bits[i] |= other_bits[i]
+        # N.B. an upper bound, keys in both filters are counted twice
+        self.count += other.count
+        return self
+
+    __ior__ = merge
+
+    # --- Persistence
+
+    def flush(self):
+        """Writes pending changes of a filter backed by a file."""
+        if self._mmap is not None and not self.readonly:
+            self._mmap[:_HEADER.size] = self._header()
+            self._mmap.flush()
+
+    def close(self):
+        """Flushes and releases the file of a filter backed by a file."""
+        if self._mmap is not None:
+            self.flush()
+            self._array = None
+            self._bits.release()
+            self._mmap.close()
+            self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def save(self, path):
+        """Writes this filter to a new file at path, that can be loaded with `open`."""
+        with open(path, 'xb' if sys.version_info[0] > 2 else 'wb') as writer:
+            writer.write(self._header())
+            writer.write(self._bits)
+        return path
+
+
+np = maybe_import('numpy', 'conda')
@@ -0,0 +1,590 @@
+# coding=utf-8
+"""Caching of computation results keyed by whatami ids.
+
+`WhatamiDiskCache` is a content-addressed store of results on disk, safe to share between
+threads and processes in a machine; `disk_cached` decorates functions to store their results
+in such a store, using the id of each call (function name and bound arguments) as its key.
+
+`WhatamiLRUCache` and `memoized` are their in-memory counterparts, bounded in number of
+entries or estimated bytes and evicting the least recently used results.
+
+This module is not imported by `whatami` itself, use `import whatami.cache`.
+
+Examples
+--------
+>>> import tempfile
+>>> cache = WhatamiDiskCache(tempfile.mkdtemp())
+>>> @cache.cached
+... def add(x, y=3):
+...     print('computing')
+...     return x + y
+>>> add(2)
+computing
+5
+>>> add(2)
+5
+>>> add(x=2, y=3)
+5
+>>> print(cache.path(What('add', {'x': 2, 'y': 3}))[len(cache.root) + 1:])
+f4/add(x=2,y=3).pkl
+"""
+
+# Authors: Santi Villalba <sdvillal@gmail.com>
+# Licence: BSD 3 clause
+
+from __future__ import absolute_import
+
+import errno
+import hashlib
+import inspect
+import os
+import os.path as op
+import pickle
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from functools import update_wrapper
+
+from future.utils import string_types
+
+from whatami.misc import MAX_EXT4_FN_LENGTH, callable2call, extract_decorated_function_from_closure, maybe_import
+from whatami.what import What, is_whatable
+from whatami.whatutils import what2id
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None  # no file locks on windows, concurrent writers are still safe but can repeat work
+
+
+# --- Call ids
+
+def call_what(func, args=(), kwargs=None, non_id_keys=None):
+    """Returns a What for a call to func, named as func, with the bound arguments, defaults included, as conf.
+
+    Examples
+    --------
+    >>> def f(x, y=3, *args, **kwargs):
+    ...     pass
+    >>> print(call_what(f, (1,), {'z': 2}).id())
+    f(args=(),kwargs={'z':2},x=1,y=3)
+    """
+    name, conf = callable2call(func, closure_extractor=extract_decorated_function_from_closure)
+    kwargs = {} if kwargs is None else kwargs
+    try:
+        signature = inspect.signature(func)
+    except AttributeError:  # pragma: no cover
+        # python 2
+        conf.update(inspect.getcallargs(func, *args, **kwargs))
+    else:
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        conf.update(bound.arguments)
+    return What(name, conf, non_id_keys=non_id_keys)
+
+
+# --- Serializers
+
+class PickleSerializer(object):
+    """Stores any picklable value using the highest pickle protocol."""
+
+    extension = '.pkl'
+
+    def __init__(self, protocol=pickle.HIGHEST_PROTOCOL):
+        super(PickleSerializer, self).__init__()
+        self.protocol = protocol
+
+    def dump(self, value, fileobj):
+        pickle.dump(value, fileobj, protocol=self.protocol)
+
+    def load(self, path):
+        with open(path, 'rb') as reader:
+            return pickle.load(reader)
+
+
+class NumpySerializer(object):
+    """Stores numpy arrays with `np.save`; reads them memory-mapped if mmap is True."""
+
+    extension = '.npy'
+
+    def __init__(self, mmap=True):
+        super(NumpySerializer, self).__init__()
+        self.mmap = mmap
+
+    def dump(self, value, fileobj):
+        np.save(fileobj, value, allow_pickle=False)
+
+    def load(self, path):
+        return np.load(path, mmap_mode='r' if self.mmap else None, allow_pickle=False)
+
+
+np = maybe_import('numpy', 'conda')
+
+SERIALIZERS = {
+    'pickle': PickleSerializer,
+    'numpy': NumpySerializer,
+}
+
+
+def _serializer(serializer):
+    if serializer is None:
+        return PickleSerializer()
+    if isinstance(serializer, string_types):
+        try:
+            return SERIALIZERS[serializer]()
+        except KeyError:
+            raise ValueError('unknown serializer "%s", must be one of %r' % (serializer, sorted(SERIALIZERS)))
+    return serializer
+
+
+# --- Disk cache
+
+_MISSING = object()
+
+
+def _missing_file(e):
+    return getattr(e, 'errno', None) == errno.ENOENT
+
+
+def _remove(path):
+    """Removes a file, returns False if it did not exist."""
+    try:
+        os.remove(path)
+        return True
+    except OSError as e:
+        if _missing_file(e):
+            return False
+        raise
+
+
+_replace = getattr(os, 'replace', os.rename)
+
+
+class WhatamiDiskCache(object):
+    """A store of computation results on disk, keyed by whatami ids.
+
+    Each result lives in a file "root/<shard>/<name><extension>", where shard is the first
+    two characters of the sha1 of the id and name is the id itself if it makes a valid file name
+    that fits `MAX_EXT4_FN_LENGTH`, or the sha1 of the id otherwise.
+
+    Writes are atomic (write to a temporary file, then rename), so readers never see partial results.
+    When computing missing results (`get_or_compute`, `cached`), a lock file per key ensures that
+    only one thread or process computes it, while the others wait and then read it.
+
+    Parameters
+    ----------
+    root : string
+      The directory where the results are stored; it is created if it does not exist.
+
+    serializer : string or serializer, default None
+      How results are written and read, 'pickle' (the default) or 'numpy'. Serializers are objects
+      with an `extension` string and `dump(value, fileobj)` and `load(path)` methods.
+
+    max_bytes : int, default None
+      If not None, the least recently used results are evicted when the store gets larger than this.
+
+    max_age : float, default None
+      If not None, results not used during max_age seconds are evicted.
+
+    readable_names : boolean, default True
+      If False, results are always stored in files named by the sha1 of their id.
+
+    evict_every : int, default 64
+      If max_bytes or max_age are given, evict each evict_every writes from this cache object.
+    """
+
+    def __init__(self, root, serializer=None, max_bytes=None, max_age=None,
+                 readable_names=True, evict_every=64):
+        super(WhatamiDiskCache, self).__init__()
+        self.root = op.abspath(op.expanduser(root))
+        self.serializer = _serializer(serializer)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.readable_names = readable_names
+        self.evict_every = evict_every
+        self._num_writes = 0
+        self._ensure_dir(self.root)
+
+    @staticmethod
+    def _ensure_dir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            if not op.isdir(path):
+                raise
+
+    # --- Keys
+
+    def path(self, what, serializer=None):
+        """Returns the path where the result for what (a What, whatable or id string) is stored."""
+        whatid = what2id(what)
+        digest = hashlib.sha1(whatid.encode('utf-8')).hexdigest()
+        extension = _serializer(serializer or self.serializer).extension
+        name = digest
+        if (self.readable_names and '/' not in whatid and '\x00' not in whatid and not whatid.startswith('.') and
+                len((whatid + extension).encode('utf-8')) <= MAX_EXT4_FN_LENGTH):
+            name = whatid
+        return op.join(self.root, digest[:2], name + extension)
+
+    # --- Reads and writes
+
+    def _load(self, path, serializer):
+        try:
+            value = serializer.load(path)
+        except (IOError, OSError) as e:
+            if _missing_file(e):
+                return _MISSING
+            raise
+        # Recently used, for eviction
+        try:
+            os.utime(path, None)
+        except OSError as e:  # pragma: no cover
+            if not _missing_file(e):
+                raise
+        return value
+
+    def _write(self, path, value, serializer):
+        shard = op.dirname(path)
+        self._ensure_dir(shard)
+        fd, tmp_path = tempfile.mkstemp(dir=shard, prefix='.tmp-', suffix=serializer.extension)
+        try:
+            with os.fdopen(fd, 'wb') as writer:
+                serializer.dump(value, writer)
+            _replace(tmp_path, path)
+        except BaseException:
+            _remove(tmp_path)
+            raise
+        self._num_writes += 1
+        if (self.max_bytes is not None or self.max_age is not None) and self._num_writes % self.evict_every == 0:
+            self.evict()
+
+    def get(self, what, default=None, serializer=None):
+        """Returns the stored result for what, or default if there is none."""
+        serializer = _serializer(serializer or self.serializer)
+        value = self._load(self.path(what, serializer), serializer)
+        return default if value is _MISSING else value
+
+    def put(self, what, value, serializer=None):
+        """Stores value as the result for what; returns value."""
+        serializer = _serializer(serializer or self.serializer)
+        self._write(self.path(what, serializer), value, serializer)
+        return value
+
+    def __contains__(self, what):
+        return op.isfile(self.path(what))
+
+    def delete(self, what, serializer=None):
+        """Removes the result for what, returns False if there was none."""
+        return _remove(self.path(what, serializer))
+
+    def get_or_compute(self, what, compute, serializer=None):
+        """Returns the stored result for what, computing it with compute() and storing it if missing."""
+        serializer = _serializer(serializer or self.serializer)
+        path = self.path(what, serializer)
+        value = self._load(path, serializer)
+        if value is _MISSING:
+            with self._locked(path):
+                value = self._load(path, serializer)
+                if value is _MISSING:
+                    value = compute()
+                    self._write(path, value, serializer)
+        return value
+
+    @contextmanager
+    def _locked(self, path):
+        """Exclusive access to path among processes, using a lock file next to it."""
+        if fcntl is None:  # pragma: no cover
+            yield
+            return
+        shard, name = op.split(path)
+        self._ensure_dir(shard)
+        lock_path = op.join(shard, '.%s.lock' % hashlib.sha1(name.encode('utf-8')).hexdigest())
+        fd = os.open(lock_path, os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+            # Done, waiters will find the result; on errors we keep the lock file so newcomers wait too
+            _remove(lock_path)
+        finally:
+            os.close(fd)
+
+    # --- Maintenance
+
+    def entries(self):
+        """Returns a list of tuples (path, size, last use time) for all the stored results."""
+        entries = []
+        for shard in os.listdir(self.root):
+            shard_path = op.join(self.root, shard)
+            if shard.startswith('.') or not op.isdir(shard_path):
+                continue
+            for name in os.listdir(shard_path):
+                if name.startswith('.'):
+                    continue
+                path = op.join(shard_path, name)
+                try:
+                    stat = os.stat(path)
+                except OSError as e:
+                    if _missing_file(e):
+                        continue
+                    raise
+                entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def evict(self, max_bytes=None, max_age=None):
+        """Removes results not used in max_age seconds and then, least recently used first,
+        results until the store takes no more than max_bytes.
+
+        None limits default to those of the cache. Returns the number of removed results.
+        If another process is already evicting, this does nothing and returns 0.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        max_age = self.max_age if max_age is None else max_age
+        if max_bytes is None and max_age is None:
+            return 0
+        fd = os.open(op.join(self.root, '.evict.lock'), os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except (IOError, OSError) as e:
+                    if e.errno in (errno.EAGAIN, errno.EACCES):
+                        return 0
+                    raise
+            entries = sorted(self.entries(), key=lambda entry: entry[2])
+            num_removed = 0
+            if max_age is not None:
+                too_old = time.time() - max_age
+                while entries and entries[0][2] < too_old:
+                    num_removed += _remove(entries.pop(0)[0])
+            if max_bytes is not None:
+                total = sum(entry[1] for entry in entries)
+                for path, size, _ in entries:
+                    if total <= max_bytes:
+                        break
+                    num_removed += _remove(path)
+                    total -= size
+            return num_removed
+        finally:
+            os.close(fd)
+
+    def clear(self):
+        """Removes all the stored results."""
+        for shard in os.listdir(self.root):
+            shard_path = op.join(self.root, shard)
+            if op.isdir(shard_path):
+                shutil.rmtree(shard_path, ignore_errors=True)
+
+    # --- Decorator
+
+    def cached(self, func=None, non_id_keys=None, serializer=None):
+        """Decorates func so its results are stored in this cache, keyed by the id of each call.
+
+        The id of a call is that of a What named as the function, with the bound arguments
+        (defaults included) as configuration; see `call_what`. Non-id keys (e.g. "n_jobs")
+        do not take part in the key.
+        """
+        if func is None:
+            return lambda f: self.cached(f, non_id_keys=non_id_keys, serializer=serializer)
+
+        def cached_func(*args, **kwargs):
+            what = call_what(func, args, kwargs, non_id_keys=non_id_keys)
+            return self.get_or_compute(what, lambda: func(*args, **kwargs), serializer=serializer)
+
+        cached_func = update_wrapper(cached_func, func)
+        cached_func.cache = self
+        if is_whatable(func):
+            cached_func.what = func.what
+        return cached_func
+
+
+def disk_cached(root, non_id_keys=None, serializer=None, **cache_params):
+    """Decorator to store the results of a function in a `WhatamiDiskCache` at root.
+
+    Examples
+    --------
+    >>> import tempfile
+    >>> @disk_cached(tempfile.mkdtemp(), non_id_keys=['verbose'])
+    ... def mul(x, y=3, verbose=False):
+    ...     return x * y
+    >>> mul(2), mul(2, verbose=True), mul.cache.get(What('mul', {'x': 2, 'y': 3}))
+    (6, 6, 6)
+    """
+    cache = WhatamiDiskCache(root, serializer=serializer, **cache_params)
+    return cache.cached(non_id_keys=non_id_keys)
+
+
+# --- In memory LRU cache
+
+CacheStats = namedtuple('CacheStats', ['hits', 'misses', 'evictions', 'entries', 'bytes'])
+
+
+def estimate_bytes(value):
+    """Returns a (rough) estimate of the memory used by value.
+
+    Uses `nbytes` for numpy arrays, `memory_usage` for pandas objects and `sys.getsizeof`
+    otherwise, adding up the elements of lists, tuples, sets and dicts.
+    """
+    nbytes = getattr(value, 'nbytes', None)
+    if isinstance(nbytes, int):
+        return nbytes
+    memory_usage = getattr(value, 'memory_usage', None)
+    if callable(memory_usage):
+        try:
+            usage = memory_usage(deep=True)
+            return int(getattr(usage, 'sum', lambda: usage)())
+        except TypeError:
+            pass
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(estimate_bytes(element) for element in value)
+    elif isinstance(value, dict):
+        size += sum(estimate_bytes(k) + estimate_bytes(v) for k, v in value.items())
+    return size
+
+
+class WhatamiLRUCache(object):
+    """An in-memory, thread-safe, least recently used cache of results keyed by whatami ids.
+
+    Parameters
+    ----------
+    max_entries : int, default 128
+      If not None, the maximum number of results kept.
+
+    max_bytes : int, default None
+      If not None, the maximum estimated bytes of the results kept. Results larger than this are not kept.
+
+    sizeof : function (value) -> int, default None
+      How to estimate the bytes of a result; if None, `estimate_bytes` is used.
+    """
+
+    def __init__(self, max_entries=128, max_bytes=None, sizeof=None):
+        super(WhatamiLRUCache, self).__init__()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = estimate_bytes if sizeof is None else sizeof
+        self._lock = threading.RLock()
+        self._entries = OrderedDict()  # id -> (value, bytes), least recently used first
+        self._bytes = 0
+        self._hits = self._misses = self._evictions = 0
+
+    def get(self, what, default=None):
+        """Returns the result for what (a What, whatable or id string), or default if there is none."""
+        value = self._get(what2id(what))
+        return default if value is _MISSING else value
+
+    def _get(self, key):
+        with self._lock:
+            try:
+                value, nbytes = self._entries.pop(key)
+            except KeyError:
+                self._misses += 1
+                return _MISSING
+            self._entries[key] = value, nbytes
+            self._hits += 1
+            return value
+
+    def put(self, what, value):
+        """Keeps value as the result for what, evicting the least recently used results if needed; returns value."""
+        self._put(what2id(what), value)
+        return value
+
+    def _put(self, key, value):
+        nbytes = self.sizeof(value) if self.max_bytes is not None else 0
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            if self.max_bytes is not None and nbytes > self.max_bytes:
+                return
+            self._entries[key] = value, nbytes
+            self._bytes += nbytes
+            while ((self.max_entries is not None and len(self._entries) > self.max_entries) or
+                   (self.max_bytes is not None and self._bytes > self.max_bytes)):
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self._bytes -= evicted_bytes
+                self._evictions += 1
+
+    def get_or_compute(self, what, compute):
+        """Returns the result for what, computing it with compute() and keeping it if missing.
+
+        N.B. computations run without holding the lock, so concurrent misses for the same id compute it more than once.
+        """
+        key = what2id(what)
+        value = self._get(key)
+        if value is _MISSING:
+            value = compute()
+            self._put(key, value)
+        return value
+
+    def __contains__(self, what):
+        with self._lock:
+            return what2id(what) in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def delete(self, what):
+        """Forgets the result for what, returns False if there was none."""
+        with self._lock:
+            entry = self._entries.pop(what2id(what), None)
+            if entry is None:
+                return False
+            self._bytes -= entry[1]
+            return True
+
+    def clear(self):
+        """Forgets all the results and resets the statistics."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._hits = self._misses = self._evictions = 0
+
+    def stats(self):
+        """Returns a `CacheStats` named tuple (hits, misses, evictions, entries, bytes)."""
+        with self._lock:
+            return CacheStats(self._hits, self._misses, self._evictions, len(self._entries), self._bytes)
+
+    def cached(self, func=None, non_id_keys=None):
+        """Decorates func to keep its results in this cache, keyed by the id of each call (see `call_what`)."""
+        if func is None:
+            return lambda f: self.cached(f, non_id_keys=non_id_keys)
+
+        def cached_func(*args, **kwargs):
+            what = call_what(func, args, kwargs, non_id_keys=non_id_keys)
+            return self.get_or_compute(what.id(), lambda: func(*args, **kwargs))
+
+        cached_func = update_wrapper(cached_func, func)
+        cached_func.cache = self
+        if is_whatable(func):
+            cached_func.what = func.what
+        return cached_func
+
+
+def memoized(func=None, max_entries=128, max_bytes=None, non_id_keys=None, sizeof=None):
+    """Decorator to keep the results of a function in memory, in a `WhatamiLRUCache`.
+
+    Calls are keyed by their id, so arguments do not need to be hashable; for example,
+    numpy arrays are identified by their contents as in their whatami ids.
+
+    Examples
+    --------
+    >>> @memoized(max_entries=2)
+    ... def total(values, scale=1):
+    ...     print('computing')
+    ...     return scale * sum(values)
+    >>> total([1, 2, 3])
+    computing
+    6
+    >>> total([1, 2, 3], scale=1)
+    6
+    >>> print(total.cache.stats())
+    CacheStats(hits=1, misses=1, evictions=0, entries=1, bytes=0)
+    """
+    cache = WhatamiLRUCache(max_entries=max_entries, max_bytes=max_bytes, sizeof=sizeof)
+    if func is None:
+        return cache.cached(non_id_keys=non_id_keys)
+    return cache.cached(func, non_id_keys=non_id_keys)
@@ -0,0 +1,5 @@
+# coding=utf-8
+import sys
+
+# asyncio helpers need python >= 3.5
+collect_ignore = ['aio.py', 'tests/test_aio.py'] if sys.version_info < (3, 5) else []
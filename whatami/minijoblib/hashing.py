@@ -13,6 +13,8 @@ import sys
 import types
 import struct
 import io
+import mmap
+import threading
 
 from ._compat import _bytes_or_unicode, PY3_OR_LATER
 
@@ -61,8 +63,22 @@ class Hasher(Pickler):
                     else pickle.HIGHEST_PROTOCOL)
         Pickler.__init__(self, self.stream, protocol=protocol)
         # Initialise the hash obj
+        self._hash_name = hash_name
         self._hash = hashlib.new(hash_name)
 
+    def reset(self):
+        """ Leaves the hasher as just constructed, so it can be reused
+            to hash another object without paying the setup cost.
+        """
+        self.stream.seek(0)
+        self.stream.truncate()
+        self.clear_memo()
+        # a failed dump can leave a frame open (protocol >= 4)
+        framer = getattr(self, 'framer', None)
+        if framer is not None:
+            framer.current_frame = None
+        self._hash = hashlib.new(self._hash_name)
+
     def hash(self, obj, return_digest=True):
         try:
             self.dump(obj)
@@ -188,38 +204,12 @@ class NumpyHasher(Hasher):
         """
         if isinstance(obj, self.np.ndarray) and not obj.dtype.hasobject:
             # Compute a hash of the object
-            # The update function of the hash requires a c_contiguous buffer.
-            if obj.shape == ():
-                # 0d arrays need to be flattened because viewing them as bytes
-                # raises a ValueError exception.
-                obj_c_contiguous = obj.flatten()
-            elif obj.flags.c_contiguous:
-                obj_c_contiguous = obj
-            elif obj.flags.f_contiguous:
-                obj_c_contiguous = obj.T
-            else:
-                # Cater for non-single-segment arrays: this creates a
-                # copy, and thus aleviates this issue.
-                # XXX: There might be a more efficient way of doing this
-                obj_c_contiguous = obj.flatten()
-
-            # memoryview is not supported for some dtypes, e.g. datetime64, see
-            # https://github.com/numpy/numpy/issues/4983. The
-            # workaround is to view the array as bytes before
-            # taking the memoryview.
-            self._hash.update(
-                self._getbuffer(obj_c_contiguous.view(self.np.uint8)))
+            self._update_hash_array(obj)
 
             # We store the class, to be able to distinguish between
             # Objects with the same binary content, but different
             # classes.
-            if self.coerce_mmap and isinstance(obj, self.np.memmap):
-                # We don't make the difference between memmap and
-                # normal ndarrays, to be able to reload previously
-                # computed results with memmap.
-                klass = self.np.ndarray
-            else:
-                klass = obj.__class__
+            klass = self._array_class(obj)
             # We also return the dtype and the shape, to distinguish
             # different views on the same data with different dtypes.
 
@@ -241,6 +231,77 @@ class NumpyHasher(Hasher):
             obj = (klass, ('HASHED', obj.descr))
         Hasher.save(self, obj)
 
+    def _array_class(self, obj):
+        if self.coerce_mmap and isinstance(obj, self.np.memmap):
+            # We don't make the difference between memmap and
+            # normal ndarrays, to be able to reload previously
+            # computed results with memmap.
+            return self.np.ndarray
+        return obj.__class__
+
+    def _update_hash_array(self, obj):
+        # The update function of the hash requires a c_contiguous buffer.
+        if obj.shape == ():
+            # 0d arrays need to be flattened because viewing them as bytes
+            # raises a ValueError exception.
+            obj_c_contiguous = obj.flatten()
+        elif obj.flags.c_contiguous:
+            obj_c_contiguous = obj
+        elif obj.flags.f_contiguous:
+            obj_c_contiguous = obj.T
+        else:
+            # Cater for non-single-segment arrays: this creates a
+            # copy, and thus aleviates this issue.
+            # XXX: There might be a more efficient way of doing this
+            obj_c_contiguous = obj.flatten()
+
+        # memoryview is not supported for some dtypes, e.g. datetime64, see
+        # https://github.com/numpy/numpy/issues/4983. The
+        # workaround is to view the array as bytes before
+        # taking the memoryview.
+        self._update_hash_windowed(obj, obj_c_contiguous.view(self.np.uint8))
+
+    # whatami: the pickle of a top level array metadata only depends on its class,
+    # dtype, shape and strides; caching it skips the (pure python, slow) pickler
+    _METADATA_DUMPS = {}
+    _METADATA_DUMPS_MAX_SIZE = 4096
+
+    def hash(self, obj, return_digest=True):
+        if (not isinstance(obj, self.np.ndarray) or obj.dtype.hasobject or
+                self.stream.tell() != 0):
+            return Hasher.hash(self, obj, return_digest=return_digest)
+        key = (self._array_class(obj), obj.dtype, str(obj.dtype.descr),
+               obj.shape, obj.strides, self.proto)
+        dumps = self._METADATA_DUMPS.get(key)
+        if dumps is None:
+            digest = Hasher.hash(self, obj, return_digest=return_digest)
+            if len(self._METADATA_DUMPS) >= self._METADATA_DUMPS_MAX_SIZE:
+                self._METADATA_DUMPS.clear()
+            self._METADATA_DUMPS[key] = self.stream.getvalue()
+            return digest
+        self._update_hash_array(obj)
+        self._hash.update(dumps)
+        if return_digest:
+            return self._hash.hexdigest()
+
+    # whatami: hash big buffers by bounded windows, so memmaps are read sequentially
+    # (the digest is the same as updating with the whole buffer at once)
+    window_bytes = 1 << 24
+
+    def _update_hash_windowed(self, obj, bytes_view):
+        flat = bytes_view.reshape(-1)
+        if flat.size <= self.window_bytes:
+            self._hash.update(self._getbuffer(flat))
+            return
+        mm = getattr(obj, '_mmap', None)
+        if mm is not None and hasattr(mm, 'madvise'):
+            try:
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            except (AttributeError, ValueError, OSError):  # pragma: no cover
+                pass
+        for start in range(0, flat.size, self.window_bytes):
+            self._hash.update(self._getbuffer(flat[start:start + self.window_bytes]))
+
 
 def hasher(obj, hash_name='md5', coerce_mmap=False):
     """ Quick calculation of a hash to identify uniquely Python objects
@@ -255,8 +316,25 @@ def hasher(obj, hash_name='md5', coerce_mmap=False):
         coerce_mmap: boolean
             Make no difference between np.memmap and np.ndarray
     """
-    if 'numpy' in sys.modules:
+    # whatami: reuse hashers from a per-thread pool; hashing can be reentrant
+    # (e.g. unorderable sets), so each nested call takes its own hasher
+    key = ('numpy' in sys.modules, hash_name, coerce_mmap)
+    try:
+        pools = _HASHERS_POOL.pools
+    except AttributeError:
+        pools = _HASHERS_POOL.pools = {}
+    pool = pools.setdefault(key, [])
+    if pool:
+        hasher = pool.pop()
+    elif key[0]:
         hasher = NumpyHasher(hash_name=hash_name, coerce_mmap=coerce_mmap)
     else:
         hasher = Hasher(hash_name=hash_name)
-    return hasher.hash(obj)
+    try:
+        return hasher.hash(obj)
+    finally:
+        hasher.reset()
+        pool.append(hasher)
+
+
+_HASHERS_POOL = threading.local()
@@ -14,6 +14,7 @@ from functools import partial
 from itertools import chain
 import datetime
 import inspect
+import sys
 from importlib import import_module
 from collections import OrderedDict
 from socket import gethostname
@@ -694,31 +695,37 @@ def decorate_some(name='DecorateSome', **decorators):
 # See also: https://snarky.ca/lazy-importing-in-python-3-7/
 #           https://github.com/mnmelo/lazy_import
 
-class _LazyImportError(object):
-    """Defer ImportError raising to when a module is actually used, giving human hints on installation."""
+class _LazyModule(object):
+    """Defer importing a module to when it is actually used, giving human hints on installation if it fails."""
     def __init__(self, library_name, install_msg=None, *variants):
-        super(_LazyImportError, self).__init__()
+        super(_LazyModule, self).__init__()
         # Bookkeeping
         self._library_name = library_name
-        self._variants = variants
+        self._variants = variants if variants else (library_name,)
         self._errors = []
-        # Try to import
-        self.module = self
-        if not variants:
-            variants = [self._library_name]
-        for variant in variants:
-            try:
-                self.module = import_module(variant)
-            except ImportError as ie:
-                self._errors.append((variant, ie))
+        self._module = None
         # Autogenerate install hint
         if install_msg in ('conda', 'pip'):
-            install_msg = '%s install %s' % (install_msg, variants[0])
+            install_msg = '%s install %s' % (install_msg, self._variants[0])
         self._install_msg = install_msg
 
-    def __getattribute__(self, name):
-        if name in ('_library_name', '_install_msg', '_errors', '_maybe_import', 'module', '_variants'):
-            return super(_LazyImportError, self).__getattribute__(name)  # pragma: no cover
+    def _load(self):
+        if self._module is None:
+            errors = []
+            for variant in self._variants:
+                try:
+                    self._module = import_module(variant)
+                    break
+                except ImportError as ie:
+                    errors.append((variant, ie))
+            self._errors = errors
+        return self._module
+
+    def __getattr__(self, name):
+        # Only called for attributes not found in the proxy itself
+        module = self._load()
+        if module is not None:
+            return getattr(module, name)
         errors_msg = '\n'.join(['\timport %s: %s' % (variant, str(ie)) for variant, ie in self._errors])
         if self._install_msg is not None:
             raise ImportError('Trying to access %s from module %s, but the library fails to import.\n'
@@ -730,9 +737,28 @@ class _LazyImportError(object):
                               'Errors: \n%s\n' %
                               (name, self._library_name, errors_msg))
 
+    def __repr__(self):
+        return '<lazy module %r (variants %r)>' % (self._library_name, self._variants)
+
+
+def _find_module(name):
+    """Returns True iff a module can be found (but not necessarily imported) without importing it."""
+    try:
+        from importlib.util import find_spec
+    except ImportError:  # pragma: no cover
+        from pkgutil import find_loader as find_spec
+    try:
+        return find_spec(name) is not None
+    except (ImportError, ValueError, AttributeError):  # pragma: no cover
+        return False
+
 
 def maybe_import(library_name, install_msg=None, *variants):
-    """Tries to import a module but do not fails immediatly if there is a problem.
+    """Lazily imports a module, not failing until (and unless) it is actually used.
+
+    If a variant is already imported, it is returned as is. Otherwise a proxy is returned,
+    importing the first available variant on first attribute access.
+    To check whether a module is in use without importing it, look it up in `sys.modules`.
 
     Parameters
     ----------
@@ -746,15 +772,21 @@ def maybe_import(library_name, install_msg=None, *variants):
       If 'pip' or 'conda', a generic install message with the first variant will be generated.
 
     variants : strings
-      Different module names that provide the same functionality.
+      Different module names that provide the same functionality, in order of preference.
 
     Examples
     --------
-    This will try to kinda lazily import toolz, prioritizing cytoolz:
-      toolz = LazyImportError.maybe_import(toolz, install_msg='conda', 'cytoolz', 'toolz')
+    This will lazily import toolz, prioritizing cytoolz:
+      toolz = maybe_import('toolz', 'conda', 'cytoolz', 'toolz')
     """
-    lie = _LazyImportError(library_name, install_msg, *variants)
-    return lie.module
+    candidates = variants if variants else (library_name,)
+    for i, variant in enumerate(candidates):
+        module = sys.modules.get(variant)
+        if module is not None:
+            return module
+        if _find_module(variant):
+            return _LazyModule(library_name, install_msg, *candidates[i:])
+    return _LazyModule(library_name, install_msg, *candidates)
 
 
 def maybe_import_member(member_fqn, fail_if_import_error=True, install_msg=None, *variants):
@@ -5,8 +5,13 @@
 # Licence: BSD 3 clause
 
 from __future__ import print_function, absolute_import, unicode_literals  # N.B. arpeggio wants unicode
-from arpeggio import ParserPython, Optional, ZeroOrMore, StrMatch, RegExMatch, EOF, PTNodeVisitor, visit_parse_tree
+import threading
+import warnings
+
 from whatami import maybe_import
+from whatami.what import _intern
+
+# N.B. arpeggio is only imported when parsing is first needed, so processes that just generate ids start faster
 
 
 def build_whatami_parser(reduce_tree=False, debug=False):
@@ -27,6 +32,7 @@ def build_whatami_parser(reduce_tree=False, debug=False):
     -------
     The arpeggio parser. Call `parser.parse` to generate the AST.
     """
+    from arpeggio import ParserPython, Optional, ZeroOrMore, StrMatch, RegExMatch, EOF
 
     # Syntactic noise
 
@@ -120,9 +126,15 @@ def build_whatami_parser(reduce_tree=False, debug=False):
     return ParserPython(whatami_id_top, reduce_tree=reduce_tree, debug=debug)
 
 
-class WhatamiTreeVisitor(PTNodeVisitor):
+_ARPEGGIO_VISITOR_CLASSES = {}
+
+
+class WhatamiTreeVisitor(object):
     """A tree visitor for whatami id ASTs that returns a `whatami.What` object.
 
+    Instances (also of subclasses) are `arpeggio.PTNodeVisitor` instances too; to defer
+    importing arpeggio, the actual visitor classes are created on first instantiation.
+
     Parameters
     ----------
     debug : boolean, default False
@@ -133,6 +145,20 @@ class WhatamiTreeVisitor(PTNodeVisitor):
     A `whatami.What` object inferred from the id string.
     """
 
+    def __new__(cls, *args, **kwargs):
+        try:
+            visitor_class = _ARPEGGIO_VISITOR_CLASSES[cls]
+        except KeyError:
+            from arpeggio import PTNodeVisitor
+            if issubclass(cls, PTNodeVisitor):
+                visitor_class = cls
+            else:
+                visitor_class = type(cls.__name__, (cls, PTNodeVisitor), {'__module__': cls.__module__})
+            # N.B. setdefault, so concurrent first instantiations agree on the class
+            visitor_class = _ARPEGGIO_VISITOR_CLASSES.setdefault(cls, visitor_class)
+            _ARPEGGIO_VISITOR_CLASSES.setdefault(visitor_class, visitor_class)
+        return object.__new__(visitor_class)
+
     def __init__(self, debug=False):
         # N.B. these actions assume that syntactic noise is being ignored, therefore defaults=True
         super(WhatamiTreeVisitor, self).__init__(defaults=True, debug=debug)
@@ -141,7 +167,8 @@ class WhatamiTreeVisitor(PTNodeVisitor):
 
     @staticmethod
     def visit_an_id(node, _):
-        return node.value
+        # names and keys repeat a lot, share them
+        return _intern(node.value)
 
     @staticmethod
     def visit_a_number(node, _):
@@ -260,8 +287,58 @@ class WhatamiTreeVisitor(PTNodeVisitor):
         return children[0]
 
 
-DEFAULT_WHATAMI_PARSER = build_whatami_parser()
-DEFAULT_WHATAMI_VISITOR = WhatamiTreeVisitor()
+# Arpeggio parsers and visitors keep state while parsing,
+# so each thread gets its own default parser and visitor, built on first use
+_THREAD_DEFAULTS = threading.local()
+
+
+def default_whatami_parser():
+    """Returns the default parser for the calling thread."""
+    parser = getattr(_THREAD_DEFAULTS, 'parser', None)
+    if parser is None:
+        parser = _THREAD_DEFAULTS.parser = build_whatami_parser()
+    return parser
+
+
+def default_whatami_visitor():
+    """Returns the default visitor for the calling thread."""
+    visitor = getattr(_THREAD_DEFAULTS, 'visitor', None)
+    if visitor is None:
+        visitor = _THREAD_DEFAULTS.visitor = WhatamiTreeVisitor()
+    return visitor
+
+
+class _ThreadDefault(object):
+    """Stand-in for a former module level default parser or visitor, now one per thread.
+
+    Attribute accesses (e.g. `parse`) are forwarded to the default of the calling thread,
+    returned by `factory`, with a DeprecationWarning.
+    """
+
+    __slots__ = ('_name', '_factory', '_instead')
+
+    def __init__(self, name, factory, instead):
+        super(_ThreadDefault, self).__init__()
+        self._name = name
+        self._factory = factory
+        self._instead = instead
+
+    def __getattr__(self, attr):
+        if attr.startswith('__') or attr in _ThreadDefault.__slots__:
+            raise AttributeError(attr)
+        warnings.warn('%s is deprecated, use %s instead' % (self._name, self._instead),
+                      DeprecationWarning, stacklevel=2)
+        return getattr(self._factory(), attr)
+
+    def __repr__(self):
+        return '<%s, deprecated, now per thread>' % self._name
+
+
+# Deprecated, use default_whatami_parser() and default_whatami_visitor()
+DEFAULT_WHATAMI_PARSER = _ThreadDefault('DEFAULT_WHATAMI_PARSER', default_whatami_parser,
+                                        'default_whatami_parser()')
+DEFAULT_WHATAMI_VISITOR = _ThreadDefault('DEFAULT_WHATAMI_VISITOR', default_whatami_visitor,
+                                         'default_whatami_visitor()')
 
 
 def parse_whatid(id_string, parser=None, visitor=None):
@@ -276,10 +353,13 @@ def parse_whatid(id_string, parser=None, visitor=None):
 
     parser : An arpeggio parser or None
       The parser. Use None to use the default parser.
+      The default parser is thread-local, so parse_whatid can be called concurrently;
+      provided parsers must not be used concurrently.
 
     visitor : An arpeggio visitor or None.
       Semantic actions over the AST.
       If None, the default visitor (that returns a What object) is used.
+      As parsers, the default visitor is thread-local.
 
     Returns
     -------
@@ -297,23 +377,24 @@ def parse_whatid(id_string, parser=None, visitor=None):
     >>> print(what.conf['n_jobs'].conf['here'])
     100
     """
-    global DEFAULT_WHATAMI_PARSER
-    if parser is None:
-        parser = DEFAULT_WHATAMI_PARSER
-    if visitor is None:
-        visitor = DEFAULT_WHATAMI_VISITOR
+    from arpeggio import visit_parse_tree
+    if parser is None or parser is DEFAULT_WHATAMI_PARSER:
+        parser = default_whatami_parser()
+    if visitor is None or visitor is DEFAULT_WHATAMI_VISITOR:
+        visitor = default_whatami_visitor()
     try:
         return visit_parse_tree(parser.parse(id_string), visitor=visitor)
     except TypeError:
         # Remove this once arpeggio is released with this fix:
         # https://github.com/igordejanovic/Arpeggio/pull/21
-        DEFAULT_WHATAMI_PARSER = build_whatami_parser()
+        _THREAD_DEFAULTS.parser = None
         raise
 
 # --- Maintenance for old whatami id strings
 
 
 def build_oldwhatami_parser(reduce_tree=False, debug=False):
+    from arpeggio import ParserPython, Optional, ZeroOrMore, StrMatch, RegExMatch, EOF
 
     # Unfortunately this is an almost verbatim copy & paste of "build_whatami_parser"
     # It is hard to avoid code duplication here:
@@ -6,9 +6,17 @@
 from __future__ import print_function, absolute_import
 from future.utils import string_types, PY2
 
+import binascii
+import hashlib
 import inspect
+import mmap
+import os
+import re
+import sys
 from collections import OrderedDict
+from contextlib import contextmanager
 from functools import partial
+import threading
 
 from whatami import getargspec, is_whatable
 
@@ -61,6 +69,77 @@ def property_plugin(v):
         raise Exception('Dynamic properties are not suppported.')
 
 
+def _collection_string(kind, strings, num_elements, opener, closer):
+    """Renders opener + ','.join(strings) + closer, or a digest "kind(hash='xxx',len=n)" if too large.
+
+    The size limits are `WhatamiPluginManager.MAX_COLLECTION_ELEMENTS` and `MAX_COLLECTION_BYTES`.
+    The digest is the md5 of the full rendered string, computed in one pass over the element strings,
+    without building the full string in memory.
+    """
+    rendering = _RENDERING
+    if rendering.subtrees is None:
+        return _summarized_collection_string(kind, strings, num_elements, opener, closer)[0]
+    # Abbreviating: summaries are decided on the full strings, otherwise the collection is a subtree
+    strings = list(strings)
+    string, summarized = _summarized_collection_string(kind, map(rendering.expand, strings), num_elements,
+                                                       opener, closer)
+    if summarized:
+        return string
+    return rendering.capture(opener + ','.join(strings) + closer, kind, num_elements)
+
+
+def _summarized_collection_string(kind, strings, num_elements, opener, closer):
+    """Returns a tuple (string, summarized), see `_collection_string`."""
+    max_elements = WhatamiPluginManager.MAX_COLLECTION_ELEMENTS
+    max_bytes = WhatamiPluginManager.MAX_COLLECTION_BYTES
+    if max_elements is None and max_bytes is None:
+        return opener + ','.join(strings) + closer, False
+    digest = None
+    if max_elements is not None and num_elements > max_elements:
+        digest = hashlib.md5(opener.encode('utf-8'))
+    parts = []
+    size = len(opener) + len(closer)
+    for i, string in enumerate(strings):
+        if digest is not None:
+            if i:
+                digest.update(b',')
+            digest.update(string.encode('utf-8'))
+            continue
+        parts.append(string)
+        size += len(string.encode('utf-8')) + (1 if i else 0)
+        if max_bytes is not None and size > max_bytes:
+            digest = hashlib.md5((opener + ','.join(parts)).encode('utf-8'))
+            parts = None
+    if digest is None:
+        return opener + ','.join(parts) + closer, False
+    digest.update(closer.encode('utf-8'))
+    return "%s(hash='%s',len=%d)" % (kind, digest.hexdigest(), num_elements), True
+
+
+def _sorted_strings(strings):
+    """Sorts id strings; while abbreviating, by their full strings, so that ids do not change."""
+    rendering = _RENDERING
+    if rendering.subtrees is None:
+        return sorted(strings)
+    return sorted(strings, key=rendering.expand)
+
+
+@contextmanager
+def _full_rendering():
+    """Context manager to render full id strings (e.g. to hash them) even while abbreviating."""
+    rendering = _RENDERING
+    if rendering.subtrees is None:
+        yield
+        return
+    # N.B. memoized strings have placeholders
+    saved = rendering.memo, rendering.subtrees
+    rendering.memo, rendering.subtrees = {}, None
+    try:
+        yield
+    finally:
+        rendering.memo, rendering.subtrees = saved
+
+
 def dict_plugin(v):
     """Returns an id for dictionaries, sorting the keys for unique id (except for OrderedDict).
     Any custom representation for a dictionary subclass must precede this plugin in the plugins chain.
@@ -73,7 +152,7 @@ def dict_plugin(v):
         kvs = ['%s:%s' % (WhatamiPluginManager.build_string(dict_k),
                           WhatamiPluginManager.build_string(dict_v))
                for dict_k, dict_v in v.items()]
-        id_string = '{%s}' % ','.join(sorted(kvs))
+        id_string = _collection_string('dict', _sorted_strings(kvs), len(kvs), '{', '}')
         if type(v) == dict:
             return id_string
         return whatareyou(v).id()
@@ -82,10 +161,12 @@ def dict_plugin(v):
 def set_plugin(v):
     """Generates an id for python sets and frozensets, sorting the elements for id uniqueness."""
     if isinstance(v, (set, frozenset)):
-        elements = sorted(map(WhatamiPluginManager.build_string, v))
+        elements = _sorted_strings(map(WhatamiPluginManager.build_string, v))
         if type(v) == frozenset:
-            return 'frozenset({%s})' % ','.join(elements) if elements else 'frozenset()'
-        id_string = '{%s}' % ','.join(elements) if len(elements) > 0 else 'set()'
+            if not elements:
+                return 'frozenset()'
+            return _collection_string('frozenset', elements, len(elements), 'frozenset({', '})')
+        id_string = _collection_string('set', elements, len(elements), '{', '}') if len(elements) > 0 else 'set()'
         if type(v) == set:
             return id_string
         return '%s(seq=%s)' % (v.__class__.__name__, id_string)
@@ -94,7 +175,7 @@ def set_plugin(v):
 def list_plugin(v):
     """Generate a unique id for lists."""
     if isinstance(v, list):
-        id_string = '[%s]' % ','.join(map(WhatamiPluginManager.build_string, v))
+        id_string = _collection_string('list', map(WhatamiPluginManager.build_string, v), len(v), '[', ']')
         if type(v) == list:
             return id_string
         return '%s(seq=%s)' % (v.__class__.__name__, id_string)
@@ -103,7 +184,7 @@ def list_plugin(v):
 def tuple_plugin(v):
     """Generate a unique id for tuples."""
     if isinstance(v, tuple):
-        id_string = '(%s)' % ','.join(map(WhatamiPluginManager.build_string, v))
+        id_string = _collection_string('tuple', map(WhatamiPluginManager.build_string, v), len(v), '(', ')')
         if type(v) == tuple:
             return id_string
         return '%s(seq=%s)' % (v.__class__.__name__, id_string)
@@ -179,7 +260,8 @@ def anyobject0x_plugin(v, deep=False):
 
     deep : boolean, default False
       If True, an id string will be generated recursively for all members of v
-      Note that this is quite unsafe and we do not check for circular recursion.
+      Note that this can be slow for big object graphs; cycles and depth are
+      handled as configured in `WhatamiPluginManager.limit_recursion`.
     """
     if ' at 0x' in str(v):
         if deep:
@@ -203,35 +285,95 @@ np = maybe_import('numpy', 'conda')
 
 
 def has_numpy():
-    """Returns True iff numpy can be imported."""
-    return inspect.ismodule(np)
+    """Returns True iff numpy can be imported (importing it)."""
+    try:
+        return np.ndarray is not None
+    except ImportError:
+        return False
 
 
 pd = maybe_import('pandas', 'conda')
 
 
 def has_pandas():
-    """Returns True iff pandas can be imported."""
-    return pd is not None
+    """Returns True iff pandas can be imported (importing it)."""
+    try:
+        return pd.DataFrame is not None
+    except ImportError:
+        return False
 
 
 def numpy_plugin(v):
     """Represents numpy arrays as "class(hash='xxx')"."""
-    if np is not None and hasher is not None:
+    if 'numpy' in sys.modules and hasher is not None:
         if isinstance(v, np.ndarray):
             return "%s(hash='%s')" % (v.__class__.__name__, hasher(v))
 
 
-def rng_plugin(v):
-    """Represents a numpy rng as a string RandomState(state=xxx)."""
-    if np is not None and hasher is not None:
+def memmap_plugin(v):
+    """Represents read-only numpy memmaps exactly like `numpy_plugin`, but caching their hashes.
+
+    The cache is keyed on the mapped file metadata (see `file_digest`), so unchanged files are not re-read.
+    Views and writable memmaps are left to `numpy_plugin`, as their contents can differ from the file.
+    """
+    if 'numpy' in sys.modules and hasher is not None:
+        if isinstance(v, np.memmap) and v.mode == 'r' and isinstance(v.base, mmap.mmap) and v.filename:
+            key = (_file_key(v.filename), 'memmap', v.offset, v.dtype.str, v.shape, v.strides)
+            digest = _cached_file_digest(key)
+            if digest is None:
+                digest = _remember_file_digest(key, hasher(v))
+            return "%s(hash='%s')" % (v.__class__.__name__, digest)
+
+
+def rng_plugin(v, compact=False):
+    """Represents numpy random number generators.
+
+    Parameters
+    ----------
+    v : object
+      The object to represent as an id string
+
+    compact : boolean, default False
+      If False, a RandomState is represented as "RandomState(state=xxx)", with the state fully expanded.
+      If True, a RandomState is represented by the digest of its state, plus its position in the
+      Mersenne Twister key, as "RandomState(pos=624,state='xxx')"; this is much shorter, and faster
+      to build and parse.
+
+    Newer numpy Generators and BitGenerators are always represented by the digest of their state dicts,
+    as "Generator(bit_generator=PCG64(state='xxx'))" (BitGenerators with a position, like MT19937,
+    get a "pos" too).
+    """
+    if 'numpy' in sys.modules and hasher is not None:
         if isinstance(v, np.random.RandomState):
+            if compact:
+                state = v.get_state()
+                return "%s(pos=%d,state='%s')" % (v.__class__.__name__, state[2], hasher(state))
             return "%s(state=%s)" % (v.__class__.__name__, whatareyou(v.__getstate__()).id())
+        if isinstance(v, getattr(np.random, 'Generator', ())):
+            return '%s(bit_generator=%s)' % (v.__class__.__name__, rng_plugin(v.bit_generator))
+        if isinstance(v, getattr(np.random, 'BitGenerator', ())):
+            state = v.state
+            pos = state.get('state', {}).get('pos') if isinstance(state.get('state'), dict) else None
+            if pos is not None:
+                return "%s(pos=%d,state='%s')" % (v.__class__.__name__, pos, hasher(state))
+            return "%s(state='%s')" % (v.__class__.__name__, hasher(state))
+
+
+def compact_rng_plugin(v):
+    """Like `rng_plugin` in compact mode; use it to replace `rng_plugin` in the plugin chain.
+
+    Examples
+    --------
+    >>> WhatamiPluginManager.insert(compact_rng_plugin, before=rng_plugin)
+    >>> WhatamiPluginManager.drop(rng_plugin)
+    >>> WhatamiPluginManager.reset()
+    """
+    return rng_plugin(v, compact=True)
 
 
 def pandas_plugin(v):
     """Represents pandas objects as any of "DataFrame(hash='xxx')" or "Series(hash='xxx')"."""
-    if pd is not None and hasher is not None:
+    if 'pandas' in sys.modules and hasher is not None:
         if isinstance(v, (pd.DataFrame, pd.Series)):
             return "%s(hash='%s')" % (v.__class__.__name__, hasher(v))
     #
@@ -239,11 +381,445 @@ def pandas_plugin(v):
     # ABI it should repay to create an spesialised pandas plugin that just
     # cast indices and data as arrays and use these to generate IDs that
     # are stable between pandas versions.
+    # That is pandas_columnar_plugin; it is not the default to keep ids stable.
     #
 
 
+# Frames with at least these many columns get their columns hashed in parallel
+PANDAS_PARALLEL_COLUMNS = 64
+
+
+def _thread_pool_executor():
+    """Returns concurrent.futures.ThreadPoolExecutor, or None if not available; imported on first use."""
+    try:
+        from concurrent.futures import ThreadPoolExecutor
+    except ImportError:  # pragma: no cover
+        return None
+    return ThreadPoolExecutor
+
+
+def _pandas_array_digest(values, hash_name='md5'):
+    """Returns the digest of a column or index, from its raw buffer if numeric, else via pandas hashing."""
+    digest = hashlib.new(hash_name)
+    dtype = getattr(values, 'dtype', None)
+    if isinstance(dtype, np.dtype) and dtype.kind in 'biufcmM':
+        array = np.ascontiguousarray(values.to_numpy() if hasattr(values, 'to_numpy') else values.values)
+        digest.update(dtype.str.encode('utf-8'))
+        digest.update(memoryview(array.reshape(-1).view(np.uint8)))
+    else:
+        if isinstance(values, pd.Series):
+            hashed = pd.util.hash_pandas_object(values, index=False)
+        else:
+            hashed = pd.util.hash_pandas_object(values)
+        digest.update(b'hashed')
+        digest.update(memoryview(np.ascontiguousarray(hashed.values, dtype='<u8').view(np.uint8)))
+    return digest.digest()
+
+
+def pandas_digest(v, hash_name='md5', parallel_columns=PANDAS_PARALLEL_COLUMNS):
+    """Returns a hexdigest for a pandas DataFrame or Series that does not depend on pickling.
+
+    The index and each column are hashed as arrays (raw buffers for numeric dtypes,
+    `pd.util.hash_pandas_object` otherwise) and the digests combined in frame order,
+    together with the column names, the index names and the dtypes.
+
+    Parameters
+    ----------
+    v : pandas DataFrame or Series
+      The object to hash.
+
+    hash_name : string, default 'md5'
+      The hashlib algorithm to use.
+
+    parallel_columns : int, default `PANDAS_PARALLEL_COLUMNS`
+      Hash columns using a thread pool if the frame has at least these many columns.
+      If None or non positive, never use threads.
+    """
+    if isinstance(v, pd.Series):
+        names, columns = [v.name], [v]
+    else:
+        names, columns = list(v.columns), [v.iloc[:, i] for i in range(v.shape[1])]
+    column_digest = partial(_pandas_array_digest, hash_name=hash_name)
+    pool = _thread_pool_executor() if parallel_columns and 0 < parallel_columns <= len(columns) else None
+    if pool is not None:
+        from multiprocessing import cpu_count
+        with pool(max_workers=min(32, cpu_count() + 4)) as executor:
+            column_digests = list(executor.map(column_digest, columns))
+    else:
+        column_digests = list(map(column_digest, columns))
+    digest = hashlib.new(hash_name)
+    with _full_rendering():
+        header = '%s(index_names=%s,names=%s,dtypes=%s)' % (
+            v.__class__.__name__,
+            WhatamiPluginManager.build_string(list(v.index.names)),
+            WhatamiPluginManager.build_string(names),
+            WhatamiPluginManager.build_string([str(column.dtype) for column in columns]))
+    digest.update(header.encode('utf-8'))
+    digest.update(column_digest(v.index))
+    for a_digest in column_digests:
+        digest.update(a_digest)
+    return digest.hexdigest()
+
+
+def pandas_columnar_plugin(v):
+    """Represents pandas objects as "DataFrame(hash='xxx')" or "Series(hash='xxx')", hashing them by columns.
+
+    As opposed to `pandas_plugin`, hashes do not depend on pickling and so should be stable
+    across pandas versions, and are faster to compute for wide frames (see `pandas_digest`).
+    Hashes are different to these of `pandas_plugin`, so it is not in the default chain.
+    Activate it with `WhatamiPluginManager.insert(pandas_columnar_plugin, before=pandas_plugin)`.
+    """
+    if 'pandas' in sys.modules:
+        if isinstance(v, (pd.DataFrame, pd.Series)):
+            return "%s(hash='%s')" % (v.__class__.__name__, pandas_digest(v))
+
+
+# --- Files and memory maps
+
+# Digests of file contents, keyed by (path, size, mtime, inode, device) plus whatever else determines the digest,
+# least recently used first
+_FILE_DIGESTS = OrderedDict()
+_FILE_DIGESTS_LOCK = threading.Lock()
+FILE_DIGESTS_MAX_SIZE = 4096
+
+# Files are read sequentially, in windows of this size
+FILE_HASH_WINDOW = 1 << 24
+
+
+def _file_key(path):
+    """Returns a tuple (realpath, size, mtime, inode, device) that changes whenever the file is likely to change."""
+    path = os.path.realpath(path)
+    st = os.stat(path)
+    return path, st.st_size, getattr(st, 'st_mtime_ns', st.st_mtime), st.st_ino, st.st_dev
+
+
+def _cached_file_digest(key):
+    """Returns the cached digest for key, or None if it is not cached."""
+    with _FILE_DIGESTS_LOCK:
+        digest = _FILE_DIGESTS.pop(key, None)
+        if digest is not None:
+            _FILE_DIGESTS[key] = digest
+        return digest
+
+
+def _remember_file_digest(key, digest):
+    """Caches digest for key, forgetting digests of previous versions of the file and the least recently used ones."""
+    file_key = key[0]
+    with _FILE_DIGESTS_LOCK:
+        for stale in [k for k in _FILE_DIGESTS if k[0][0] == file_key[0] and k[0] != file_key]:
+            del _FILE_DIGESTS[stale]
+        _FILE_DIGESTS[key] = digest
+        while len(_FILE_DIGESTS) > FILE_DIGESTS_MAX_SIZE:
+            _FILE_DIGESTS.popitem(last=False)
+    return digest
+
+
+def file_digest(path, hash_name='md5', window=FILE_HASH_WINDOW):
+    """Returns the hexdigest of the contents of a file, reading it sequentially by bounded windows.
+
+    Digests are cached on the file (path, size, mtime, inode) so unchanged files are not re-read.
+    The cache keeps up to `FILE_DIGESTS_MAX_SIZE` digests, and only those of the current version of each file.
+
+    Parameters
+    ----------
+    path : string
+      The path to the file.
+
+    hash_name : string, default 'md5'
+      The hashlib algorithm to use.
+
+    window : int, default `FILE_HASH_WINDOW`
+      How many bytes are read at a time.
+    """
+    key = (_file_key(path), 'file', hash_name)
+    digest = _cached_file_digest(key)
+    if digest is not None:
+        return digest
+    digest = hashlib.new(hash_name)
+    with open(path, 'rb') as reader:
+        if hasattr(os, 'posix_fadvise'):
+            try:
+                os.posix_fadvise(reader.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            except OSError:  # pragma: no cover
+                pass
+        buf = bytearray(window)
+        view = memoryview(buf)
+        while True:
+            n = reader.readinto(buf)
+            if not n:
+                break
+            digest.update(view[:n])
+    return _remember_file_digest(key, digest.hexdigest())
+
+
+def clear_file_digests():
+    """Empties the file digests cache."""
+    _FILE_DIGESTS.clear()
+
+
+try:
+    from pathlib import PurePath as _PurePath
+except ImportError:  # pragma: no cover
+    _PurePath = None
+
+
+def path_plugin(v):
+    """Represents pathlib paths by the contents of the file they point to, "PosixPath(hash='xxx')".
+
+    This is not in the default chain, as it changes the meaning of paths in configurations.
+    Use `WhatamiPluginManager.insert(path_plugin)` to activate it.
+    """
+    if _PurePath is not None and isinstance(v, _PurePath):
+        return "%s(hash='%s')" % (v.__class__.__name__, file_digest(str(v)))
+
+
 # --- Plugin management
 
+# --- Plugin chains
+
+try:
+    from contextvars import ContextVar
+except ImportError:  # pragma: no cover
+    class ContextVar(object):
+        """Minimal thread-local stand-in for `contextvars.ContextVar` (python < 3.7)."""
+
+        def __init__(self, name, default=None):
+            self.name = name
+            self._default = default
+            self._local = threading.local()
+
+        def get(self):
+            return getattr(self._local, 'value', self._default)
+
+        def set(self, value):
+            token = self.get()
+            self._local.value = value
+            return token
+
+        def reset(self, token):
+            self._local.value = token
+
+
+# Exact types for which the plugins in _TYPE_PURE_PLUGINS accept or reject values based only on their type
+_DISPATCHABLE_TYPES = frozenset([type(None), bool, int, float, complex, str, type(u''),
+                                 list, tuple, dict, set, frozenset, What] +
+                                ([long] if PY2 else []))  # noqa
+
+# N.B. anyobject0x_plugin is pure for _DISPATCHABLE_TYPES, as no such value reaching it contains " at 0x"
+_TYPE_PURE_PLUGINS = frozenset([
+    what_plugin, whatable_plugin, builtin_plugin, numeric_type_plugin, property_plugin,
+    string_plugin, tuple_plugin, list_plugin, dict_plugin, set_plugin,
+    partial_plugin, function_plugin,
+    pandas_plugin, pandas_columnar_plugin, memmap_plugin, numpy_plugin, rng_plugin, compact_rng_plugin,
+    path_plugin, anyobject0x_plugin, anyobject_plugin,
+])
+
+
+class _PluginChain(object):
+    """An immutable tuple of plugins, with a cache of where to start the search for some value types.
+
+    For values of a type in _DISPATCHABLE_TYPES, if a plugin gets selected and all the plugins
+    before it are type-pure, later values of the same type start the search on that plugin.
+    """
+
+    __slots__ = ('plugins', '_dispatch', '_num_pure')
+
+    def __init__(self, plugins):
+        super(_PluginChain, self).__init__()
+        self.plugins = tuple(plugins)
+        self._dispatch = {}
+        self._num_pure = 0
+        for plugin in self.plugins:
+            if plugin not in _TYPE_PURE_PLUGINS:
+                break
+            self._num_pure += 1
+
+    def build_string(self, v):
+        plugins = self.plugins
+        vtype = type(v)
+        start = self._dispatch.get(vtype, 0)
+        for i in range(start, len(plugins)):
+            string = plugins[i](v)
+            if string is not None:
+                if i != start and i <= self._num_pure and vtype in _DISPATCHABLE_TYPES:
+                    self._dispatch[vtype] = i
+                return string
+
+
+# The plugin chain active in the current thread or task, None for the global chain
+_ACTIVE_CHAIN = ContextVar('whatami_plugin_chain', default=None)
+
+
+# Cheap to render values, not worth memoizing
+_UNMEMOIZED_TYPES = frozenset([type(None), bool, int, float, complex, str, type(u'')] +
+                              ([long] if PY2 else []))  # noqa
+
+
+class _Rendering(threading.local):
+    """Per thread bookkeeping for the top level id string being rendered.
+
+    Use as a (reentrant) context manager; the outermost block owns `memo`, that maps
+    id(obj) to (obj, string) so objects referenced several times are rendered once.
+    Objects are kept alive in the memo, so their ids cannot be reused while rendering.
+    `active` maps the ids of the objects being rendered to their nesting level, to detect cycles.
+    """
+
+    def __init__(self):
+        super(_Rendering, self).__init__()
+        self.depth = 0
+        self.memo = None
+        self.active = {}
+        self.num_backrefs = 0
+        # When abbreviating (see `_abbreviated_id`), the list of rendered subtrees and their placeholders
+        self.subtrees = None
+        self.placeholders = None
+
+    def capture(self, template, label, num_elements=None):
+        """Records a subtree while abbreviating, returning a placeholder for it.
+
+        Placeholders in template are replaced by the strings of the already captured subtrees.
+        """
+        self.subtrees.append(_Subtree(template, self.expand(template), label, num_elements))
+        return self.placeholders.placeholder(len(self.subtrees) - 1)
+
+    def expand(self, string):
+        """Replaces placeholders in string by the full strings of the subtrees."""
+        return self.placeholders.sub(lambda i: self.subtrees[i].string, string)
+
+    def __enter__(self):
+        if not self.depth:
+            self.memo = {}
+        self.depth += 1
+        return self
+
+    def __exit__(self, *_):
+        self.depth -= 1
+        if not self.depth:
+            self.memo = None
+            self.active.clear()
+
+
+_RENDERING = _Rendering()
+
+
+# --- Hierarchical abbreviation of ids
+
+class _Placeholders(object):
+    """Placeholders for the subtrees captured while abbreviating, "\\x00nonce:index\\x01".
+
+    The random nonce makes them distinguishable from any text in the rendered values.
+    """
+
+    __slots__ = ('prefix', 'pattern')
+
+    def __init__(self):
+        super(_Placeholders, self).__init__()
+        self.prefix = '\x00%s:' % binascii.hexlify(os.urandom(8)).decode('ascii')
+        self.pattern = re.compile(re.escape(self.prefix) + '(\\d+)\x01')
+
+    def placeholder(self, i):
+        return '%s%d\x01' % (self.prefix, i)
+
+    def indices(self, string):
+        return [int(i) for i in self.pattern.findall(string)]
+
+    def sub(self, func, string):
+        return self.pattern.sub(lambda match: func(int(match.group(1))), string)
+
+
+class _Subtree(object):
+    """A nested What or collection in an id; template has placeholders for its own subtrees."""
+
+    __slots__ = ('template', 'string', 'label', 'num_elements')
+
+    def __init__(self, template, string, label, num_elements=None):
+        super(_Subtree, self).__init__()
+        self.template = template
+        self.string = string
+        self.label = label
+        self.num_elements = num_elements
+
+    def abbreviation(self):
+        if self.num_elements is None:
+            return "%s(hash='%s')" % (self.label, hashlib.sha1(self.string.encode('utf-8')).hexdigest())
+        # like collection summaries (see _collection_string)
+        return "%s(hash='%s',len=%d)" % (self.label, hashlib.md5(self.string.encode('utf-8')).hexdigest(),
+                                         self.num_elements)
+
+    def abbreviation_length(self):
+        if self.num_elements is None:
+            return len(self.label) + len("(hash='')") + 40
+        return len(self.label) + len("(hash='',len=)") + 32 + len(str(self.num_elements))
+
+
+def _abbreviated_id(what, maxlength, nonids_too=False):
+    """Returns what id, replacing nested subtrees by digests until it is not longer than maxlength.
+
+    The id is rendered once, recording nested Whats and collections as subtrees. Then, using their
+    lengths, subtrees are replaced one at a time by "name(hash='sha1')" (or "list(hash='md5',len=n)"
+    for collections, as in collection summaries): the smallest subtree that alone makes the id fit
+    if there is one, else the largest. If even so the id is too long, its sha1 is returned.
+    """
+    rendering = _RENDERING
+    placeholders = _Placeholders()
+    saved = (rendering.depth, rendering.memo, rendering.active, rendering.num_backrefs,
+             rendering.subtrees, rendering.placeholders)
+    (rendering.depth, rendering.memo, rendering.active, rendering.num_backrefs,
+     rendering.subtrees, rendering.placeholders) = 0, None, {}, 0, [], placeholders
+    try:
+        with rendering:
+            root, = placeholders.indices(what.id(nonids_too=nonids_too))
+        subtrees = rendering.subtrees
+    finally:
+        (rendering.depth, rendering.memo, rendering.active, rendering.num_backrefs,
+         rendering.subtrees, rendering.placeholders) = saved
+
+    # N.B. subtrees are captured after their own subtrees
+    children = [placeholders.indices(subtree.template) for subtree in subtrees]
+    own_lengths = [len(subtree.template) - sum(len(placeholders.placeholder(child)) for child in subtree_children)
+                   for subtree, subtree_children in zip(subtrees, children)]
+    abbreviated = set()
+
+    def measure():
+        lengths = []
+        for i, subtree in enumerate(subtrees):
+            if i in abbreviated:
+                lengths.append(subtree.abbreviation_length())
+            else:
+                lengths.append(own_lengths[i] + sum(lengths[child] for child in children[i]))
+        visible, pending = set(), [root]
+        while pending:
+            i = pending.pop()
+            if i not in visible:
+                visible.add(i)
+                if i not in abbreviated:
+                    pending.extend(children[i])
+        return lengths, visible
+
+    while True:
+        lengths, visible = measure()
+        excess = lengths[root] - maxlength
+        if excess <= 0:
+            break
+        savings = dict((i, lengths[i] - subtrees[i].abbreviation_length())
+                       for i in visible if i != root and i not in abbreviated)
+        savings = dict((i, saving) for i, saving in savings.items() if saving > 0)
+        if not savings:
+            return What._trim_too_long(subtrees[root].string, maxlength=maxlength)
+        sufficient = [i for i, saving in savings.items() if saving >= excess]
+        if sufficient:
+            abbreviated.add(min(sufficient, key=lambda i: (savings[i], i)))
+        else:
+            abbreviated.add(max(savings, key=lambda i: (savings[i], i)))
+
+    def expand(i):
+        if i in abbreviated:
+            return subtrees[i].abbreviation()
+        return placeholders.sub(expand, subtrees[i].template)
+
+    return expand(root)
+
+
 class WhatamiPluginManager(object):
     """
     Examples
@@ -292,6 +868,14 @@ class WhatamiPluginManager(object):
     >>> print(whatareyou(lambda x=0.7: x))
     lambda(x='float=0.7')
     >>> WhatamiPluginManager.reset()
+
+    Changes to the plugins are global, unless done within a `scope`:
+    >>> with WhatamiPluginManager.scope():
+    ...     WhatamiPluginManager.insert(float_plugin)
+    ...     print(whatareyou(lambda x=0.7: x))
+    lambda(x='float=0.7')
+    >>> print(whatareyou(lambda x=0.7: x))
+    lambda(x=0.7)
     """
 
     DEFAULT_PLUGINS = (
@@ -312,6 +896,7 @@ class WhatamiPluginManager(object):
         function_plugin,
         # numpy/pandas plugins
         pandas_plugin,
+        memmap_plugin,
         numpy_plugin,
         rng_plugin,
         # capture-all plugins, should come last in the chain
@@ -321,15 +906,133 @@ class WhatamiPluginManager(object):
 
     PLUGINS = DEFAULT_PLUGINS
 
+    # The chain for PLUGINS, rebuilt when PLUGINS changes
+    _GLOBAL_CHAIN = None
+
+    # Lists, tuples, sets and dicts with more elements or longer (utf-8) strings than these
+    # are represented by a digest, like "list(hash='xxx',len=100000)"; None means no limit
+    MAX_COLLECTION_ELEMENTS = None
+    MAX_COLLECTION_BYTES = None
+
+    # Values nested deeper than this raise a ValueError; None means no limit (but python's recursion limit)
+    MAX_DEPTH = None
+    # What to do when a value references itself: 'raise' a ValueError or 'mark' it as "backref(up=n)"
+    ON_CYCLE = 'raise'
+
+    @classmethod
+    def _chain(cls):
+        chain = _ACTIVE_CHAIN.get()
+        if chain is None:
+            chain = cls._GLOBAL_CHAIN
+            if chain is None or chain.plugins is not cls.PLUGINS:
+                chain = cls._GLOBAL_CHAIN = _PluginChain(cls.PLUGINS)
+        return chain
+
+    @classmethod
+    def _config_key(cls):
+        """Returns a hashable key of what determines id strings: the active plugins and the rendering limits."""
+        return (cls._chain().plugins, cls.MAX_COLLECTION_ELEMENTS, cls.MAX_COLLECTION_BYTES,
+                cls.MAX_DEPTH, cls.ON_CYCLE)
+
+    @classmethod
+    def _set_plugins(cls, plugins):
+        if _ACTIVE_CHAIN.get() is None:
+            cls.PLUGINS = tuple(plugins)
+        else:
+            _ACTIVE_CHAIN.set(_PluginChain(plugins))
+
     @classmethod
     def plugins(cls):
         """Returns a tuple with the currently considered plugins."""
-        return cls.PLUGINS
+        return cls._chain().plugins
+
+    @classmethod
+    @contextmanager
+    def scope(cls, plugins=None):
+        """Context manager that activates a plugin chain for the current thread or asyncio task.
+
+        Within the scope, `insert`, `drop` and `reset` only change the scoped chain,
+        so concurrent code can customize plugins without interfering with each other.
+
+        Parameters
+        ----------
+        plugins : sequence of plugins or None, default None
+          The plugins in the scoped chain. If None, start with the currently active plugins.
+        """
+        chain = _PluginChain(cls.plugins() if plugins is None else plugins)
+        token = _ACTIVE_CHAIN.set(chain)
+        try:
+            yield chain.plugins
+        finally:
+            _ACTIVE_CHAIN.reset(token)
+
+    @classmethod
+    def summarize_collections(cls, max_elements=None, max_bytes=None):
+        """Sets the size limits over which collections are represented by a digest.
+
+        Parameters
+        ----------
+        max_elements : int or None, default None
+          Collections with more elements than this are summarized; None means no limit.
+
+        max_bytes : int or None, default None
+          Collections whose id string would be longer than this (in utf-8 bytes) are summarized;
+          None means no limit.
+
+        Examples
+        --------
+        >>> WhatamiPluginManager.summarize_collections(max_elements=3)
+        >>> print(What('features', {'names': ['a', 'b', 'c', 'd'], 'few': ['a', 'b']}).id())
+        features(few=['a','b'],names=list(hash='69517e6523e2ebba225881a853c8dd63',len=4))
+        >>> WhatamiPluginManager.summarize_collections()
+        >>> print(What('features', {'names': ['a', 'b', 'c', 'd'], 'few': ['a', 'b']}).id())
+        features(few=['a','b'],names=['a','b','c','d'])
+        """
+        cls.MAX_COLLECTION_ELEMENTS = max_elements
+        cls.MAX_COLLECTION_BYTES = max_bytes
+
+    @classmethod
+    def limit_recursion(cls, max_depth=None, on_cycle='raise'):
+        """Configures how deep object graphs and cycles are dealt with when generating ids.
+
+        Parameters
+        ----------
+        max_depth : int or None, default None
+          Values nested deeper than this raise a ValueError; None means no limit
+          (although eventually python's recursion limit would be hit).
+
+        on_cycle : 'raise' or 'mark', default 'raise'
+          If 'raise', a value referencing itself raises a ValueError as soon as it is found.
+          If 'mark', the back reference is rendered as "backref(up=n)", where n is the number
+          of nesting levels up where the referenced value is.
+
+        Examples
+        --------
+        >>> what = What('node', {'value': 1})
+        >>> what.conf['parent'] = what
+        >>> print(what.id())
+        Traceback (most recent call last):
+        ...
+        ValueError: cycle detected while generating an id: What object references itself (1 levels up)
+        >>> WhatamiPluginManager.limit_recursion(on_cycle='mark')
+        >>> print(what.id())
+        node(parent=node(parent=backref(up=1),value=1),value=1)
+        >>> WhatamiPluginManager.limit_recursion(max_depth=1)
+        >>> print(What('f', {'x': [[1]]}).id())
+        Traceback (most recent call last):
+        ...
+        ValueError: maximum depth (1) exceeded while generating an id for a list
+        >>> WhatamiPluginManager.limit_recursion()
+        """
+        if on_cycle not in ('raise', 'mark'):
+            raise ValueError('on_cycle must be one of "raise" or "mark", not %r' % on_cycle)
+        cls.MAX_DEPTH = max_depth
+        cls.ON_CYCLE = on_cycle
 
     @classmethod
     def reset(cls):
         """Makes the plugin list the default list."""
-        cls.PLUGINS = cls.DEFAULT_PLUGINS
+        cls._set_plugins(cls.DEFAULT_PLUGINS)
 
     @classmethod
     def drop(cls, plugin):
@@ -340,10 +1043,10 @@ class WhatamiPluginManager(object):
         plugin : function
           The plugin to drop
         """
-        plugins = list(cls.PLUGINS)
+        plugins = list(cls.plugins())
         try:
             plugins.remove(plugin)
-            cls.PLUGINS = tuple(plugins)
+            cls._set_plugins(plugins)
         except ValueError:
             raise ValueError('cannot drop plugin %s, not in plugins list' % plugin.__name__)
 
@@ -365,9 +1068,9 @@ class WhatamiPluginManager(object):
         ------
         ValueError if plugin is already in the list of registered plugins of if before is not in the list.
         """
-        if plugin in cls.PLUGINS:
+        if plugin in cls.plugins():
             raise ValueError('cannot insert plugin %s, already in plugins list' % plugin.__name__)
-        plugins = list(cls.PLUGINS)
+        plugins = list(cls.plugins())
         if before is None:
             plugins.append(plugin)
         else:
@@ -376,7 +1079,23 @@ class WhatamiPluginManager(object):
                 plugins.insert(index, plugin)
             except ValueError:
                 raise ValueError('plugin to insert before (%s) not in plugins list' % before.__name__)
-        cls.PLUGINS = tuple(plugins)
+        cls._set_plugins(plugins)
+
+    @classmethod
+    def rendering(cls):
+        """Returns a context manager for the generation of one (top level) id string.
+
+        While in the outermost block, objects referenced several times are rendered only once.
+        Objects must not be mutated while rendering.
+
+        Examples
+        --------
+        >>> shared = ['a', 'b']
+        >>> with WhatamiPluginManager.rendering():
+        ...     print(What('f', {'x': shared, 'y': What('g', {'z': shared})}).id())
+        f(x=['a','b'],y=g(z=['a','b']))
+        """
+        return _RENDERING
 
     @classmethod
     def build_string(cls, v):
@@ -387,10 +1106,40 @@ class WhatamiPluginManager(object):
         v : object
           The object to represent as a string
         """
-        for plugin in cls.plugins():
-            string = plugin(v)
-            if string is not None:
-                return string
+        if type(v) in _UNMEMOIZED_TYPES:
+            return cls._chain().build_string(v)
+        rendering = _RENDERING
+        memo = rendering.memo
+        if memo is None:
+            with rendering:
+                return cls.build_string(v)
+        key = id(v)
+        try:
+            return memo[key][1]
+        except KeyError:
+            pass
+        active = rendering.active
+        level = len(active)
+        if key in active:
+            up = level - active[key]
+            if cls.ON_CYCLE == 'mark':
+                rendering.num_backrefs += 1
+                return 'backref(up=%d)' % up
+            raise ValueError('cycle detected while generating an id: %s object references itself (%d levels up)' %
+                             (v.__class__.__name__, up))
+        if cls.MAX_DEPTH is not None and level >= cls.MAX_DEPTH:
+            raise ValueError('maximum depth (%d) exceeded while generating an id for a %s' %
+                             (cls.MAX_DEPTH, v.__class__.__name__))
+        active[key] = level
+        num_backrefs = rendering.num_backrefs
+        try:
+            string = cls._chain().build_string(v)
+        finally:
+            del active[key]
+        # Strings with back references depend on where they are rendered, do not reuse them
+        if rendering.num_backrefs == num_backrefs:
+            memo[key] = (v, string)
+        return string
 
 
 toolz = maybe_import('toolz', 'pip', 'cytoolz', 'toolz')
@@ -6,26 +6,63 @@
 
 from __future__ import absolute_import, print_function
 
+import hashlib
+import os
+import os.path as op
+import struct
+import threading
+import zlib
+from contextlib import contextmanager
 from copy import copy
 
 from future.utils import string_types, with_metaclass
 
-from functools import partial
+from functools import partial, wraps
 from collections import OrderedDict, Hashable
 
 from whatami import what2id, is_iterable, decorate_some, ensure_has_positional_args
 from whatami.plugins import pd, toolz
 
 
+_SIGNED64 = struct.Struct('>q')
+# Old SQLite versions limit the number of parameters of a query to 999
+_SQLITE_MAX_PARAMETERS = 900
+
+
 class WhatamiRegistry(object):
-    """Bidirectional mapping, one-to-one, no persistence ATM (all should be in code), string to string (no thunks)."""
+    """Bidirectional mapping, one-to-one, no persistence ATM (all should be in code), string to string (no thunks).
+
+    Parameters
+    ----------
+    name : string, default 'master'
+      The name of the registry.
+
+    digest_ids : boolean, default False
+      If True, ids are indexed by their (16 bytes) md5 digest instead of by the id strings themselves,
+      and the ids are kept only zlib-compressed, so memory is dominated by the number of entries
+      and not by the length of the ids (long, repetitive, ids usually compress very well).
+      Digest collisions are detected: they make `register` fail instead of mixing the entries.
+      See `SQLiteWhatamiRegistry` to keep the ids on disk instead.
+    """
 
-    def __init__(self, name='master'):
+    def __init__(self, name='master', digest_ids=False):
         super(WhatamiRegistry, self).__init__()
         self.name = name
+        self.digest_ids = digest_ids
         self._id2nick = {}
         self._nick2id = {}
 
+    def _key(self, whatid):
+        """Returns the key of an id in _id2nick."""
+        return hashlib.md5(whatid.encode('utf-8')).digest() if self.digest_ids else whatid
+
+    def _pack(self, whatid):
+        """Returns how an id is stored in _nick2id."""
+        return zlib.compress(whatid.encode('utf-8')) if self.digest_ids else whatid
+
+    def _unpack(self, packed):
+        return zlib.decompress(packed).decode('utf-8') if self.digest_ids else packed
+
     def register(self, what, nickname):
         """Registers the nickname for the id of what; returns `what` in the interest of fluent interfaces."""
 
@@ -36,26 +73,35 @@ class WhatamiRegistry(object):
 
         whatid = what2id(what)
 
-        i2n, n2i = self._id2nick, self._nick2id
-
         # Ensure a one-to-one relationship; probably a nickname pointing to more than one id would be more useful
-        if nickname in n2i and not n2i[nickname] == whatid:
+        old_whatid = self.nick2id(nickname)
+        if old_whatid is not None and not old_whatid == whatid:
             raise Exception('nickname "%s" is already associated with id "%s", delete it before updating' %
-                            (nickname, n2i[nickname]))
-        if whatid in i2n and not i2n[whatid] == nickname:
+                            (nickname, old_whatid))
+        old_nickname = self.id2nick(whatid)
+        if old_nickname is not None and not old_nickname == nickname:
             raise Exception('id "%s" is already associated with nickname "%s", delete it before updating' %
-                            (whatid, i2n[whatid]))
+                            (whatid, old_nickname))
 
         # Add binding
-        i2n[whatid] = nickname
-        n2i[nickname] = whatid
+        self._bind(whatid, nickname)
 
         # Fluent
         return what
 
+    def _bind(self, whatid, nickname):
+        key = self._key(whatid)
+        if self.digest_ids and key in self._id2nick:
+            old_whatid = self._unpack(self._nick2id[self._id2nick[key]])
+            if old_whatid != whatid:
+                raise Exception('ids "%s" and "%s" have the same digest, they cannot be both registered' %
+                                (whatid, old_whatid))
+        self._id2nick[key] = nickname
+        self._nick2id[nickname] = self._pack(whatid)
+
     def list(self):
         """Returns a sorted list of tuples (nick, id)."""
-        return sorted(self._nick2id.items())
+        return sorted((nickname, self._unpack(packed)) for nickname, packed in self._nick2id.items())
 
     def remove(self, nickname=None, what=None):
         """Removes the entry corresponding to nickname or what.
@@ -70,31 +116,102 @@ class WhatamiRegistry(object):
             whatid = self.nick2id(nickname)
         else:
             old_whatid = self.nick2id(nickname)
-            old_nick = self.id2nick(nickname)
+            old_nick = self.id2nick(whatid)
             if old_whatid != whatid or old_nick != nickname:
                 raise ValueError('both whatid "%s"=="%s" and nickname "%s"=="%s" identities must hold' %
                                  (whatid, old_whatid, nickname, old_nick))
+        self._unbind(whatid, nickname)
+
+    def _unbind(self, whatid, nickname):
         del self._nick2id[nickname]
-        del self._id2nick[whatid]
+        del self._id2nick[self._key(whatid)]
 
     def nick2id(self, nickname):  # type: (str) -> Optional[str]
         """
         Maps a nickname to the corrensponding id-
         Returns a string or None if the pair is not in the registry.
         """
-        return self._nick2id.get(nickname, None)
+        packed = self._nick2id.get(nickname, None)
+        return None if packed is None else self._unpack(packed)
 
     def id2nick(self, whatid):  # type: (str) -> Optional[str]
         """
         Maps an id to the corrensponding nickname.
         Returns a string or None if the pair is not in the registry.
         """
-        return self._id2nick.get(whatid, None)
+        nickname = self._id2nick.get(self._key(whatid), None)
+        if self.digest_ids and nickname is not None and self._unpack(self._nick2id[nickname]) != whatid:
+            # Another id with the same digest
+            return None
+        return nickname
 
     def nick_or_id(self, what):
         """Returns the nickname if it exists, otherwise it returns the id."""
         whatid = what2id(what)
-        return self._id2nick.get(whatid, whatid)
+        nickname = self.id2nick(whatid)
+        return whatid if nickname is None else nickname
+
+    def register_many(self, pairs):
+        """Registers all the (what, nickname) pairs in the pairs iterable.
+
+        Either all the pairs are registered or, if any of them breaks the one-to-one relationship
+        (with the registry or with other pairs), none is and an exception is raised.
+        Ids are computed once per distinct what object.
+        """
+        # Validate all the pairs before binding any
+        id2nick, nick2id = self._id2nick, self._nick2id
+        digest_ids, unpack = self.digest_ids, self._unpack
+        batch_nick2id, batch_key2entry = {}, {}
+        computed = {}
+        for what, nickname in pairs:
+            if what is None or nickname is None:
+                raise ValueError('neither what nor nickname can be None')
+            whatid = what if isinstance(what, string_types) else _computed_id(what, computed)
+            key = self._key(whatid) if digest_ids else whatid
+            old_whatid = batch_nick2id.setdefault(nickname, whatid)
+            if old_whatid == whatid:
+                old_whatid = nick2id.get(nickname)
+                if digest_ids and old_whatid is not None:
+                    old_whatid = unpack(old_whatid)
+            if old_whatid is not None and not old_whatid == whatid:
+                raise Exception('nickname "%s" is already associated with id "%s", delete it before updating' %
+                                (nickname, old_whatid))
+            old_whatid, old_nickname = batch_key2entry.setdefault(key, (whatid, nickname))
+            if old_nickname == nickname:
+                old_nickname = id2nick.get(key)
+                if old_nickname is not None:
+                    old_whatid = unpack(nick2id[old_nickname])
+            if not old_whatid == whatid:
+                raise Exception('ids "%s" and "%s" have the same digest, they cannot be both registered' %
+                                (whatid, old_whatid))
+            if old_nickname is not None and not old_nickname == nickname:
+                raise Exception('id "%s" is already associated with nickname "%s", delete it before updating' %
+                                (whatid, old_nickname))
+        # Add bindings
+        id2nick.update((key, nickname) for key, (_, nickname) in batch_key2entry.items())
+        if digest_ids:
+            nick2id.update((nickname, self._pack(whatid)) for nickname, whatid in batch_nick2id.items())
+        else:
+            nick2id.update(batch_nick2id)
+
+    def id2nick_many(self, whatids):
+        """Returns a list with the nickname (or None) of each id in whatids; each distinct id is looked up once."""
+        whatids = list(whatids)
+        nicknames = self._id2nick_many(set(whatids))
+        return [nicknames[whatid] for whatid in whatids]
+
+    def _id2nick_many(self, whatids):
+        """Returns a dictionary {id: nickname or None} for the distinct ids in whatids."""
+        if self.digest_ids:
+            return {whatid: self.id2nick(whatid) for whatid in whatids}
+        get = self._id2nick.get
+        return {whatid: get(whatid) for whatid in whatids}
+
+    def nick_or_id_many(self, whats):
+        """Returns a list with `nick_or_id` of each what in whats; ids are computed once per distinct object."""
+        whatids = _whatids(whats)
+        return [whatid if nickname is None else nickname
+                for whatid, nickname in zip(whatids, self.id2nick_many(whatids))]
 
     def reset(self):
         """Removes all entries in the registry."""
@@ -102,6 +219,242 @@ class WhatamiRegistry(object):
         self._nick2id = {}
 
 
+def _computed_id(what, computed):
+    """Returns the id of what, computing it only if it is not in the computed dictionary yet."""
+    # N.B. objects are kept alive in computed, so their python ids are not reused
+    try:
+        return computed[id(what)][1]
+    except KeyError:
+        whatid = what2id(what)
+        computed[id(what)] = what, whatid
+        return whatid
+
+
+def _whatids(whats):
+    """Returns a list with the ids of whats, computing them just once per distinct object."""
+    computed = {}
+    return [what if isinstance(what, string_types) else _computed_id(what, computed) for what in whats]
+
+
+class SQLiteWhatamiRegistry(WhatamiRegistry):
+    """A `WhatamiRegistry` persisted in an SQLite database, that can be shared by many processes.
+
+    Each entry is stored once, keyed by nickname, with a 64 bit hash index on the ids, so that
+    long ids are not duplicated in the index and lookups by id need not compare full strings
+    but for the (almost always single) entry with a matching hash. The database is opened
+    in write-ahead-log mode and memory-mapped, so many readers can query it concurrently,
+    also while a writer registers new entries.
+
+    Parameters
+    ----------
+    path : string
+      The database file, created if it does not exist.
+
+    name : string, default 'master'
+      The name of the registry.
+
+    readonly : boolean, default False
+      If True, the database must exist and the registry cannot be modified.
+
+    mmap_size : int, default 2 ** 30
+      The maximum number of bytes of the database accessed via memory-mapping.
+
+    Examples
+    --------
+    >>> import os.path as op
+    >>> import tempfile
+    >>> path = op.join(tempfile.mkdtemp(), 'nicknames.sqlite')
+    >>> with SQLiteWhatamiRegistry(path) as registry:
+    ...     _ = registry.register('rfc(n_trees=100)', 'rfc100')
+    ...     registry.register_many([("rfc(n_trees=%d)" % n, 'rfc%d' % n) for n in (10, 1000)])
+    >>> with SQLiteWhatamiRegistry(path, readonly=True) as registry:
+    ...     print(registry.nick_or_id('rfc(n_trees=10)'), registry.nick2id('rfc1000'), len(registry))
+    rfc10 rfc(n_trees=1000) 3
+    """
+
+    def __init__(self, path, name='master', readonly=False, mmap_size=2 ** 30):
+        # N.B. no call to super().__init__, there are no in-memory dictionaries
+        self.name = name
+        self.path = path
+        self.readonly = readonly
+        self.mmap_size = mmap_size
+        self._lock = threading.RLock()
+        self._in_transaction = False
+        self._connection = None
+        self._pid = None
+        if not readonly:
+            with self._transaction() as connection:
+                connection.execute('CREATE TABLE IF NOT EXISTS entries '
+                                   '(nick TEXT PRIMARY KEY, id TEXT NOT NULL, id_hash INTEGER NOT NULL) WITHOUT ROWID')
+                connection.execute('CREATE INDEX IF NOT EXISTS entries_id_hash ON entries (id_hash)')
+
+    @staticmethod
+    def _hash(whatid):
+        """Returns a signed 64 bit integer hash of an id."""
+        return _SIGNED64.unpack(hashlib.md5(whatid.encode('utf-8')).digest()[:8])[0]
+
+    @property
+    def connection(self):
+        """The connection to the database; each process opens its own."""
+        if self._connection is None or self._pid != os.getpid():
+            # N.B. imported here, not to load sqlite on "import whatami"
+            import sqlite3
+            if self.readonly and not op.isfile(self.path):
+                raise ValueError('the registry database %s does not exist' % self.path)
+            connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            if self.readonly:
+                connection.execute('PRAGMA query_only=1')
+            else:
+                connection.execute('PRAGMA journal_mode=WAL')
+            self._in_transaction = False
+            connection.execute('PRAGMA mmap_size=%d' % self.mmap_size)
+            self._connection, self._pid = connection, os.getpid()
+        return self._connection
+
+    @contextmanager
+    def _transaction(self):
+        """Runs a block in a write transaction, with exclusive access to the database, committing if no errors."""
+        if self.readonly:
+            raise ValueError('the registry %s is read only' % self.path)
+        with self._lock:
+            connection = self.connection
+            if self._in_transaction:
+                # Nested in an ongoing transaction
+                yield connection
+                return
+            connection.execute('BEGIN IMMEDIATE')
+            self._in_transaction = True
+            try:
+                yield connection
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            else:
+                connection.execute('COMMIT')
+            finally:
+                self._in_transaction = False
+
+    def _query(self, sql, parameters=()):
+        with self._lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def register(self, what, nickname):
+        with self._transaction():
+            return super(SQLiteWhatamiRegistry, self).register(what, nickname)
+    register.__doc__ = WhatamiRegistry.register.__doc__
+
+    def _bind(self, whatid, nickname):
+        self.connection.execute('INSERT OR IGNORE INTO entries (nick, id, id_hash) VALUES (?, ?, ?)',
+                                (nickname, whatid, self._hash(whatid)))
+
+    def register_many(self, pairs):
+        """Registers all the (what, nickname) pairs in the pairs iterable, in a single transaction.
+
+        Either all the pairs are registered, or, if any of them breaks the one-to-one relationship
+        (with the registry or with other pairs), none is and an exception is raised.
+        Ids are computed once per distinct what object.
+        """
+        pairs = list(pairs)
+        if any(what is None or nickname is None for what, nickname in pairs):
+            raise ValueError('neither what nor nickname can be None')
+
+        def rows():
+            for whatid, (_, nickname) in zip(_whatids(what for what, _ in pairs), pairs):
+                yield nickname, whatid, self._hash(whatid)
+
+        with self._transaction() as connection:
+            connection.execute('CREATE TEMP TABLE staging (nick TEXT, id TEXT, id_hash INTEGER)')
+            try:
+                connection.executemany('INSERT INTO staging VALUES (?, ?, ?)', rows())
+                connection.execute('CREATE INDEX temp.staging_nick ON staging (nick)')
+                connection.execute('CREATE INDEX temp.staging_id_hash ON staging (id_hash)')
+                conflict = connection.execute(
+                    'SELECT s.nick, e.id FROM staging s JOIN entries e ON s.nick = e.nick '
+                    'WHERE s.id != e.id LIMIT 1').fetchone()
+                if conflict is None:
+                    conflict = connection.execute(
+                        'SELECT s1.nick, s2.id FROM staging s1 JOIN staging s2 ON s1.nick = s2.nick '
+                        'WHERE s1.id != s2.id LIMIT 1').fetchone()
+                if conflict is not None:
+                    raise Exception('nickname "%s" is already associated with id "%s", delete it before updating' %
+                                    conflict)
+                conflict = connection.execute(
+                    'SELECT s.id, e.nick FROM staging s JOIN entries e ON s.id_hash = e.id_hash '
+                    'WHERE s.id = e.id AND s.nick != e.nick LIMIT 1').fetchone()
+                if conflict is None:
+                    conflict = connection.execute(
+                        'SELECT s1.id, s2.nick FROM staging s1 JOIN staging s2 ON s1.id_hash = s2.id_hash '
+                        'WHERE s1.id = s2.id AND s1.nick != s2.nick LIMIT 1').fetchone()
+                if conflict is not None:
+                    raise Exception('id "%s" is already associated with nickname "%s", delete it before updating' %
+                                    conflict)
+                connection.execute('INSERT OR IGNORE INTO entries SELECT nick, id, id_hash FROM staging')
+            finally:
+                connection.execute('DROP TABLE temp.staging')
+
+    @classmethod
+    def from_registry(cls, registry, path, **kwargs):
+        """Returns a new registry in path with all the entries of another registry."""
+        sqlite_registry = cls(path, name=registry.name, **kwargs)
+        sqlite_registry.register_many((whatid, nickname) for nickname, whatid in registry.list())
+        return sqlite_registry
+
+    def list(self):
+        return self._query('SELECT nick, id FROM entries ORDER BY nick')
+    list.__doc__ = WhatamiRegistry.list.__doc__
+
+    def remove(self, nickname=None, what=None):
+        with self._transaction():
+            return super(SQLiteWhatamiRegistry, self).remove(nickname=nickname, what=what)
+    remove.__doc__ = WhatamiRegistry.remove.__doc__
+
+    def _unbind(self, whatid, nickname):
+        if not self.connection.execute('DELETE FROM entries WHERE nick = ?', (nickname,)).rowcount:
+            raise KeyError(nickname)
+
+    def nick2id(self, nickname):
+        rows = self._query('SELECT id FROM entries WHERE nick = ?', (nickname,))
+        return rows[0][0] if rows else None
+    nick2id.__doc__ = WhatamiRegistry.nick2id.__doc__
+
+    def id2nick(self, whatid):
+        rows = self._query('SELECT nick FROM entries WHERE id_hash = ? AND id = ?', (self._hash(whatid), whatid))
+        return rows[0][0] if rows else None
+    id2nick.__doc__ = WhatamiRegistry.id2nick.__doc__
+
+    def _id2nick_many(self, whatids):
+        nicknames = dict.fromkeys(whatids)
+        hashes = sorted(set(self._hash(whatid) for whatid in nicknames))
+        for start in range(0, len(hashes), _SQLITE_MAX_PARAMETERS):
+            chunk = hashes[start:start + _SQLITE_MAX_PARAMETERS]
+            for whatid, nickname in self._query('SELECT id, nick FROM entries WHERE id_hash IN (%s)' %
+                                                ','.join('?' * len(chunk)), chunk):
+                if whatid in nicknames:
+                    nicknames[whatid] = nickname
+        return nicknames
+
+    def reset(self):
+        with self._transaction() as connection:
+            connection.execute('DELETE FROM entries')
+    reset.__doc__ = WhatamiRegistry.reset.__doc__
+
+    def __len__(self):
+        return self._query('SELECT COUNT(*) FROM entries')[0][0]
+
+    def close(self):
+        """Closes the connection to the database of this process."""
+        with self._lock:
+            if self._connection is not None and self._pid == os.getpid():
+                self._connection.close()
+            self._connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
 # --- Registration helpers
 
 class _DefaultDict(dict):
@@ -120,8 +473,16 @@ class _DefaultDict(dict):
         return isinstance(k, Hashable)
 
 
+def _lazy_curry(func):
+    """Like `toolz.curry`, but deferring the import of toolz to the first call."""
+    @wraps(func)
+    def curried(*args, **kwargs):
+        return toolz.curry(func)(*args, **kwargs)
+    return curried
+
+
 _RecorderMeta = decorate_some(add=[partial(ensure_has_positional_args, args=('ids',)),
-                                   toolz.curry])
+                                   _lazy_curry])
 
 
 class Recorder(with_metaclass(_RecorderMeta)):
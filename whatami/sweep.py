@@ -0,0 +1,474 @@
+# coding=utf-8
+"""Running sweeps of configurations, skipping the ones already computed.
+
+`run_sweep` takes an iterable of configurations (Whats, whatables or id strings) and a function,
+and runs the function on the configurations missing from a completion store, in a pool of
+processes or threads, recording each completion as soon as it happens. So an interrupted sweep
+can just be run again, and it will only compute what is left.
+
+Completion stores are objects supporting `whatid in store` and either `record(whatid, result)`
+or `put(whatid, result)`; for example, a `CompletionLog` or a `whatami.cache.WhatamiDiskCache`.
+
+`StageScheduler` runs batches of configurations sharing sub-configurations (e.g. the same
+data preprocessing), computing each shared stage just once.
+
+Sweeps are opt-in, so this module is not imported by `whatami` itself.
+
+Examples
+--------
+>>> import os.path as op
+>>> import tempfile
+>>> from whatami import What
+>>> def square(what):
+...     return what['x'] ** 2
+>>> whats = [What('square', {'x': x}) for x in range(4)]
+>>> with CompletionLog(op.join(tempfile.mkdtemp(), 'done.log')) as done:
+...     print(run_sweep(square, whats[:2], done, executor='thread'))
+...     print(run_sweep(square, whats, done, executor='thread'))
+SweepReport(submitted=2, completed=2, skipped=0, failed=[])
+SweepReport(submitted=2, completed=2, skipped=2, failed=[])
+"""
+
+# Authors: Santi Villalba <sdvillal@gmail.com>
+# Licence: BSD 3 clause
+
+from __future__ import absolute_import
+
+import hashlib
+import io
+import json
+import os
+import threading
+from collections import namedtuple
+from multiprocessing import cpu_count
+
+from future.utils import string_types
+
+from whatami.parsers import parse_whatid
+from whatami.what import What
+from whatami.whatutils import what2id
+
+
+# --- Completion stores
+
+class CompletionLog(object):
+    """A persistent set of completed ids, in an append-only file with one (json-encoded) id per line.
+
+    Each completion is flushed to the file as soon as it is recorded, and a torn last line
+    (e.g. after a crash) is ignored when loading, so the log can be trusted after crashes.
+    In memory, just the md5 of each id is kept.
+
+    Parameters
+    ----------
+    path : string
+      The file of the log; it is created if it does not exist.
+
+    fsync : boolean, default False
+      If True, also ask the OS to write each completion to disk (slower, but survives power losses).
+    """
+
+    def __init__(self, path, fsync=False):
+        super(CompletionLog, self).__init__()
+        self.path = path
+        self.fsync = fsync
+        self._done = set()
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with io.open(path, 'rb') as reader:
+                for line in reader:
+                    if line.endswith(b'\n'):
+                        self._done.add(self._digest(json.loads(line.decode('utf-8'))))
+        self._writer = io.open(path, 'ab')
+
+    @staticmethod
+    def _digest(whatid):
+        return hashlib.md5(whatid.encode('utf-8')).digest()
+
+    def __contains__(self, what):
+        return self._digest(what2id(what)) in self._done
+
+    def __len__(self):
+        return len(self._done)
+
+    def record(self, what, result=None):
+        """Records what (a What, whatable or id string) as completed; the result is ignored."""
+        whatid = what2id(what)
+        digest = self._digest(whatid)
+        with self._lock:
+            if digest in self._done:
+                return
+            self._writer.write(json.dumps(whatid).encode('utf-8') + b'\n')
+            self._writer.flush()
+            if self.fsync:
+                os.fsync(self._writer.fileno())
+            self._done.add(digest)
+
+    def close(self):
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+_MISSING = object()
+
+
+def _in_store(whatid, store):
+    """Returns True if store has whatid, without loading its result if the store supports `in`."""
+    if hasattr(store, '__contains__'):
+        return whatid in store
+    return store.get(whatid, _MISSING) is not _MISSING
+
+
+def _recorder(store):
+    record = getattr(store, 'record', None)
+    if record is None:
+        record = getattr(store, 'put', None)
+    if record is None:
+        raise ValueError('the completion store must have a "record" or a "put" method')
+    return record
+
+
+# --- Runner
+
+SweepReport = namedtuple('SweepReport', ['submitted', 'completed', 'skipped', 'failed'])
+
+
+def _executor(executor, max_workers):
+    """Returns a tuple (executor, owned, number of workers)."""
+    from concurrent import futures
+    if executor == 'process':
+        max_workers = max_workers or cpu_count()
+        return futures.ProcessPoolExecutor(max_workers=max_workers), True, max_workers
+    if executor == 'thread':
+        max_workers = max_workers or cpu_count() * 5
+        return futures.ThreadPoolExecutor(max_workers=max_workers), True, max_workers
+    if isinstance(executor, string_types):
+        raise ValueError('executor must be "process", "thread" or an Executor, not "%s"' % executor)
+    return executor, False, max_workers or cpu_count()
+
+
+def run_sweep(func, whats, store, executor='process', max_workers=None, max_in_flight=None,
+              raise_errors=False, on_result=None):
+    """Runs func on each configuration in whats that is not in the completion store yet.
+
+    Parameters
+    ----------
+    func : function (what) -> result
+      The computation, called with each item in whats as given. With process pools
+      it must be picklable (e.g. a module level function).
+
+    whats : iterable of What, whatable or id strings
+      The configurations; it is consumed lazily, so it can be a (big) generator.
+      Configurations with the same id are just run once.
+
+    store : completion store
+      Where completions are looked up and recorded, see the module documentation.
+      Completions are recorded as they happen, in the calling process.
+
+    executor : 'process', 'thread' or a `concurrent.futures.Executor`, default 'process'
+      Where to run the computations. Pools created here are shut down on return.
+
+    max_workers : int, default None
+      The number of workers of the pools created here; None for the executor defaults.
+      For given executors, their number of workers, used only to size max_in_flight;
+      None for the number of CPUs.
+
+    max_in_flight : int, default None
+      The maximum number of submitted but not finished computations, bounding the memory used
+      by pending work; None for twice the number of workers.
+
+    raise_errors : boolean, default False
+      If True, the first failing computation stops the sweep (after finishing the running ones)
+      and its exception is raised. If False, failures are reported and the sweep goes on.
+
+    on_result : function (whatid, result) -> None, default None
+      If not None, it is called with each computed result, after recording it.
+
+    Returns
+    -------
+    A `SweepReport` named tuple (submitted, completed, skipped, failed), where
+    failed is a list of (whatid, exception) tuples.
+    """
+    from concurrent import futures
+    record = _recorder(store)
+    if max_in_flight is not None and max_in_flight < 1:
+        raise ValueError('max_in_flight must be at least 1, not %r' % max_in_flight)
+    executor, owned, num_workers = _executor(executor, max_workers)
+    if max_in_flight is None:
+        max_in_flight = 2 * num_workers
+
+    submitted = completed = skipped = 0
+    failed = []
+    pending = {}  # future -> whatid
+    in_flight = set()
+
+    def collect(done):
+        num_completed = 0
+        for future in done:
+            whatid = pending.pop(future)
+            in_flight.discard(whatid)
+            if future.cancelled():
+                continue
+            try:
+                result = future.result()
+            except Exception as e:
+                failed.append((whatid, e))
+                continue
+            record(whatid, result)
+            num_completed += 1
+            if on_result is not None:
+                on_result(whatid, result)
+        return num_completed
+
+    try:
+        for what in whats:
+            whatid = what2id(what)
+            if whatid in in_flight or whatid in store:
+                skipped += 1
+                continue
+            if len(pending) >= max_in_flight:
+                done, _ = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+                completed += collect(done)
+                if raise_errors and failed:
+                    # do not start more work, but record what is running
+                    for future in pending:
+                        future.cancel()
+                    break
+            pending[executor.submit(func, what)] = whatid
+            in_flight.add(whatid)
+            submitted += 1
+        if pending:
+            done, _ = futures.wait(pending)
+            completed += collect(done)
+    finally:
+        for future in pending:
+            future.cancel()
+        if owned:
+            executor.shutdown(wait=True)
+    if raise_errors and failed:
+        raise failed[0][1]
+    return SweepReport(submitted, completed, skipped, failed)
+
+
+# --- Reuse of shared sub-configurations
+
+StagesReport = namedtuple('StagesReport', ['roots', 'stages', 'cached', 'executions', 'executions_without_reuse',
+                                           'cost', 'cost_without_reuse'])
+
+
+def _nested_whats(value):
+    """Yields the Whats nested in value (directly, or in lists, tuples and dictionary values)."""
+    if isinstance(value, What):
+        yield value
+    elif isinstance(value, (list, tuple)):
+        for element in value:
+            for what in _nested_whats(element):
+                yield what
+    elif isinstance(value, dict):
+        for element in value.values():
+            for what in _nested_whats(element):
+                yield what
+
+
+def _as_what(what):
+    if isinstance(what, What):
+        return what
+    if isinstance(what, string_types):
+        return parse_whatid(what)
+    return what.what() if callable(what.what) else what.what
+
+
+class StageScheduler(object):
+    """Runs a batch of configurations so that their shared sub-configurations (stages) run just once.
+
+    Each configuration is a DAG of stages: the configuration itself, depending on the Whats nested
+    in its id keys (directly, or in lists, tuples and dictionaries), that in turn depend on their own
+    nested Whats. Stages are identified by their ids, so a stage shared by several configurations
+    (e.g. the same data loading and preprocessing, with different models) is computed once, before all
+    its dependents, and its result is kept only until the last of them has run.
+
+    Parameters
+    ----------
+    whats : iterable of What, whatable or id strings
+      The batch of configurations; id strings are parsed.
+
+    Examples
+    --------
+    >>> ids = ["rfc(data=scale(data=load(name='iris')),n_trees=%d)" % n for n in (10, 100, 1000)]
+    >>> scheduler = StageScheduler(ids)
+    >>> print(scheduler.run(dry_run=True))
+    StagesReport(roots=3, stages=5, cached=0, executions=5, executions_without_reuse=9, cost=5, cost_without_reuse=9)
+    >>> funcs = {'load': lambda what, conf: [1, 2, 3],
+    ...          'scale': lambda what, conf: [x / 3. for x in conf['data']],
+    ...          'rfc': lambda what, conf: sum(conf['data']) * conf['n_trees']}
+    >>> results = scheduler.run(funcs)
+    >>> results[ids[1]]
+    200.0
+    """
+
+    def __init__(self, whats):
+        super(StageScheduler, self).__init__()
+        self.whats = {}  # id -> What
+        self.dependencies = {}  # id -> sorted list of the ids of the nested stages
+        self.roots = []
+        self._nested = {}  # id -> ids of the nested stages, with repetitions
+        for what in whats:
+            what = _as_what(what)
+            whatid = self._add(what)
+            if whatid not in self.roots:
+                self.roots.append(whatid)
+        self.order = self._topological_order()
+
+    def _add(self, what):
+        whatid = what.id()
+        if whatid in self.whats:
+            return whatid
+        nested_ids = []
+        for key in sorted(what.conf):
+            if key in what.non_id_keys:
+                continue
+            nested_ids.extend(self._add(nested) for nested in _nested_whats(what.conf[key]))
+        self.whats[whatid] = what
+        self.dependencies[whatid] = sorted(set(nested_ids))
+        self._nested[whatid] = nested_ids
+        return whatid
+
+    def _topological_order(self):
+        order, visited = [], set()
+
+        def visit(whatid):
+            if whatid not in visited:
+                visited.add(whatid)
+                for dependency in self.dependencies[whatid]:
+                    visit(dependency)
+                order.append(whatid)
+
+        for root in self.roots:
+            visit(root)
+        return order
+
+    def _resolve(self, value, results):
+        """Returns value with the nested Whats replaced by their results.
+
+        Values without nested Whats are returned as they are. Otherwise lists, tuples, named tuples
+        and dictionaries (of any mapping type accepting a list of items) are rebuilt.
+        """
+        if isinstance(value, What):
+            return results[value.id()]
+        if next(_nested_whats(value), None) is None:
+            return value
+        if isinstance(value, dict):
+            return type(value)([(k, self._resolve(v, results)) for k, v in value.items()])
+        resolved = [self._resolve(element, results) for element in value]
+        if type(value) is list:
+            return resolved
+        if type(value) is tuple:
+            return tuple(resolved)
+        if isinstance(value, tuple) and hasattr(value, '_make'):
+            return type(value)._make(resolved)
+        raise TypeError('cannot replace the Whats nested in a %s' % type(value).__name__)
+
+    def report(self, store=None, cost=None):
+        """Returns a `StagesReport` with the stages to run and what would be run without reusing them.
+
+        Parameters
+        ----------
+        store : object supporting `whatid in store` (or with a method get(what, default)), default None
+          If not None, stages with results in the store do not need to run (nor the stages they depend on).
+          Results are not loaded.
+
+        cost : function (What) -> float, default None
+          An estimate of the cost of running each stage, used to report cost savings; by default all cost 1.
+        """
+        costs = {whatid: 1 if cost is None else cost(what) for whatid, what in self.whats.items()}
+        needed = self._needed(store)
+        # Without reuse, each stage would run as many times as it appears in the trees of the roots
+        tree_costs = {}
+        for whatid in self.order:
+            tree_costs[whatid] = costs[whatid] + sum(tree_costs[nested] for nested in self._nested[whatid])
+        tree_sizes = {}
+        for whatid in self.order:
+            tree_sizes[whatid] = 1 + sum(tree_sizes[nested] for nested in self._nested[whatid])
+        return StagesReport(roots=len(self.roots),
+                            stages=len(self.whats),
+                            cached=len(self.whats) - len(needed),
+                            executions=len(needed),
+                            executions_without_reuse=sum(tree_sizes[root] for root in self.roots),
+                            cost=sum(costs[whatid] for whatid in needed),
+                            cost_without_reuse=sum(tree_costs[root] for root in self.roots))
+
+    def _needed(self, store):
+        """Returns the set of ids of the stages that need to run, given the results in store."""
+        if store is None:
+            return set(self.whats)
+        needed = set()
+
+        def visit(whatid):
+            if whatid in needed:
+                return
+            if not _in_store(whatid, store):
+                needed.add(whatid)
+                for dependency in self.dependencies[whatid]:
+                    visit(dependency)
+
+        for root in self.roots:
+            visit(root)
+        return needed
+
+    def run(self, funcs=None, store=None, dry_run=False, cost=None):
+        """Runs all the stages, each once, in dependency order.
+
+        Parameters
+        ----------
+        funcs : function (what, conf) -> result, or dictionary {name: function}
+          How to run each stage; conf is the configuration of the stage, with the nested Whats replaced
+          by their results (values of non-id keys are passed as they are, they are not stages).
+          If a dictionary, the function is chosen by the name of the stage.
+
+        store : object with methods get(what, default) and put(what, result), default None
+          If not None, results are looked up here before running stages, and stored here after
+          (e.g. a `whatami.cache.WhatamiDiskCache` or a `whatami.cache.WhatamiLRUCache`).
+          Stored results are loaded once, and only if they are needed by a stage or are results of roots.
+
+        dry_run : boolean, default False
+          If True, nothing is run and the report of `report(store, cost)` is returned.
+
+        Returns
+        -------
+        A dictionary {root id: result}, or a `StagesReport` if dry_run is True.
+        """
+        if dry_run:
+            return self.report(store=store, cost=cost)
+        if funcs is None:
+            raise ValueError('funcs must be provided unless dry running')
+        needed = self._needed(store)
+        # Results are kept until all their dependents have run
+        dependents = {}
+        for whatid in needed:
+            for dependency in self.dependencies[whatid]:
+                dependents[dependency] = dependents.get(dependency, 0) + 1
+        roots = set(self.roots)
+        results = {}
+        for whatid in self.order:
+            if whatid not in needed:
+                if whatid in roots:
+                    results[whatid] = store.get(whatid)
+                continue
+            for dependency in self.dependencies[whatid]:
+                if dependency not in results:
+                    results[dependency] = store.get(dependency)
+            what = self.whats[whatid]
+            func = funcs if callable(funcs) else funcs[what.name]
+            conf = {k: v if k in what.non_id_keys else self._resolve(v, results) for k, v in what.conf.items()}
+            results[whatid] = func(what, conf)
+            if store is not None:
+                store.put(whatid, results[whatid])
+            for dependency in self.dependencies[whatid]:
+                dependents[dependency] -= 1
+                if not dependents[dependency] and dependency not in roots:
+                    del results[dependency]
+        return {root: results[root] for root in self.roots}
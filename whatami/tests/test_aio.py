@@ -0,0 +1,124 @@
+# coding=utf-8
+
+# Authors: Santi Villalba <sdvillal@gmail.com>
+# Licence: BSD 3 clause
+
+import asyncio
+import os.path as op
+import threading
+
+import pytest
+
+from ..aio import SingleFlight, adigest_id, afile_digest, aid, async_memoized
+from ..cache import WhatamiDiskCache
+from ..plugins import WhatamiPluginManager, file_digest
+from ..what import What
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+async def gather(*coroutines):
+    return await asyncio.gather(*coroutines)
+
+
+def test_aid(tmpdir):
+    what = What('rfc', {'n_trees': 10, 'weights': list(range(100))}, non_id_keys=['weights'])
+    whatid, whatid_nonids, digest = run(gather(what.aid(), aid(what, nonids_too=True), adigest_id(what)))
+    assert whatid == what.id() == 'rfc(n_trees=10)'
+    assert whatid_nonids == what.id(nonids_too=True)
+    assert digest == what.digest_id()
+
+    path = op.join(str(tmpdir), 'data.bin')
+    with open(path, 'wb') as writer:
+        writer.write(b'x' * 1000)
+    assert run(afile_digest(path)) == file_digest(path)
+
+
+def test_aid_plugin_scopes():
+    what = What('f', {'x': 0.5})
+
+    def float_plugin(v):
+        if isinstance(v, float):
+            return "'F'"
+
+    async def scoped():
+        with WhatamiPluginManager.scope():
+            WhatamiPluginManager.insert(float_plugin, before=WhatamiPluginManager.plugins()[0])
+            assert what.id() == "f(x='F')"
+            return await what.aid(), await adigest_id(what)
+
+    async def main():
+        return await gather(scoped(), what.aid())
+
+    (scoped_id, scoped_digest), unscoped_id = run(main())
+    assert scoped_id == "f(x='F')"
+    assert unscoped_id == what.id() == 'f(x=0.5)'
+    assert scoped_digest != what.digest_id(cache=False)
+
+
+def test_single_flight():
+    flights = SingleFlight()
+    calls = []
+
+    async def compute(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        return value
+
+    async def main():
+        results = await asyncio.gather(*[flights.run(v, lambda v=v: compute(v)) for v in (1, 1, 2, 1)])
+        assert not len(flights)
+        return results
+
+    assert run(main()) == [1, 1, 2, 1]
+    assert sorted(calls) == [1, 2]
+
+    # cancelling one of the callers does not cancel the computation for the others
+    async def cancel_one():
+        first = asyncio.ensure_future(flights.run('key', lambda: compute(3)))
+        second = asyncio.ensure_future(flights.run('key', lambda: compute(4)))
+        await asyncio.sleep(0)
+        assert 'key' in flights
+        first.cancel()
+        assert await second == 3
+        with pytest.raises(asyncio.CancelledError):
+            await first
+
+    run(cancel_one())
+
+
+def test_async_memoized(tmpdir):
+    calls = []
+
+    @async_memoized
+    async def total(values, scale=1):
+        calls.append(values)
+        await asyncio.sleep(0.01)
+        return scale * sum(values)
+
+    async def main():
+        return await asyncio.gather(total([1, 2]), total([1, 2], scale=1), total(values=[1, 2]), total([3]))
+
+    assert run(main()) == [3, 3, 3, 3]
+    assert calls == [[1, 2], [3]]
+    assert run(total([1, 2])) == 3
+    assert len(calls) == 2
+    assert total.cache.stats().entries == 2
+
+    # regular functions run in the executor, results can go to any cache
+    threads = []
+
+    @async_memoized(cache=WhatamiDiskCache(str(tmpdir)), non_id_keys=['verbose'])
+    def square(x, verbose=False):
+        threads.append(threading.current_thread())
+        return x ** 2
+
+    assert run(gather(square(3), square(3, verbose=True))) == [9, 9]
+    assert threads and threading.current_thread() not in threads
+    assert square.cache.get('square(x=3)') == 9
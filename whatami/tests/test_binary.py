@@ -0,0 +1,75 @@
+# coding=utf-8
+
+# Authors: Santi Villalba <sdvillal@gmail.com>
+# Licence: BSD 3 clause
+
+from __future__ import absolute_import
+
+import pytest
+
+from ..binary import what2bytes, bytes2what, binary_digest
+from ..parsers import parse_whatid
+from ..what import What
+from .fixtures import *
+
+
+def test_binary_roundtrips(c1, c2, c3):
+    whats = [
+        What('empty', {}),
+        What('rfc', {'n_trees': 100, 'min_split': -2, 'big': 2 ** 70, 'alpha': 0.25, 'name': 'gini',
+                     'seed': None, 'verbose': True, 'debug': False}),
+        What('rfc', {'criterion': What('gini', {'weights': [1, 2.5, 'x']}), 'bagging': (0.5, 10)},
+             out_name='model'),
+        What('nested', {'d': {'k': (1, 2), 3: frozenset([1, 2])}, 's': {1, 'z'}, 'l': [[], (), {}]}),
+        What('classes', {'c': What, 'f': lambda x, y=3: x}),
+        c1.what(), c2.what(), c3.what(),
+    ]
+    for what in whats:
+        encoded = what2bytes(what)
+        decoded = bytes2what(encoded)
+        # same values as parsing back the id string...
+        assert decoded == parse_whatid(what.id())
+        assert decoded.id() == what.id()
+        # canonical
+        assert what2bytes(decoded) == encoded
+        assert bytes2what(bytearray(encoded)) == decoded
+        assert bytes2what(memoryview(encoded)) == decoded
+    # smaller than id strings, unless there is little more than names and keys
+    assert len(what2bytes(whats[1])) < len(whats[1].id())
+    weights = What('x', {'weights': list(range(100))})
+    assert len(what2bytes(weights)) < len(weights.id())
+    # whatables can be encoded too
+    assert bytes2what(what2bytes(c3)).id() == c3.what().id()
+
+
+def test_binary_canonical_and_digests():
+    w1 = What('rfc', {'a': {'x': 1, 'y': 2}, 'b': {3, 1, 2}, 'verbose': True}, non_id_keys=['verbose'])
+    w2 = What('rfc', {'b': {1, 2, 3}, 'a': {'y': 2, 'x': 1}, 'verbose': False}, non_id_keys=['verbose'])
+    assert what2bytes(w1) == what2bytes(w2)
+    assert binary_digest(w1) == binary_digest(w2) == binary_digest(what2bytes(w1))
+    assert what2bytes(w1, nonids_too=True) != what2bytes(w2, nonids_too=True)
+    assert bytes2what(what2bytes(w1, nonids_too=True)).conf['verbose'] is True
+    assert binary_digest(w1) != binary_digest(What('rfc', {'a': {'x': 1, 'y': 2}, 'b': {1, 2}}))
+    # types are part of the encoding
+    assert binary_digest(What('rfc', {'a': 1})) != binary_digest(What('rfc', {'a': True}))
+    assert binary_digest(What('rfc', {'a': 1})) != binary_digest(What('rfc', {'a': 1.0}))
+    assert binary_digest(What('rfc', {'a': [1]})) != binary_digest(What('rfc', {'a': (1,)}))
+    assert len(binary_digest(w1, hash_name='md5')) == 32
+
+
+def test_binary_errors():
+    with pytest.raises(ValueError) as excinfo:
+        what2bytes(1)
+    assert str(excinfo.value) == 'only What and whatable objects can be encoded, not int'
+    cycle = []
+    cycle.append(cycle)
+    with pytest.raises(ValueError) as excinfo:
+        what2bytes(What('cycle', {'c': cycle}))
+    assert str(excinfo.value) == 'cycle detected while encoding a list'
+    encoded = what2bytes(What('rfc', {'n_trees': 100}))
+    with pytest.raises(ValueError) as excinfo:
+        bytes2what(b'\x02' + encoded[1:])
+    assert 'unsupported binary what version' in str(excinfo.value)
+    with pytest.raises(ValueError) as excinfo:
+        bytes2what(encoded + b'N')
+    assert str(excinfo.value) == '1 trailing bytes after the encoded What'
@@ -0,0 +1,86 @@
+# coding=utf-8
+
+# Authors: Santi Villalba <sdvillal@gmail.com>
+# Licence: BSD 3 clause
+
+from __future__ import absolute_import
+
+import os.path as op
+
+import pytest
+
+from ..bloom import WhatamiBloomFilter
+from ..what import What
+from .fixtures import *
+
+
+def test_bloom_filter():
+    ids = ['rfc(n_trees=%d)' % n for n in range(2000)]
+    bloom = WhatamiBloomFilter(capacity=2000, error_rate=0.01)
+    assert (bloom.num_bits, bloom.num_hashes) == (19171, 7)
+    # one by one and in bulk give the same
+    for whatid in ids[:1000]:
+        bloom.add(whatid)
+    bloom.add_many(ids[1000:])
+    assert all(whatid in bloom for whatid in ids)
+    assert bloom.contains_many(ids) == [True] * len(ids)
+    assert 1900 < len(bloom) <= 2000
+    # false positives are rare
+    others = ['gbm(n_trees=%d)' % n for n in range(10000)]
+    assert sum(bloom.contains_many(others)) < 250
+    assert sum(other in bloom for other in others) == sum(bloom.contains_many(others))
+    assert 0.005 < bloom.false_positive_rate() < 0.02
+    # Whats and whatables are added by their ids
+    bloom.add(What('gbm', {'n_trees': 10}))
+    assert 'gbm(n_trees=10)' in bloom
+
+
+def test_bloom_filter_digests(c1):
+    bloom = WhatamiBloomFilter.from_ids([What('rfc', {'n_trees': 10}), c1], capacity=100, keys='digest')
+    assert What('rfc', {'n_trees': 10}).digest_id() in bloom
+    assert 'rfc(n_trees=10)' not in bloom
+    assert bloom.contains_many([What('rfc', {'n_trees': 10}), c1.what(), What('rfc', {})]) == [True, True, False]
+
+
+def test_bloom_filter_files_and_merges(tmpdir):
+    path = op.join(str(tmpdir), 'seen.bloom')
+    ids = ['rfc(n_trees=%d)' % n for n in range(1000)]
+    with WhatamiBloomFilter.from_ids(ids[:500], capacity=1000, path=path) as bloom:
+        assert bloom.path == path
+    with pytest.raises(Exception):
+        WhatamiBloomFilter(capacity=1000, path=path)
+    # reopen and keep adding
+    with WhatamiBloomFilter.open(path) as bloom:
+        assert bloom.contains_many(ids[:500]) == [True] * 500
+        worker = WhatamiBloomFilter(capacity=1000)
+        worker.add_many(ids[500:])
+        bloom.merge(worker)
+        num_added = len(bloom)
+    with WhatamiBloomFilter.open(path, readonly=True) as bloom:
+        assert len(bloom) == num_added
+        assert bloom.contains_many(ids) == [True] * 1000
+        with pytest.raises(ValueError) as excinfo:
+            bloom.add('gbm()')
+        assert str(excinfo.value) == 'this bloom filter is read only'
+    # in memory filters can be saved too
+    copy_path = worker.save(op.join(str(tmpdir), 'worker.bloom'))
+    with WhatamiBloomFilter.open(copy_path) as copy:
+        assert copy.contains_many(ids[500:]) == [True] * 500
+    # only compatible filters can be merged
+    with pytest.raises(ValueError) as excinfo:
+        worker |= WhatamiBloomFilter(capacity=10)
+    assert 'same number of bits' in str(excinfo.value)
+    with open(op.join(str(tmpdir), 'no.bloom'), 'wb') as writer:
+        writer.write(b'not a bloom filter')
+    with pytest.raises(ValueError) as excinfo:
+        WhatamiBloomFilter.open(op.join(str(tmpdir), 'no.bloom'))
+    assert 'is not a whatami bloom filter file' in str(excinfo.value)
+
+
+def test_bloom_filter_parameters():
+    with pytest.raises(ValueError):
+        WhatamiBloomFilter(capacity=0)
+    with pytest.raises(ValueError):
+        WhatamiBloomFilter(error_rate=1.5)
+    with pytest.raises(ValueError):
+        WhatamiBloomFilter(keys='sha1')
@@ -0,0 +1,272 @@
+# coding=utf-8
+
+# Authors: Santi Villalba <sdvillal@gmail.com>
+# Licence: BSD 3 clause
+
+from __future__ import absolute_import
+
+import hashlib
+import os
+import os.path as op
+import time
+from threading import Thread
+
+import pytest
+
+from ..cache import (WhatamiDiskCache, NumpySerializer, disk_cached, call_what,
+                     WhatamiLRUCache, memoized, estimate_bytes)
+from ..misc import MAX_EXT4_FN_LENGTH
+from ..what import What, whatable
+from .fixtures import *
+
+
+def test_call_what():
+    def f(x, y=3, n_jobs=1):
+        pass
+    assert call_what(f, (1,)).id() == 'f(n_jobs=1,x=1,y=3)'
+    assert call_what(f, (1, 2), {'n_jobs': 4}, non_id_keys=['n_jobs']).id() == 'f(x=1,y=2)'
+    with pytest.raises(TypeError):
+        call_what(f, (), {'z': 1})
+
+
+def test_disk_cache_layout(tmpdir):
+    cache = WhatamiDiskCache(str(tmpdir))
+    what = What('rfc', {'n_trees': 10})
+    digest = hashlib.sha1(what.id().encode('utf-8')).hexdigest()
+    assert cache.path(what) == op.join(cache.root, digest[:2], 'rfc(n_trees=10).pkl')
+    assert cache.path(what.id()) == cache.path(what)
+    assert cache.path(what, serializer='numpy').endswith('rfc(n_trees=10).npy')
+    # ids that do not make good file names are replaced by their sha1
+    for what in (What('rfc', {'data': '/tmp/data'}), What('rfc', {'weights': list(range(MAX_EXT4_FN_LENGTH))})):
+        digest = hashlib.sha1(what.id().encode('utf-8')).hexdigest()
+        assert cache.path(what) == op.join(cache.root, digest[:2], digest + '.pkl')
+    cache = WhatamiDiskCache(str(tmpdir), readable_names=False)
+    assert op.basename(cache.path(What('rfc', {}))) == hashlib.sha1(b'rfc()').hexdigest() + '.pkl'
+
+
+def test_disk_cache_store(tmpdir):
+    cache = WhatamiDiskCache(str(tmpdir))
+    what = What('rfc', {'n_trees': 10})
+    assert what not in cache
+    assert cache.get(what) is None
+    assert cache.get(what, default=3) == 3
+    assert cache.put(what, {'auc': 0.9}) == {'auc': 0.9}
+    assert what in cache
+    assert cache.get(what) == {'auc': 0.9}
+    assert cache.get(what.id()) == {'auc': 0.9}
+    # no temporary files left behind
+    assert [name for _, _, names in os.walk(cache.root) for name in names] == ['rfc(n_trees=10).pkl']
+    assert cache.get_or_compute(what, lambda: 1 / 0) == {'auc': 0.9}
+    assert cache.delete(what)
+    assert not cache.delete(what)
+    assert cache.get_or_compute(what, lambda: 'computed') == 'computed'
+    # failed computations store nothing
+    with pytest.raises(ZeroDivisionError):
+        cache.get_or_compute(What('fails', {}), lambda: 1 / 0)
+    assert What('fails', {}) not in cache
+    cache.clear()
+    assert cache.entries() == []
+
+
+@pytest.mark.skipif(not has_numpy(), reason='the numpy serializer requires numpy')
+def test_disk_cache_numpy(tmpdir):
+    import numpy as np
+    cache = WhatamiDiskCache(str(tmpdir), serializer='numpy')
+    what = What('features', {'n': 100})
+    cache.put(what, np.arange(100))
+    loaded = cache.get(what)
+    assert isinstance(loaded, np.memmap)
+    assert np.array_equal(loaded, np.arange(100))
+    del loaded
+    cache = WhatamiDiskCache(str(tmpdir), serializer=NumpySerializer(mmap=False))
+    assert type(cache.get(what)) == np.ndarray
+    with pytest.raises(ValueError) as excinfo:
+        WhatamiDiskCache(str(tmpdir), serializer='json')
+    assert str(excinfo.value) == 'unknown serializer "json", must be one of [\'numpy\', \'pickle\']'
+
+
+def test_disk_cache_eviction(tmpdir):
+    cache = WhatamiDiskCache(str(tmpdir))
+    now = time.time()
+    for i in range(10):
+        what = What('result', {'i': i})
+        cache.put(what, b'x' * 1000)
+        os.utime(cache.path(what), (now - 100 * i, now - 100 * i))
+    assert len(cache.entries()) == 10
+    assert cache.evict() == 0
+    # by age
+    assert cache.evict(max_age=750) == 2
+    assert [What('result', {'i': i}) in cache for i in range(10)] == [True] * 8 + [False] * 2
+    # reading a result makes it recently used
+    os.utime(cache.path(What('result', {'i': 7})), (now - 700, now - 700))
+    assert cache.get(What('result', {'i': 7})) is not None
+    # by size, least recently used first
+    size = cache.entries()[0][1]
+    assert cache.evict(max_bytes=3 * size) == 5
+    kept = sorted(op.basename(path) for path, _, _ in cache.entries())
+    assert kept == ['result(i=0).pkl', 'result(i=1).pkl', 'result(i=7).pkl']
+    # automatic eviction
+    cache = WhatamiDiskCache(str(tmpdir), max_bytes=5 * size, evict_every=2)
+    for i in range(10, 20):
+        cache.put(What('result', {'i': i}), b'x' * 1000)
+    assert len(cache.entries()) <= 6
+
+
+def test_disk_cached_decorator(tmpdir):
+    calls = []
+
+    @disk_cached(str(tmpdir), non_id_keys=['verbose'])
+    def add(x, y=3, verbose=False):
+        calls.append((x, y))
+        return x + y
+
+    assert add(1) == 4
+    assert add(1, 3) == 4
+    assert add(x=1, verbose=True) == 4
+    assert add(2, y=5) == 7
+    assert calls == [(1, 3), (2, 5)]
+    assert add.__name__ == 'add'
+    assert add.cache.get(What('add', {'x': 2, 'y': 5})) == 7
+
+
+def test_disk_cache_concurrency(tmpdir):
+    cache = WhatamiDiskCache(str(tmpdir))
+    computations = []
+
+    def compute():
+        computations.append(1)
+        time.sleep(0.05)
+        return len(computations)
+
+    results = []
+    threads = [Thread(target=lambda: results.append(cache.get_or_compute(What('slow', {}), compute)))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [1] * 8
+    assert len(computations) == 1
+    # lock files are cleaned
+    assert [name for _, _, names in os.walk(cache.root) for name in names] == ['slow().pkl']
+
+
+def _compute_in_process(root):
+    def compute():
+        with open(op.join(root, 'computations.log'), 'a') as writer:
+            writer.write('computed\n')
+        time.sleep(0.1)
+        return 42
+    return WhatamiDiskCache(op.join(root, 'cache')).get_or_compute(What('slow', {}), compute)
+
+
+def test_disk_cache_processes(tmpdir):
+    import multiprocessing
+    pool = multiprocessing.Pool(4)
+    try:
+        assert pool.map(_compute_in_process, [str(tmpdir)] * 8) == [42] * 8
+    finally:
+        pool.close()
+        pool.join()
+    with open(op.join(str(tmpdir), 'computations.log')) as reader:
+        assert reader.read() == 'computed\n'
+
+
+def test_lru_cache():
+    cache = WhatamiLRUCache(max_entries=3)
+    for i in range(3):
+        cache.put(What('result', {'i': i}), i)
+    assert cache.get(What('result', {'i': 0})) == 0
+    cache.put(What('result', {'i': 3}), 3)
+    # the least recently used goes first
+    assert What('result', {'i': 1}) not in cache
+    assert [What('result', {'i': i}) in cache for i in (0, 2, 3)] == [True] * 3
+    assert cache.get('result(i=1)', default=-1) == -1
+    assert cache.get_or_compute('result(i=3)', lambda: 1 / 0) == 3
+    assert cache.stats() == (2, 1, 1, 3, 0)
+    assert cache.delete('result(i=3)')
+    assert not cache.delete('result(i=3)')
+    assert len(cache) == 2
+    cache.clear()
+    assert cache.stats() == (0, 0, 0, 0, 0)
+    # bounded by bytes
+    cache = WhatamiLRUCache(max_entries=None, max_bytes=100, sizeof=len)
+    cache.put('a()', 'x' * 60)
+    cache.put('b()', 'x' * 30)
+    cache.put('c()', 'x' * 20)
+    assert 'a()' not in cache
+    assert cache.stats().bytes == 50
+    cache.put('d()', 'x' * 101)
+    assert 'd()' not in cache
+    cache.put('b()', 'x' * 10)
+    assert cache.stats() == (0, 0, 1, 2, 30)
+    assert estimate_bytes([b'x' * 100]) > estimate_bytes(b'x' * 100) > 100
+
+
+def test_memoized():
+    calls = []
+
+    @memoized(max_entries=2, non_id_keys=['verbose'])
+    def total(values, scale=1, verbose=False):
+        calls.append(values)
+        return scale * sum(values)
+
+    assert total([1, 2]) == 3
+    assert total([1, 2], verbose=True) == 3
+    assert total([1, 2], scale=2) == 6
+    assert total([3]) == 3
+    assert total([1, 2]) == 3
+    assert calls == [[1, 2], [1, 2], [3], [1, 2]]
+    assert total.cache.stats() == (1, 4, 2, 2, 0)
+    assert total.__name__ == 'total'
+
+    # whatable functions keep their what
+    @memoized
+    @whatable
+    def scaled(x, scale=2):
+        return x * scale
+    assert scaled(3) == 6
+    assert scaled.what().id() == 'scaled(scale=2)'
+    assert 'scaled(scale=2,x=3)' in scaled.cache
+
+
+@pytest.mark.skipif(not has_numpy(), reason='array hashing requires numpy')
+def test_memoized_numpy():
+    import numpy as np
+    calls = []
+
+    @memoized(max_bytes=1000)
+    def normalize(x):
+        calls.append(1)
+        return x / x.sum()
+
+    normalize(np.arange(10.))
+    normalize(np.arange(10.))
+    normalize(np.arange(10.) + 1)
+    assert len(calls) == 2
+    assert normalize.cache.stats().bytes == 160
+    normalize(np.arange(200.))
+    assert normalize.cache.stats().entries == 2
+
+
+def test_lru_cache_threads():
+    cache = WhatamiLRUCache(max_entries=50)
+    errors = []
+
+    def work(seed):
+        try:
+            for i in range(500):
+                key = 'r(i=%d)' % ((i * seed) % 80)
+                assert cache.get_or_compute(key, lambda: key) == key
+        except Exception as e:  # pragma: no cover
+            errors.append(e)
+
+    threads = [Thread(target=work, args=(seed,)) for seed in range(1, 9)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    stats = cache.stats()
+    assert stats.hits + stats.misses == 8 * 500
+    assert stats.entries == 50
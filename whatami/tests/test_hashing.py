@@ -0,0 +1,74 @@
+# coding=utf-8
+
+# Authors: Santi Villalba <sdvillal@gmail.com>
+# Licence: BSD 3 clause
+
+from __future__ import absolute_import
+
+import pickle
+from threading import Thread
+
+import pytest
+
+from ..minijoblib.hashing import hasher, Hasher, NumpyHasher
+from ..plugins import has_numpy
+
+
+def fresh_hash(obj, hash_name='md5'):
+    try:
+        import numpy  # noqa
+        return NumpyHasher(hash_name=hash_name).hash(obj)
+    except ImportError:  # pragma: no cover
+        return Hasher(hash_name=hash_name).hash(obj)
+
+
+OBJECTS = [
+    1,
+    'one',
+    [1, 'one', (1.0, None)],
+    {'b': 1, 'a': [1, 2]},
+    # unorderable sets and dict keys make hashing reentrant
+    {1, 'one', (1, 'one')},
+    {1: 'one', 'one': 1},
+]
+
+
+def test_pooled_hasher_consistency():
+    for obj in OBJECTS:
+        assert hasher(obj) == fresh_hash(obj)
+        assert hasher(obj) == hasher(obj)
+        assert hasher(obj, hash_name='sha1') == fresh_hash(obj, hash_name='sha1')
+
+
+@pytest.mark.skipif(not has_numpy(), reason='array hashing requires numpy')
+def test_pooled_hasher_consistency_numpy():
+    # noinspection PyPackageRequirements
+    import numpy as np
+    arrays = [np.arange(10), np.arange(10.), np.arange(12).reshape((3, 4)).T, [np.arange(3), np.arange(3)]]
+    for array in arrays:
+        assert hasher(array) == fresh_hash(array)
+        assert hasher(array) == hasher(array)
+
+
+def test_pooled_hasher_reset_after_errors():
+    expected = hasher(OBJECTS[2])
+    with pytest.raises(pickle.PicklingError):
+        hasher([1, lambda x: x])
+    assert hasher(OBJECTS[2]) == expected
+
+
+def test_pooled_hasher_threads():
+    expected = [hasher(obj) for obj in OBJECTS]
+    results = {}
+
+    def work(i):
+        results[i] = [[hasher(obj) for obj in OBJECTS] for _ in range(50)]
+
+    threads = [Thread(target=work, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 8
+    for result in results.values():
+        assert all(got == expected for got in result)
@@ -10,6 +10,8 @@ from threading import Thread
 from future.utils import PY3
 from datetime import datetime
 import inspect
+import subprocess
+import sys
 from time import strptime, mktime
 
 from functools import partial
@@ -155,6 +157,23 @@ def test_lazy_imports():
     assert 'Trying to access whatever from module cool, but the library fails to import.' in str(excinfo.value)
     assert 'Maybe install it like "sudo apt-get cool"?' in str(excinfo.value)
 
+    # Modules are not imported until used
+    if 'colorsys' not in sys.modules:
+        colorsys = maybe_import('colorsys')
+        assert 'colorsys' not in sys.modules
+        assert colorsys.rgb_to_hsv(0, 0, 0) == (0, 0, 0)
+        assert 'colorsys' in sys.modules
+        assert maybe_import('colorsys') is sys.modules['colorsys']
+
+
+def test_import_is_lazy():
+    # Importing whatami should not import heavy optional dependencies, the parsing machinery, nor sqlite,
+    # nor opt-in subsystems
+    code = ('import sys, whatami; '
+            'print(sorted(set(sys.modules) & {"numpy", "pandas", "toolz", "cytoolz", "arpeggio", "sqlite3",'
+            ' "whatami.cache", "whatami.bloom", "whatami.sweep", "concurrent.futures", "multiprocessing"}))')
+    assert subprocess.check_output([sys.executable, '-c', code]).decode('utf-8').strip() == '[]'
+
 
 def test_init_argspec():
     args, _, _, defaults, required = init_argspec(Thread)
@@ -5,11 +5,14 @@
 
 from __future__ import absolute_import
 
+import random
+from threading import Thread
+
 import arpeggio
 from whatami import obj2what
 
 from ..what import What
-from ..parsers import parse_whatid
+from ..parsers import parse_whatid, default_whatami_parser, default_whatami_visitor
 
 import pytest
 
@@ -189,3 +192,47 @@ def test_arpeggio_resilience():
     what = parse_whatid("rfc(splits = {1, None, 'end'})")
     assert what.name == 'rfc'
     assert what.conf == {'splits': {1, None, 'end'}}
+
+
+def test_concurrent_parsing():
+    whatids = [What('rfc', {'n_trees': i, 'splits': [i, 'end', None], 'nested': What('a', {'x': {i: 'y' * i}})}).id()
+               for i in range(50)]
+    whatids += ["rfc(min=-inf,splits={1, None, 'end'},x=())", 'kurtosis=moments(x=std=Normal(mean=0,std=1))']
+    expected = [parse_whatid(whatid).id() for whatid in whatids]
+    results = {}
+
+    def parse_all(thread_num):
+        rng = random.Random(thread_num)
+        order = list(range(len(whatids))) * 4
+        rng.shuffle(order)
+        results[thread_num] = [(i, parse_whatid(whatids[i]).id()) for i in order]
+
+    threads = [Thread(target=parse_all, args=(thread_num,)) for thread_num in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 16
+    for result in results.values():
+        assert all(parsed == expected[i] for i, parsed in result)
+
+
+def test_deprecated_default_parsers():
+    from arpeggio import visit_parse_tree
+    from whatami import DEFAULT_WHATAMI_PARSER, DEFAULT_WHATAMI_VISITOR, OLD_WHATID_PARSER
+    from whatami.parsers import DEFAULT_WHATAMI_PARSER as parsers_default_parser
+    from whatami.whatutils import OLD_WHATID_PARSER as whatutils_old_parser
+    assert parsers_default_parser is DEFAULT_WHATAMI_PARSER
+    assert whatutils_old_parser is OLD_WHATID_PARSER
+    expected = What('rfc', {'n_trees': 10})
+    # passed to parse_whatid, they are the defaults of the calling thread
+    assert parse_whatid('rfc(n_trees=10)', parser=DEFAULT_WHATAMI_PARSER, visitor=DEFAULT_WHATAMI_VISITOR) == expected
+    # used directly, they forward to the defaults of the calling thread, warning
+    with pytest.warns(DeprecationWarning):
+        tree = DEFAULT_WHATAMI_PARSER.parse('rfc(n_trees=10)')
+    with pytest.warns(DeprecationWarning):
+        assert visit_parse_tree(tree, visitor=DEFAULT_WHATAMI_VISITOR) == expected
+    with pytest.warns(DeprecationWarning):
+        assert OLD_WHATID_PARSER.parse('rfc#n_trees=10') is not None
+    with pytest.raises(AttributeError):
+        DEFAULT_WHATAMI_PARSER.__not_a_method__
@@ -1,12 +1,15 @@
 # coding=utf-8
 """Test id string generation plugins on isolation."""
+import hashlib
 from collections import namedtuple, OrderedDict, defaultdict
 
 from future.utils import PY2, PY3
-from whatami import whatable
+from whatami import plugins, whatable
 
-from whatami.plugins import (string_plugin, rng_plugin, has_numpy,
-                             tuple_plugin, list_plugin, set_plugin, dict_plugin, numeric_type_plugin)
+from whatami.plugins import (string_plugin, rng_plugin, compact_rng_plugin, has_numpy, has_pandas,
+                             tuple_plugin, list_plugin, set_plugin, dict_plugin, numeric_type_plugin,
+                             numpy_plugin, memmap_plugin, path_plugin, file_digest, clear_file_digests,
+                             pandas_columnar_plugin, pandas_digest, _FILE_DIGESTS)
 import pytest
 
 # noinspection PyUnresolvedReferences
@@ -140,3 +143,315 @@ def test_numeric_type_plugin():
     def f(x=int):  # pragma: no cover
         return x
     assert f.what().id() == "f(x=int())"
+
+
+@pytest.mark.skipif(not has_numpy(),
+                    reason='windowed array hashing requires numpy')
+def test_windowed_array_hashing(monkeypatch):
+    # noinspection PyPackageRequirements
+    import numpy as np
+    from whatami.plugins import hasher
+    from whatami.minijoblib.hashing import NumpyHasher
+    x = np.arange(1000, dtype=np.float64).reshape((10, 100))
+    expectations = [hasher(x), hasher(x.T), hasher(x[:, ::3])]
+    # hashing by windows must not change the digest
+    monkeypatch.setattr(NumpyHasher, 'window_bytes', 7)
+    assert expectations == [hasher(x), hasher(x.T), hasher(x[:, ::3])]
+
+
+def test_file_digest(tmpdir, monkeypatch):
+    path = tmpdir.join('data.bin')
+    path.write_binary(b'whatami' * 1000)
+    clear_file_digests()
+    assert file_digest(str(path)) == hashlib.md5(b'whatami' * 1000).hexdigest()
+    assert file_digest(str(path), window=13) == hashlib.md5(b'whatami' * 1000).hexdigest()
+    assert file_digest(str(path), hash_name='sha1') == hashlib.sha1(b'whatami' * 1000).hexdigest()
+    # cached on file metadata...
+    assert len(_FILE_DIGESTS) == 2
+    # ...so changes are detected
+    path.write_binary(b'whatami' * 1001)
+    assert file_digest(str(path)) == hashlib.md5(b'whatami' * 1001).hexdigest()
+    # ...and digests of previous versions are forgotten
+    assert len(_FILE_DIGESTS) == 1
+    # the cache is bounded
+    monkeypatch.setattr(plugins, 'FILE_DIGESTS_MAX_SIZE', 3)
+    for i in range(5):
+        other = tmpdir.join('other%d.bin' % i)
+        other.write_binary(b'x')
+        file_digest(str(other))
+    assert len(_FILE_DIGESTS) == 3
+    clear_file_digests()
+    assert not _FILE_DIGESTS
+
+
+@pytest.mark.skipif(not PY3, reason='pathlib is not in the python 2 standard library')
+def test_path_plugin(tmpdir):
+    from pathlib import Path
+    path = tmpdir.join('data.bin')
+    path.write_binary(b'whatami')
+    assert path_plugin(str(path)) is None
+    expected = "%s(hash='%s')" % (Path(str(path)).__class__.__name__, hashlib.md5(b'whatami').hexdigest())
+    assert path_plugin(Path(str(path))) == expected
+
+
+@pytest.mark.skipif(not has_numpy(),
+                    reason='the memmap plugin requires numpy')
+def test_memmap_plugin(tmpdir):
+    # noinspection PyPackageRequirements
+    import numpy as np
+    path = str(tmpdir.join('array.npy'))
+    np.save(path, np.arange(100))
+    clear_file_digests()
+    mm = np.load(path, mmap_mode='r')
+    # same representation as numpy_plugin, but cached
+    assert memmap_plugin(mm) == numpy_plugin(mm)
+    assert len(_FILE_DIGESTS) == 1
+    assert memmap_plugin(np.load(path, mmap_mode='r')) == numpy_plugin(mm)
+    assert len(_FILE_DIGESTS) == 1
+    # views and writable memmaps are left to numpy_plugin
+    assert memmap_plugin(mm[::2]) is None
+    assert memmap_plugin(np.load(path, mmap_mode='r+')) is None
+    assert memmap_plugin(np.arange(100)) is None
+    clear_file_digests()
+
+
+@pytest.mark.skipif(not has_pandas(),
+                    reason='the columnar pandas plugin requires pandas')
+def test_pandas_columnar_plugin():
+    # noinspection PyPackageRequirements
+    import pandas as pd
+    df = pd.DataFrame({'x': [1, 2, 3], 'y': [0.5, 1.5, None], 'z': ['a', None, 'c']},
+                      columns=['x', 'y', 'z'], index=['r1', 'r2', 'r3'])
+    got = pandas_columnar_plugin(df)
+    assert got == "DataFrame(hash='%s')" % pandas_digest(df)
+    # equal contents, equal ids; column threading does not change hashes
+    assert got == pandas_columnar_plugin(df.copy())
+    assert pandas_digest(df) == pandas_digest(df, parallel_columns=1)
+    # hashes depend on values, column names, index, column order and dtypes
+    assert got != pandas_columnar_plugin(df.assign(x=[1, 2, 4]))
+    assert got != pandas_columnar_plugin(df.rename(columns={'x': 'w'}))
+    assert got != pandas_columnar_plugin(df.set_axis(['r1', 'r2', 'r4'], axis=0))
+    assert got != pandas_columnar_plugin(df[['y', 'x', 'z']])
+    assert got != pandas_columnar_plugin(df.astype({'x': 'float64'}))
+    # series
+    assert pandas_columnar_plugin(df['x']).startswith("Series(hash='")
+    assert pandas_columnar_plugin(df['x']) != pandas_columnar_plugin(df['x'].rename('w'))
+    assert pandas_columnar_plugin(df.values) is None
+    # hashes do not depend on id abbreviation
+    from whatami import What
+    from whatami.plugins import WhatamiPluginManager, pandas_plugin
+    with WhatamiPluginManager.scope():
+        WhatamiPluginManager.insert(pandas_columnar_plugin, before=pandas_plugin)
+        what = What('f', {'df': df, 's': df['x'], 'l': [1, 2]})
+        assert what.id(maxlength=1000, abbreviate=True) == what.id()
+
+
+@pytest.mark.skipif(not has_numpy(),
+                    reason='the numpy RandomState plugin requires numpy')
+def test_rng_plugin_compact():
+    # noinspection PyPackageRequirements
+    import numpy as np
+    rng = np.random.RandomState(0)
+    got = compact_rng_plugin(rng)
+    assert got == rng_plugin(rng, compact=True)
+    assert got.startswith("RandomState(pos=624,state='")
+    assert len(got) < len(rng_plugin(rng))
+    # same state, same id
+    assert got == compact_rng_plugin(np.random.RandomState(0))
+    # ...and depends on where are we on the pseudo-random sampling chain
+    rng.uniform(size=1)
+    assert compact_rng_plugin(rng).startswith("RandomState(pos=2,state='")
+    assert compact_rng_plugin(rng) != got
+    assert compact_rng_plugin(np.arange(3)) is None
+
+
+@pytest.mark.skipif(not has_numpy() or not hasattr(__import__('numpy').random, 'Generator'),
+                    reason='numpy Generators are only available from numpy 1.17')
+def test_rng_plugin_generators():
+    # noinspection PyPackageRequirements
+    import numpy as np
+    from whatami import parse_whatid
+    rng = np.random.default_rng(0)
+    got = rng_plugin(rng)
+    assert got.startswith("Generator(bit_generator=%s(state='" % rng.bit_generator.__class__.__name__)
+    assert got == rng_plugin(np.random.default_rng(0))
+    assert got == compact_rng_plugin(np.random.default_rng(0))
+    rng.uniform(size=1)
+    assert got != rng_plugin(rng)
+    # bit generators with a position in a key array
+    mt = np.random.MT19937(0)
+    assert rng_plugin(mt).startswith("MT19937(pos=%d,state='" % mt.state['state']['pos'])
+    # these are valid, parseable, ids
+    what = parse_whatid('f(rng=%s)' % rng_plugin(np.random.Generator(mt)))
+    assert what['rng'].name == 'Generator'
+    assert what['rng', 'bit_generator'].name == 'MT19937'
+
+
+def test_collection_summaries():
+    from whatami import What, parse_whatid
+    from whatami.plugins import WhatamiPluginManager
+
+    def md5(string):
+        return hashlib.md5(string.encode('utf-8')).hexdigest()
+
+    try:
+        # limit by number of elements
+        WhatamiPluginManager.summarize_collections(max_elements=2)
+        assert list_plugin([1, 2]) == '[1,2]'
+        assert list_plugin([1, 2, 3]) == "list(hash='%s',len=3)" % md5('[1,2,3]')
+        assert tuple_plugin((1, 2, 3)) == "tuple(hash='%s',len=3)" % md5('(1,2,3)')
+        assert set_plugin({3, 1, 2}) == "set(hash='%s',len=3)" % md5('{1,2,3}')
+        assert set_plugin(frozenset({3, 1, 2})) == "frozenset(hash='%s',len=3)" % md5('frozenset({1,2,3})')
+        assert dict_plugin({3: 1, 1: 2, 2: 3}) == "dict(hash='%s',len=3)" % md5('{1:2,2:3,3:1}')
+        assert set_plugin(set()) == 'set()'
+
+        # limit by rendered size; the digest does not depend on which limit is hit
+        WhatamiPluginManager.summarize_collections(max_bytes=7)
+        assert list_plugin([1, 2, 3]) == '[1,2,3]'
+        assert list_plugin([1, 2, 3, 4]) == "list(hash='%s',len=4)" % md5('[1,2,3,4]')
+        assert list_plugin(['abcdefghi']) == "list(hash='%s',len=1)" % md5("['abcdefghi']")
+
+        # subclasses and nesting
+        class MyList(list):
+            pass
+        assert list_plugin(MyList([1, 2, 3, 4])) == "MyList(seq=list(hash='%s',len=4))" % md5('[1,2,3,4]')
+        nested = "[list(hash='%s',len=4)]" % md5('[1,2,3,4]')
+        assert list_plugin([[1, 2, 3, 4]]) == "list(hash='%s',len=1)" % md5(nested)
+
+        # summaries are valid ids, that roundtrip
+        what = What('features', {'names': ['name%d' % i for i in range(100)]})
+        what_id = what.id()
+        assert what_id == "features(names=list(hash='%s',len=100))" % md5(
+            '[%s]' % ','.join("'name%d'" % i for i in range(100)))
+        parsed = parse_whatid(what_id)
+        assert parsed['names'].name == 'list'
+        assert parsed['names']['len'] == 100
+        assert parsed.id() == what_id
+    finally:
+        WhatamiPluginManager.summarize_collections()
+    assert list_plugin([1, 2, 3, 4]) == '[1,2,3,4]'
+
+
+def test_plugin_scopes():
+    from threading import Thread, Event
+    from whatami import What
+    from whatami.plugins import WhatamiPluginManager
+
+    def big_float_plugin(v):
+        # value dependent: later floats must not be dispatched directly to anyobject_plugin
+        if isinstance(v, float) and v > 1:
+            return "'big'"
+
+    what = What('f', {'x': 0.5, 'y': 2.0})
+    assert what.id() == 'f(x=0.5,y=2.0)'
+
+    # scoped changes do not leak
+    with WhatamiPluginManager.scope() as plugins:
+        assert plugins == WhatamiPluginManager.DEFAULT_PLUGINS
+        WhatamiPluginManager.insert(big_float_plugin, before=string_plugin)
+        assert what.id() == "f(x=0.5,y='big')"
+        assert What('f', {'x': 3.0, 'y': 0.1}).id() == "f(x='big',y=0.1)"
+        with WhatamiPluginManager.scope():
+            WhatamiPluginManager.reset()
+            assert what.id() == 'f(x=0.5,y=2.0)'
+        assert what.id() == "f(x=0.5,y='big')"
+    assert big_float_plugin not in WhatamiPluginManager.plugins()
+    assert what.id() == 'f(x=0.5,y=2.0)'
+
+    # scoped changes do not affect other threads
+    inserted, checked = Event(), Event()
+    results = {}
+
+    def scoped():
+        with WhatamiPluginManager.scope():
+            WhatamiPluginManager.insert(big_float_plugin, before=string_plugin)
+            inserted.set()
+            checked.wait()
+            results['scoped'] = what.id()
+
+    def unscoped():
+        inserted.wait()
+        results['unscoped'] = what.id()
+        checked.set()
+
+    threads = [Thread(target=scoped), Thread(target=unscoped)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == {'scoped': "f(x=0.5,y='big')", 'unscoped': 'f(x=0.5,y=2.0)'}
+
+    # scopes can be given explicit plugin chains
+    with WhatamiPluginManager.scope(plugins=(big_float_plugin,) + WhatamiPluginManager.DEFAULT_PLUGINS):
+        assert what.id() == "f(x=0.5,y='big')"
+    assert what.id() == 'f(x=0.5,y=2.0)'
+
+
+def test_rendering_memo():
+    from whatami import What
+    from whatami.plugins import WhatamiPluginManager
+
+    class Expensive(object):
+        renders = 0
+
+    def expensive_plugin(v):
+        if isinstance(v, Expensive):
+            Expensive.renders += 1
+            return 'Expensive(n=%d)' % Expensive.renders
+
+    shared = Expensive()
+    what = What('pipeline', {'a': shared,
+                             'b': [shared, shared, Expensive()],
+                             'c': What('step', {'x': shared, 'y': {'z': shared}})})
+    with WhatamiPluginManager.scope():
+        WhatamiPluginManager.insert(expensive_plugin)
+        # shared objects are rendered once per top level id
+        assert what.id() == ('pipeline(a=Expensive(n=1),b=[Expensive(n=1),Expensive(n=1),Expensive(n=2)],'
+                             "c=step(x=Expensive(n=1),y={'z':Expensive(n=1)}))")
+        assert Expensive.renders == 2
+        # ...but not across top level ids
+        assert what.id().startswith('pipeline(a=Expensive(n=3)')
+        assert WhatamiPluginManager.build_string([shared, shared]) == '[Expensive(n=5),Expensive(n=5)]'
+
+
+def test_cycles_and_depth():
+    from functools import partial
+    from whatami import What, whatareyou
+    from whatami.plugins import WhatamiPluginManager, anyobject0x_plugin
+
+    class Node(object):
+        def __init__(self, children=()):
+            self.children = list(children)
+
+    root = Node([Node(), Node()])
+    root.children[1].children.append(root)
+
+    with WhatamiPluginManager.scope():
+        WhatamiPluginManager.insert(partial(anyobject0x_plugin, deep=True), before=anyobject0x_plugin)
+        try:
+            # cycles are detected immediately
+            with pytest.raises(ValueError) as excinfo:
+                whatareyou(root).id()
+            assert 'cycle detected while generating an id: list object references itself' in str(excinfo.value)
+            # ...or marked
+            WhatamiPluginManager.limit_recursion(on_cycle='mark')
+            assert whatareyou(root).id() == ('Node(children=[Node(children=[]),'
+                                             'Node(children=[Node(children=backref(up=4))])])')
+            # shared, acyclic, references are not cycles
+            leaf = Node()
+            assert whatareyou(Node([leaf, leaf])).id() == 'Node(children=[Node(children=[]),Node(children=[])])'
+            # depth limits
+            deep = []
+            for _ in range(50):
+                deep = [deep]
+            assert What('f', {'x': deep}).id() == 'f(x=%s%s)' % ('[' * 51, ']' * 51)
+            WhatamiPluginManager.limit_recursion(max_depth=50)
+            with pytest.raises(ValueError) as excinfo:
+                What('f', {'x': deep}).id()
+            assert 'maximum depth (50) exceeded while generating an id for a list' in str(excinfo.value)
+            with pytest.raises(ValueError):
+                WhatamiPluginManager.limit_recursion(on_cycle='ignore')
+        finally:
+            WhatamiPluginManager.limit_recursion()
+    # bookkeeping is cleaned after errors
+    assert What('f', {'x': [1, [2]]}).id() == 'f(x=[1,[2]])'
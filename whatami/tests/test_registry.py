@@ -6,15 +6,20 @@
 from __future__ import absolute_import
 
 from whatami import call_dict
-from ..what import whatable
-from ..registry import WhatamiRegistry, Recorder
+from ..what import What, whatable
+from ..registry import WhatamiRegistry, SQLiteWhatamiRegistry, Recorder
 
 import pytest
 
 
-@pytest.fixture()
-def registry():
-    return WhatamiRegistry()
+REGISTRIES = ['memory', 'digest', 'sqlite']
+
+
+@pytest.fixture(params=REGISTRIES, ids=REGISTRIES)
+def registry(request, tmpdir):
+    if request.param == 'sqlite':
+        return SQLiteWhatamiRegistry(str(tmpdir.join('registry.sqlite')))
+    return WhatamiRegistry(digest_ids=request.param == 'digest')
 
 
 WHAT2NICKS = ['rfc0']
@@ -94,6 +99,13 @@ def test_remove(registry, what2nick):
     assert 'at least one of nickname or what must be provided' == str(excinfo.value)
 
 
+def test_remove_by_both(registry, what2nick):
+    what, whatid, nick = what2nick
+    registry.register(what, nick)
+    registry.remove(what=what, nickname=nick)
+    assert registry.list() == []
+
+
 def test_reset(registry, what2nick):
     what, whatid, nick = what2nick
     assert what == registry.register(what, nick)
@@ -102,6 +114,104 @@ def test_reset(registry, what2nick):
     assert registry.list() == []
 
 
+def test_register_many(registry):
+    registry.register('rfc(n_trees=10)', 'rfc10')
+    registry.register_many([('rfc(n_trees=%d)' % n, 'rfc%d' % n) for n in range(100)])
+    assert len(registry.list()) == 100
+
+    # registration is all or nothing
+    for pairs in ([('rfc(n_trees=1000)', 'rfc1000'), ('rfc(n_trees=1)', 'rfc_one')],
+                  [('rfc(n_trees=1000)', 'rfc1000'), ('lr()', 'rfc5')],
+                  [('rfc(n_trees=1000)', 'rfc1000'), ('rfc(n_trees=1000)', 'rfc_thousand')],
+                  [('rfc(n_trees=1000)', 'rfc1000'), ('rfc(n_trees=2000)', 'rfc1000')],
+                  [('rfc(n_trees=1000)', 'rfc1000'), ('rfc()', None)]):
+        with pytest.raises(Exception):
+            registry.register_many(pairs)
+        assert len(registry.list()) == 100
+        assert registry.id2nick('rfc(n_trees=1000)') is None
+
+    # ids are computed once per distinct object
+    computed = []
+
+    class Model(object):
+        def __init__(self, n):
+            self.n = n
+
+        def what(self):
+            computed.append(self.n)
+            return What('model', {'n': self.n})
+
+    models = [Model(n) for n in range(3)]
+    registry.register_many([(models[0], 'm0'), (models[1], 'm1'), (models[0], 'm0')])
+    assert computed == [0, 1]
+    assert registry.nick_or_id_many(models * 2 + ['rfc(n_trees=3)']) == \
+        ['m0', 'm1', 'model(n=2)', 'm0', 'm1', 'model(n=2)', 'rfc3']
+    assert computed == [0, 1, 0, 1, 2]
+    assert registry.id2nick_many(['model(n=0)', 'model(n=2)', 'model(n=0)']) == ['m0', None, 'm0']
+    assert registry.id2nick_many([]) == []
+
+
+def test_digest_ids():
+    registry = WhatamiRegistry(digest_ids=True)
+    whatid = "pipeline(steps=[%s])" % ','.join(['scaler(with_mean=True)'] * 100)
+    registry.register(whatid, 'pipeline')
+    assert list(registry._id2nick) == [registry._key(whatid)]
+    assert len(registry._key(whatid)) == 16
+    assert registry.id2nick(whatid) == 'pipeline'
+    assert registry.nick_or_id(whatid) == 'pipeline'
+
+    # digest collisions are detected
+    registry._key = lambda whatid: b'collision'
+    registry.reset()
+    registry.register('rfc()', 'rfc')
+    assert registry.id2nick('lr()') is None
+    assert registry.nick_or_id('lr()') == 'lr()'
+    with pytest.raises(Exception) as excinfo:
+        registry.register('lr()', 'lr')
+    assert 'ids "lr()" and "rfc()" have the same digest' in str(excinfo.value)
+    for pairs in ([('svm()', 'svm'), ('lr()', 'lr')], [('rfc()', 'rfc'), ('svm()', 'svm')]):
+        with pytest.raises(Exception) as excinfo:
+            registry.register_many(pairs)
+        assert 'have the same digest' in str(excinfo.value)
+    assert registry.list() == [('rfc', 'rfc()')]
+
+
+def test_sqlite_registry(tmpdir):
+    path = str(tmpdir.join('registry.sqlite'))
+    with pytest.raises(ValueError):
+        SQLiteWhatamiRegistry(path, readonly=True).nick2id('rfc')
+
+    registry = WhatamiRegistry()
+    registry.register('rfc(n_trees=10)', 'rfc10')
+    with SQLiteWhatamiRegistry.from_registry(registry, path) as sqlite_registry:
+        assert sqlite_registry.list() == registry.list()
+        sqlite_registry.register_many([('rfc(n_trees=%d)' % n, 'rfc%d' % n) for n in range(100)])
+        assert len(sqlite_registry) == 100
+
+    # persistence, many readers
+    readers = [SQLiteWhatamiRegistry(path, readonly=True) for _ in range(3)]
+    assert all(reader.nick_or_id('rfc(n_trees=42)') == 'rfc42' for reader in readers)
+    assert readers[0].nick_or_id('rfc(n_trees=420)') == 'rfc(n_trees=420)'
+    with pytest.raises(ValueError):
+        readers[0].register('lr()', 'lr')
+    with pytest.raises(Exception):
+        readers[0].connection.execute('DELETE FROM entries')
+    assert len(readers[0]) == 100
+    # writes are seen by open readers
+    with SQLiteWhatamiRegistry(path) as writer:
+        writer.register('lr()', 'lr')
+    assert all(reader.nick2id('lr') == 'lr()' for reader in readers)
+    # failed transactions are rolled back, and do not leave the registry in a transaction
+    with SQLiteWhatamiRegistry(path) as writer:
+        with pytest.raises(Exception):
+            writer.register_many([('svm()', 'svm'), ('lr(C=2)', 'lr')])
+        assert writer.nick2id('svm') is None
+        writer.register('svm()', 'svm')
+    assert readers[0].nick2id('svm') == 'svm()'
+    for reader in readers:
+        reader.close()
+
+
 def test_recorder_basic():
     rec = Recorder(name='registry', id_column_name='name', register='me')
     assert rec.name == 'registry'
@@ -0,0 +1,236 @@
+# coding=utf-8
+
+# Authors: Santi Villalba <sdvillal@gmail.com>
+# Licence: BSD 3 clause
+
+from __future__ import absolute_import
+
+import os.path as op
+import threading
+
+import pytest
+
+from ..cache import WhatamiDiskCache, WhatamiLRUCache
+from ..sweep import CompletionLog, StageScheduler, run_sweep
+from ..what import What
+
+
+def square(what):
+    return what['x'] ** 2
+
+
+def test_completion_log(tmpdir):
+    path = op.join(str(tmpdir), 'done.log')
+    with CompletionLog(path) as log:
+        log.record(What('rfc', {'n_trees': 10}))
+        log.record("rfc(name='with\\nnewline')")
+        log.record('rfc(n_trees=10)')
+        assert len(log) == 2
+    # a crash while writing leaves a torn line
+    with open(path, 'ab') as writer:
+        writer.write(b'"rfc(n_trees=')
+    with CompletionLog(path) as log:
+        assert What('rfc', {'n_trees': 10}) in log
+        assert "rfc(name='with\\nnewline')" in log
+        assert len(log) == 2
+
+
+def test_run_sweep(tmpdir):
+    calls = []
+    lock = threading.Lock()
+
+    def func(what):
+        with lock:
+            calls.append(what['x'])
+        if what['x'] == 13:
+            raise ValueError('unlucky')
+        return what['x'] ** 2
+
+    whats = [What('square', {'x': x}) for x in range(20)]
+    results = {}
+    with CompletionLog(op.join(str(tmpdir), 'done.log')) as log:
+        report = run_sweep(func, whats + whats[:5], log, executor='thread', max_workers=4, max_in_flight=3,
+                           on_result=results.__setitem__)
+        assert report[:3] == (20, 19, 5)
+        assert [(whatid, str(e)) for whatid, e in report.failed] == [('square(x=13)', 'unlucky')]
+        assert sorted(calls) == list(range(20))
+        assert results == {'square(x=%d)' % x: x ** 2 for x in range(20) if x != 13}
+        # run again, just failures are run
+        del calls[:]
+        report = run_sweep(func, (What('square', {'x': x}) for x in range(20)), log, executor='thread')
+        assert report[:3] == (1, 0, 19)
+        assert calls == [13]
+        # stop at the first failure
+        with pytest.raises(ValueError) as excinfo:
+            run_sweep(func, whats, log, executor='thread', raise_errors=True)
+        assert str(excinfo.value) == 'unlucky'
+    with pytest.raises(ValueError):
+        run_sweep(func, whats, object(), executor='thread')
+    with pytest.raises(ValueError):
+        run_sweep(func, whats, log, executor='cluster')
+    with pytest.raises(ValueError):
+        run_sweep(func, whats, log, max_in_flight=0)
+
+
+def test_run_sweep_resumes(tmpdir):
+    # a sweep interrupted by an error resumes without recomputing finished work
+    calls = []
+    fail = [True]
+
+    def func(what):
+        calls.append(what['x'])
+        if what['x'] == 5 and fail[0]:
+            raise KeyboardInterrupt()
+        return what['x']
+
+    whats = [What('f', {'x': x}) for x in range(10)]
+    path = op.join(str(tmpdir), 'done.log')
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        with CompletionLog(path) as log:
+            with pytest.raises(KeyboardInterrupt):
+                run_sweep(func, whats, log, executor=executor, max_in_flight=1)
+    fail[0] = False
+    with CompletionLog(path) as log:
+        assert len(log) == 5
+        del calls[:]
+        assert run_sweep(func, whats, log, executor='thread', max_workers=1)[:3] == (5, 5, 5)
+        assert sorted(calls) == list(range(5, 10))
+
+
+def test_run_sweep_custom_executor():
+    from concurrent.futures import Executor, Future
+
+    class InlineExecutor(Executor):
+        """Runs each submission right away, it does not have the private _max_workers of the stdlib pools."""
+
+        def submit(self, fn, *args, **kwargs):
+            future = Future()
+            future.set_result(fn(*args, **kwargs))
+            return future
+
+    whats = [What('square', {'x': x}) for x in range(10)]
+    store = WhatamiLRUCache()
+    assert run_sweep(square, whats, store, executor=InlineExecutor()) == (10, 10, 0, [])
+    assert run_sweep(square, whats[:3], store, executor=InlineExecutor(), max_workers=1) == (0, 0, 3, [])
+    assert store.get(whats[7]) == 49
+
+
+def test_run_sweep_processes_and_disk_cache(tmpdir):
+    cache = WhatamiDiskCache(str(tmpdir))
+    whats = [What('square', {'x': x}) for x in range(10)]
+    assert run_sweep(square, whats, cache, max_workers=2) == (10, 10, 0, [])
+    assert cache.get(What('square', {'x': 7})) == 49
+    assert run_sweep(square, whats, cache, max_workers=2) == (0, 0, 10, [])
+
+
+def test_stage_scheduler():
+    load = What('load', {'name': 'iris'})
+    scale = What('scale', {'data': load, 'with_std': True})
+    whats = [What('rfc', {'data': scale, 'n_trees': 10}),
+             "rfc(data=scale(data=load(name='iris'),with_std=True),n_trees=100)",
+             What('stack', {'models': [What('rfc', {'data': scale, 'n_trees': 10}), What('lr', {'data': load})]})]
+    scheduler = StageScheduler(whats)
+
+    # shared stages come first, and once
+    assert scheduler.order == [load.id(), scale.id(),
+                               'rfc(data=scale(data=load(name=\'iris\'),with_std=True),n_trees=10)',
+                               'rfc(data=scale(data=load(name=\'iris\'),with_std=True),n_trees=100)',
+                               'lr(data=load(name=\'iris\'))',
+                               scheduler.roots[2]]
+    report = scheduler.run(dry_run=True)
+    assert (report.roots, report.stages, report.executions, report.executions_without_reuse) == (3, 6, 6, 12)
+    report = scheduler.report(cost=lambda what: 10 if what.name == 'load' else 1)
+    assert (report.cost, report.cost_without_reuse) == (15, 12 + 4 * 9)
+
+    calls = []
+
+    def run(what, conf):
+        calls.append(what.name)
+        if what.name == 'load':
+            return 2
+        if what.name == 'scale':
+            return conf['data'] * 3
+        if what.name == 'stack':
+            return sum(conf['models'])
+        return conf['data'] + conf.get('n_trees', 0)
+
+    results = scheduler.run(run)
+    assert sorted(calls) == ['load', 'lr', 'rfc', 'rfc', 'scale', 'stack']
+    assert list(results.values()) == [16, 106, 18]
+    assert list(results) == scheduler.roots
+
+    # with a store, done stages are not run again
+    store = WhatamiLRUCache()
+    store.put(scheduler.roots[1], 106)
+    assert scheduler.report(store=store).executions == 5
+    del calls[:]
+    assert scheduler.run(run, store=store) == results
+    assert sorted(calls) == ['load', 'lr', 'rfc', 'scale', 'stack']
+    del calls[:]
+    assert scheduler.run({'rfc': run, 'scale': run, 'load': run, 'lr': run, 'stack': run}, store=store) == results
+    assert calls == []
+    assert scheduler.report(store=store).cached == 6
+
+    with pytest.raises(ValueError):
+        scheduler.run()
+
+
+def test_stage_scheduler_non_id_keys():
+    load = What('load', {'name': 'iris'})
+    logger = What('logger', {'level': 'debug'})
+    whats = [What('rfc', {'data': load, 'logger': logger, 'n_trees': n}, non_id_keys=['logger']) for n in (1, 2)]
+    scheduler = StageScheduler(whats)
+    # Whats under non-id keys are not stages, and are passed as they are
+    assert scheduler.order == [load.id(), whats[0].id(), whats[1].id()]
+
+    def run(what, conf):
+        if what.name == 'load':
+            return 10
+        assert conf['logger'] is logger
+        return conf['data'] * conf['n_trees']
+
+    assert list(scheduler.run(run).values()) == [10, 20]
+
+
+def test_stage_scheduler_containers():
+    from collections import namedtuple, OrderedDict
+    Pair = namedtuple('Pair', ['first', 'second'])
+    load = What('load', {})
+    whats = [What('m', {'data': load, 'p': Pair(1, 2)}),
+             What('n', {'data': OrderedDict([('b', load), ('a', 1)]), 'p': Pair(load, (load, 3))})]
+    confs = {}
+
+    def run(what, conf):
+        confs[what.name] = conf
+        return 0 if what.name == 'load' else 1
+
+    StageScheduler(whats).run(run)
+    # values without Whats are passed as they are; containers with Whats keep their types
+    assert confs['m']['p'] is whats[0]['p']
+    assert confs['n']['data'] == OrderedDict([('b', 0), ('a', 1)])
+    assert type(confs['n']['data']) is OrderedDict
+    assert confs['n']['p'] == Pair(0, (0, 3))
+    assert type(confs['n']['p']) is Pair
+
+
+def test_stage_scheduler_loads_results_once():
+
+    class CountingStore(WhatamiLRUCache):
+        gets = []
+
+        def get(self, what, default=None):
+            self.gets.append(what)
+            return super(CountingStore, self).get(what, default)
+
+    load = What('load', {'name': 'iris'})
+    whats = [What('rfc', {'data': load, 'n_trees': n}) for n in (1, 2)]
+    scheduler = StageScheduler(whats)
+    store = CountingStore()
+    store.put(load.id(), 10)
+    store.put(whats[0].id(), 10)
+    assert scheduler.report(store=store).executions == 1
+    assert scheduler.run(dry_run=True, store=store).cached == 2
+    assert store.gets == []
+    assert list(scheduler.run(lambda what, conf: conf['data'] * conf['n_trees'], store=store).values()) == [10, 20]
+    assert sorted(store.gets) == sorted([load.id(), whats[0].id()])
@@ -58,7 +58,7 @@ def test_what_str_magic(c1, c2, c3):
 
 
 def test_what_repr_magic(c1):
-    empty_dict_repr = 'set()' if PY3 else 'set([])'
+    empty_dict_repr = 'frozenset()' if PY3 else 'frozenset([])'
     result = repr(c1.what()).replace("'", "'")
     assert "What('C1', {" in result
     assert "'p2': 'bleh'" in result
@@ -223,3 +223,196 @@ def test_to_dict(c1, c2, c3):
                                         'whatami_out_name': None,
                                         'whatami_conf': {'p2': 'bleh', 'length': 1, 'p1': 'blah'}}}}
     assert c3.what().to_dict() == expected
+
+
+def test_digest_id(c1, c2, c3):
+    from ..plugins import WhatamiPluginManager
+
+    # digests depend on configurations, not identities, and respect non-id keys
+    for c in (c1, c2, c3):
+        assert c.what().digest_id() == c.what().digest_id()
+        assert c.what().digest_id() == id2what(c.what().id()).digest_id()
+        assert c.what().digest_id(cache=True) == c.what().digest_id()
+    assert c3.what().digest_id() == c3.what().set('irrelevant', False).digest_id()
+    assert What('a', {'x': 1}).digest_id() != What('a', {'x': 2}).digest_id()
+    assert What('a', {'x': 1}).digest_id() != What('b', {'x': 1}).digest_id()
+    assert What('a', {'x': 1}).digest_id() != What('a', {'x': 1}, out_name='o').digest_id()
+    assert What('a', {'x': [1]}).digest_id() != What('a', {'x': (1,)}).digest_id()
+
+    class Leaf(object):
+        renders = 0
+
+        def __init__(self, value):
+            self.value = value
+
+    def leaf_plugin(v):
+        if isinstance(v, Leaf):
+            Leaf.renders += 1
+            return 'Leaf(value=%r)' % v.value
+
+    with WhatamiPluginManager.scope():
+        WhatamiPluginManager.insert(leaf_plugin)
+        rfc = What('rfc', {'n_trees': Leaf(100), 'seed': Leaf(0)})
+        steps = {'scaler': What('scaler', {'mean': Leaf(True)})}
+        pipeline = What('pipeline', {'steps': [rfc], 'named': steps, 'data': Leaf('x')})
+        digest = pipeline.digest_id(cache=True)
+        assert Leaf.renders == 4
+        assert pipeline.digest_id(cache=True) == digest
+        assert Leaf.renders == 4
+        # only the changed leaf is rendered again
+        rfc.set('n_trees', Leaf(200))
+        changed_digest = pipeline.digest_id(cache=True)
+        assert Leaf.renders == 5
+        assert changed_digest != digest
+        assert changed_digest == What('pipeline', {'steps': [What('rfc', {'n_trees': Leaf(200), 'seed': Leaf(0)})],
+                                                   'named': {'scaler': What('scaler', {'mean': Leaf(True)})},
+                                                   'data': Leaf('x')}).digest_id()
+        steps['scaler'].set('mean', Leaf(False))
+        assert pipeline.digest_id(cache=True) not in (digest, changed_digest)
+        assert Leaf.renders == 10
+
+
+def test_digest_id_caches_subtrees(monkeypatch):
+    from .. import what as what_module
+    from ..plugins import WhatamiPluginManager
+
+    # a tree of 1 + 10 + 100 + 1000 Whats
+    leaves = [[[What('leaf', {'x': 100 * i + 10 * j + k}) for k in range(10)] for j in range(10)] for i in range(10)]
+    tree = What('root', {'children': [What('child', {'i': i, 'children': [What('grandchild', {'j': j, 'leaves': ls})
+                                                                          for j, ls in enumerate(grandchildren)]})
+                                      for i, grandchildren in enumerate(leaves)]})
+    digest = tree.digest_id(cache=True)
+
+    # count the digests of Whats computed
+    computed = []
+
+    class CountingHashlib(object):
+        @staticmethod
+        def sha1(data=b''):
+            if data == b'What(':
+                computed.append(1)
+            return hashlib.sha1(data)
+
+    monkeypatch.setattr(what_module, 'hashlib', CountingHashlib)
+    assert tree.digest_id(cache=True) == digest
+    assert not computed
+    # changing a leaf recomputes just the path to the root
+    leaves[3][4][5].set('x', -1)
+    changed_digest = tree.digest_id(cache=True)
+    assert len(computed) == 4
+    assert changed_digest != digest
+    assert changed_digest == tree.digest_id()
+    monkeypatch.undo()
+
+    # caches are not reused with different plugins
+    def float_plugin(v):
+        if isinstance(v, float):
+            return "'F'"
+
+    what = What('f', {'x': 0.5, 'g': What('g', {'y': 0.5})})
+    digest = what.digest_id(cache=True)
+    with WhatamiPluginManager.scope():
+        WhatamiPluginManager.insert(float_plugin, before=WhatamiPluginManager.plugins()[0])
+        assert what.digest_id(cache=True) == what.digest_id() != digest
+        what['g'].set('y', 1.5)
+        assert what.digest_id(cache=True) == what.digest_id()
+    # the change is noticed by the digest cached before the scope too
+    assert what.digest_id(cache=True) == what.digest_id() != digest
+
+
+def test_digest_id_default_is_not_cached():
+    # by default, digests notice changes made without set
+    what = What('f', {'x': [1], 'g': What('g', {'y': 1})})
+    digest = what.digest_id()
+    what.conf['x'] = [2]
+    assert what.digest_id() == What('f', {'x': [2], 'g': What('g', {'y': 1})}).digest_id() != digest
+    what['x'].append(3)
+    what['g'].conf['y'] = 2
+    assert what.digest_id() == What('f', {'x': [2, 3], 'g': What('g', {'y': 2})}).digest_id()
+
+
+def test_abbreviated_ids():
+    from ..whatutils import parse_whatid
+
+    # short ids are untouched
+    what = What('rfc', {'n_trees': 10, 'seed': 0})
+    assert what.id(maxlength=100, abbreviate=True) == what.id()
+
+    # only the oversized subtree gets replaced by its digest
+    gini = What('gini', {'weights': list(range(100)), 'normalize': True})
+    what = What('rfc', {'n_trees': 10, 'criterion': gini, 'seed': 0})
+    abbreviated = what.id(maxlength=100, abbreviate=True)
+    assert len(abbreviated) <= 100
+    assert abbreviated == "rfc(criterion=gini(hash='%s'),n_trees=10,seed=0)" % gini.id(maxlength=1)
+    assert parse_whatid(abbreviated).name == 'rfc'
+
+    # collections keep their length around
+    abbreviated = what.id(maxlength=150, abbreviate=True)
+    assert len(abbreviated) <= 150
+    assert 'gini(normalize=True,weights=list(hash=' in abbreviated
+    assert abbreviated.endswith(",len=100)),n_trees=10,seed=0)")
+    assert parse_whatid(abbreviated).name == 'rfc'
+
+    # when nothing helps, we fall back to the sha1 of the full id
+    assert what.id(maxlength=40, abbreviate=True) == what.id(maxlength=40)
+    assert len(what.id(maxlength=40, abbreviate=True)) == 40
+
+    # abbreviation does not leak state into later renderings
+    assert what.id() == what.id(maxlength=0, abbreviate=True)
+    assert '\x00' not in what.id()
+
+
+def test_abbreviated_ids_unchanged_when_fitting():
+    # sets and dicts are sorted by their rendered elements, not by placeholders
+    for what in (What('f', {'x': {(2,), (1,), (10,)}}),
+                 What('f', {'x': frozenset([(2,), (1,), (10,)])}),
+                 What('f', {'x': {(2,): [2], (1,): [1], (10,): [10]}}),
+                 What('f', {'x': {'b': What('g', {'y': [2]}), 'a': What('h', {'y': [1]})}})):
+        assert what.id(maxlength=1000, abbreviate=True) == what.id()
+    # values looking like placeholders are left alone
+    what = What('f', {'s': 'a\x000\x01b', 'l': [1, 2]})
+    assert what.id(maxlength=1000, abbreviate=True) == what.id()
+    assert what.id(maxlength=20, abbreviate=True) == what.id(maxlength=20)
+
+
+def test_pickling():
+    import pickle
+    rfc = What('rfc', {'n_trees': 100, 'n_jobs': 4}, non_id_keys=['n_jobs'], out_name='model')
+    pipeline = What('pipeline', {'steps': [What('scaler', {}), rfc], 'verbose': True}, non_id_keys=('verbose',))
+    pipeline.digest_id(cache=True)
+    for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+        roundtripped = pickle.loads(pickle.dumps(pipeline, protocol=protocol))
+        assert roundtripped == pipeline
+        assert roundtripped.id(nonids_too=True) == pipeline.id(nonids_too=True)
+        assert roundtripped.non_id_keys == {'verbose'}
+        assert roundtripped['steps'][1].non_id_keys == {'n_jobs'}
+        assert roundtripped['steps'][1].out_name == 'model'
+        assert roundtripped['steps'][0].non_id_keys == set()
+        # the digests cache is not transported, but it is rebuilt on demand
+        assert roundtripped._digests is None
+        assert roundtripped.digest_id() == pipeline.digest_id()
+    # equal non_id_keys are stored once per pickle
+    whats = [What('rfc', {'n_trees': i, 'n_jobs': 4, 'verbose': True}, non_id_keys=['n_jobs', 'verbose'])
+             for i in range(100)]
+    pickled = pickle.dumps(whats, protocol=2)
+    assert pickled.count(b'verbose') == 1
+    assert [what.non_id_keys for what in pickle.loads(pickled)] == [{'n_jobs', 'verbose'}] * 100
+
+
+def test_flyweights():
+    from ..binary import what2bytes, bytes2what
+    from ..parsers import parse_whatid
+    name, key = ''.join(['r', 'fc']), ''.join(['n_', 'jobs'])
+    w1 = What(name, {'n_trees': 10, key: 4}, non_id_keys=[key])
+    w2 = What('rfc', {'n_trees': 20, 'n_jobs': 4}, non_id_keys=('n_jobs',))
+    # names are interned, non-id keys shared
+    assert w1.name is w2.name
+    assert w1.non_id_keys is w2.non_id_keys
+    assert isinstance(w1.non_id_keys, frozenset)
+    assert What('a', {}).non_id_keys is What('b', {}, non_id_keys=()).non_id_keys
+    assert w1.copy().non_id_keys is w1.non_id_keys
+    # parsed and decoded Whats share names and keys
+    for p1, p2 in ((parse_whatid(w1.id()), parse_whatid(w2.id())),
+                   (bytes2what(what2bytes(w1)), bytes2what(what2bytes(w2)))):
+        assert p1.name is p2.name is w2.name
+        assert [k for k in p1.conf if k == 'n_trees'][0] is [k for k in p2.conf if k == 'n_trees'][0]
@@ -66,17 +66,63 @@ buy(currency='euro',price=4294967296)
 # Licence: BSD 3 clause
 
 from __future__ import print_function, absolute_import
+import binascii
 import hashlib
 import inspect
 from copy import deepcopy
 from functools import partial, update_wrapper, WRAPPER_ASSIGNMENTS
+from operator import itemgetter
 import types
+import weakref
 
 from future.utils import PY3
 
 from .misc import callable2call, is_iterable, config_dict_for_object, extract_decorated_function_from_closure, trim_dict
 
 
+# Values that are never whatable nor contain Whats
+_ATOMIC_TYPES = (type(None), bool, int, float, complex, bytes, type(u''))
+
+
+try:
+    from sys import intern
+except ImportError:  # pragma: no cover
+    pass  # python 2, intern is a builtin
+
+
+def _intern(string):
+    """Returns the interned version of a (native) string, other objects are returned untouched."""
+    return intern(string) if type(string) is str else string
+
+
+# Canonical frozensets of (interned) non-id keys, shared by all the Whats with the same keys
+_NON_ID_KEYS = {}
+
+
+def _shared_non_id_keys(keys):
+    keys = frozenset(keys)
+    try:
+        return _NON_ID_KEYS[keys]
+    except KeyError:
+        return _NON_ID_KEYS.setdefault(keys, frozenset(map(_intern, keys)))
+
+
+_NO_NON_ID_KEYS = _shared_non_id_keys(())
+
+
+class _DigestCache(object):
+    """Cached digests of a What, valid for one plugins configuration (see `What.digest_id`)."""
+
+    __slots__ = ('config', 'subtree', 'leaves', 'parents')
+
+    def __init__(self, config, parents=None):
+        super(_DigestCache, self).__init__()
+        self.config = config
+        self.subtree = None  # the digest of the What
+        self.leaves = {}  # path -> (value, digest), for values that are not Whats
+        self.parents = {} if parents is None else parents  # id(parent) -> weakref to a What containing this
+
+
 class What(object):
     """Stores and manipulates object configuration.
 
@@ -104,9 +150,11 @@ class What(object):
     ----------
     `What` objects carry the same attributes passed to the constructor:
     name, conf, non_id_keys and out_name.
+    Names are interned and non_id_keys is a frozenset shared by all Whats with the same non-id keys,
+    so many configurations can be kept in memory cheaply.
     """
 
-    __slots__ = ('name', 'conf', 'non_id_keys', 'out_name')
+    __slots__ = ('name', 'conf', 'non_id_keys', 'out_name', '_digests', '__weakref__')
 
     def __init__(self,
                  name,
@@ -114,13 +162,14 @@ class What(object):
                  non_id_keys=None,
                  out_name=None):
         super(What, self).__init__()
-        self.name = name
+        self.name = _intern(name)
         self.conf = conf
         self.out_name = out_name
+        self._digests = None
         if non_id_keys is None:
-            self.non_id_keys = set()
+            self.non_id_keys = _NO_NON_ID_KEYS
         elif is_iterable(non_id_keys):
-            self.non_id_keys = set(non_id_keys)
+            self.non_id_keys = _shared_non_id_keys(non_id_keys)
         else:
             raise Exception('non_ids must be None or an iterable')
 
@@ -214,6 +263,19 @@ class What(object):
             self.non_id_keys,
             self.out_name)
 
+    def __reduce__(self):
+        """Pickles as a call to the constructor, leaving out default arguments and the digests cache.
+
+        Whats with equal non_id_keys share the same frozenset, so each one is stored just once
+        when pickling many configurations together (e.g. in a list sent to a process pool).
+        """
+        args = (self.name, self.conf)
+        if self.non_id_keys or self.out_name is not None:
+            args += (self.non_id_keys or None,)
+        if self.out_name is not None:
+            args += (self.out_name,)
+        return self.__class__, args
+
     def __getitem__(self, item):
         """Allow to retrieve configuration values using [] notations, recursively, whatami aware."""
         try:
@@ -243,11 +305,12 @@ class What(object):
         # implement recursive keys
         what = self if not copy else self.copy()
         what.conf[key] = value
+        what._forget_digests(key)
         return what
 
     # ---- ID string generation
 
-    def id(self, nonids_too=False, maxlength=0):
+    def id(self, nonids_too=False, maxlength=0, abbreviate=False):
         """Returns the id string (unicode) of this configuration.
 
         Parameters
@@ -258,16 +321,45 @@ class What(object):
         maxlength : int, default 0
           If the id length goes over maxlength, it gets replaced by its sha1.
           If <= 0, it is ignored and the full id string will be returned.
+
+        abbreviate : boolean, default False
+          If True and the id length goes over maxlength, nested configurations and collections
+          are replaced by their digests (preferring the smallest replacement that suffices)
+          until the id fits. Abbreviated ids are still valid, parseable, ids. If no abbreviation
+          is short enough, the id gets replaced by its sha1.
+
+        Examples
+        --------
+        >>> what = What('rfc', {'n_trees': 10, 'criterion': What('gini', {'weights': list(range(30))})})
+        >>> print(what.id(maxlength=80, abbreviate=True))
+        rfc(criterion=gini(hash='4caf6eab222e4eca35ec3d05ecf856b20c72c35f'),n_trees=10)
+        >>> len(what.id(maxlength=60, abbreviate=True))
+        40
         """
-        from whatami.plugins import WhatamiPluginManager
-        kvs = ','.join('%s=%s' % (k, WhatamiPluginManager.build_string(v))
-                       for k, v in sorted(self.conf.items())
-                       if nonids_too or k not in self.non_id_keys)
+        from whatami.plugins import WhatamiPluginManager, _RENDERING, _abbreviated_id
+        if abbreviate and 0 < maxlength:
+            return _abbreviated_id(self, maxlength, nonids_too=nonids_too)
+        with WhatamiPluginManager.rendering():
+            kvs = ','.join('%s=%s' % (k, WhatamiPluginManager.build_string(v))
+                           for k, v in sorted(self.conf.items())
+                           if nonids_too or k not in self.non_id_keys)
         my_id = '%s(%s)' % (self.name, kvs)
         if self.out_name is not None:
             my_id = '%s=%s' % (self.out_name, my_id)
+        if _RENDERING.subtrees is not None:
+            # Abbreviating, record this configuration as a subtree
+            return _RENDERING.capture(my_id, my_id[:len(my_id) - len(kvs) - 2])
         return self._trim_too_long(my_id, maxlength=maxlength)
 
+    def aid(self, nonids_too=False, maxlength=0, abbreviate=False, executor=None):
+        """Returns an awaitable of `id`, rendered in executor so that it does not block the event loop.
+
+        Concurrent requests for the id of the same What share a single computation.
+        Needs python 3.5 or newer, see `whatami.aio`.
+        """
+        from whatami.aio import aid
+        return aid(self, nonids_too=nonids_too, maxlength=maxlength, abbreviate=abbreviate, executor=executor)
+
     def positional_id(self, non_ids_too=False, maxlength=0):
         """Returns an id without parameter names, just values.
 
@@ -281,8 +373,9 @@ class What(object):
           If <= 0, it is ignored and the full id string will be returned.
         """
         from whatami.plugins import WhatamiPluginManager
-        my_id = '%s(%s)' % (self.name, ','.join(map(WhatamiPluginManager.build_string,
-                                                    self.values(non_ids_too=non_ids_too))))
+        with WhatamiPluginManager.rendering():
+            my_id = '%s(%s)' % (self.name, ','.join(map(WhatamiPluginManager.build_string,
+                                                        self.values(non_ids_too=non_ids_too))))
         if self.out_name is not None:
             my_id = '%s=%s' % (self.out_name, my_id)
         return self._trim_too_long(my_id, maxlength=maxlength)
@@ -297,6 +390,135 @@ class What(object):
                 return hashlib.sha1(string.decode('utf-8').encode('utf-8')).hexdigest()
         return string
 
+    # ---- Merkle digests
+
+    def digest_id(self, cache=False):
+        """Returns a sha1 hexdigest identifying this configuration, combining digests of its subtrees.
+
+        Instead of hashing the full id string, the digest of a What combines its name, out_name
+        and, for each id key, the digest of nested Whats and whatables (also within lists, tuples
+        and dicts) or the digest of the id string of any other value. Like ids, digests do not depend
+        on the identity of the objects, but just on their configuration.
+
+        Digests are different to the sha1 of the id string, but unique in the same way.
+
+        Parameters
+        ----------
+        cache : boolean, default False
+          If True, each What caches its digest, and the digests of the values in its configuration
+          that are not Whats (reused while the same objects are in the configuration). Changing a key
+          with `set` forgets the digest of the What and of all the Whats containing it, so only the
+          path from the changed What to the root is recomputed. Caches are discarded when the plugins
+          or the rendering limits of `WhatamiPluginManager` change. Changes made without `set`
+          (assigning to `conf` or mutating values in place) are not noticed: set the value again,
+          or do not use the cache.
+
+        Examples
+        --------
+        >>> pipeline = What('pipeline', {'steps': [What('scaler', {'with_mean': True}),
+        ...                                        What('rfc', {'n_trees': 100})]})
+        >>> digest = pipeline.digest_id(cache=True)
+        >>> len(digest)
+        40
+        >>> rfc = pipeline['steps'][1]
+        >>> rfc.set('n_trees', 200).digest_id(cache=True) == What('rfc', {'n_trees': 200}).digest_id()
+        True
+        >>> pipeline.digest_id(cache=True) == digest
+        False
+        >>> _ = rfc.set('n_trees', 100)
+        >>> pipeline.digest_id(cache=True) == digest
+        True
+        """
+        from whatami.plugins import WhatamiPluginManager
+        with WhatamiPluginManager.rendering():
+            config = WhatamiPluginManager._config_key() if cache else None
+            return binascii.hexlify(self._merkle_digest(config)).decode('ascii')
+
+    def _digest_cache(self, config):
+        """Returns the digest cache of this What for the plugins configuration config."""
+        cache = self._digests
+        if cache is None:
+            cache = self._digests = _DigestCache(config)
+        elif cache.config != config:
+            # N.B. keep the parents, they might be still cached for other configurations
+            cache = self._digests = _DigestCache(config, cache.parents)
+        return cache
+
+    def _merkle_digest(self, config):
+        """Returns the digest of this What; if config is not None, cached for that plugins configuration."""
+        cache = None
+        if config is not None:
+            cache = self._digest_cache(config)
+            if cache.subtree is not None:
+                return cache.subtree
+        merkle = hashlib.sha1(b'What(')
+        merkle.update(self.name.encode('utf-8'))
+        if self.out_name is not None:
+            merkle.update(b'=' + self.out_name.encode('utf-8'))
+        for k, v in sorted(self.conf.items()):
+            if k not in self.non_id_keys:
+                merkle.update(b',%s=' % str(k).encode('utf-8'))
+                merkle.update(self._merkle_value_digest(v, (k,), cache))
+        merkle.update(b')')
+        digest = merkle.digest()
+        if cache is not None:
+            cache.subtree = digest
+        return digest
+
+    def _merkle_value_digest(self, v, path, cache):
+        if not isinstance(v, What) and type(v) not in _ATOMIC_TYPES and is_whatable(v):
+            v = v.what() if callable(v.what) else v.what
+        if isinstance(v, What):
+            if cache is None:
+                return v._merkle_digest(None)
+            digest = v._merkle_digest(cache.config)
+            # Changes to v need to invalidate this What too
+            v._digests.parents[id(self)] = weakref.ref(self)
+            return digest
+        if type(v) in (list, tuple) and any(isinstance(x, What) for x in v):
+            merkle = hashlib.sha1(type(v).__name__.encode('utf-8'))
+            for i, x in enumerate(v):
+                merkle.update(self._merkle_value_digest(x, path + (i,), cache))
+            return merkle.digest()
+        if type(v) == dict and any(isinstance(x, What) for x in v.values()):
+            from whatami.plugins import WhatamiPluginManager
+            merkle = hashlib.sha1(b'dict')
+            for ks, dict_k in sorted(((WhatamiPluginManager.build_string(dict_k), dict_k) for dict_k in v),
+                                     key=itemgetter(0)):
+                merkle.update(ks.encode('utf-8') + b':')
+                merkle.update(self._merkle_value_digest(v[dict_k], path + (ks,), cache))
+            return merkle.digest()
+        if cache is not None:
+            try:
+                obj, digest = cache.leaves[path]
+                if obj is v:
+                    return digest
+            except KeyError:
+                pass
+        from whatami.plugins import WhatamiPluginManager
+        digest = hashlib.sha1(WhatamiPluginManager.build_string(v).encode('utf-8')).digest()
+        if cache is not None:
+            cache.leaves[path] = (v, digest)
+        return digest
+
+    def _forget_digests(self, key):
+        """Forgets the cached digests depending on key, including those of the Whats containing this What."""
+        cache = self._digests
+        if cache is None:
+            return
+        for path in [path for path in cache.leaves if path[0] == key]:
+            del cache.leaves[path]
+        # Forget the digests of this What and its ancestors
+        pending, seen = [self], set()
+        while pending:
+            what = pending.pop()
+            if id(what) in seen or what._digests is None:
+                continue
+            seen.add(id(what))
+            what._digests.subtree = None
+            pending.extend(parent for parent in (ref() for ref in what._digests.parents.values())
+                           if parent is not None)
+
     # --- ID to dictionary
 
     def to_dict(self, nonids_too=False):
@@ -9,14 +9,15 @@ from __future__ import print_function
 from future.utils import string_types
 
 import inspect
+import threading
 from itertools import chain
 
 from operator import itemgetter
-from arpeggio import NoMatch
 
 from whatami import (config_dict_for_object,
                      parse_whatid, build_oldwhatami_parser,
                      whatareyou, What, is_whatable, maybe_import)
+from whatami.parsers import _ThreadDefault
 
 
 def whatamize_object(clazz_or_fqn, what_func, fail_on_import_error=True, force=False):
@@ -432,7 +433,20 @@ class FunctionLike(object):
 
 # --- Maintenance
 
-OLD_WHATID_PARSER = None
+# Parsers are stateful, so each thread gets its own (see parse_whatid)
+_OLD_WHATID_PARSERS = threading.local()
+
+
+def _old_whatid_parser():
+    """Returns the old-style ids parser for the calling thread."""
+    parser = getattr(_OLD_WHATID_PARSERS, 'parser', None)
+    if parser is None:
+        parser = _OLD_WHATID_PARSERS.parser = build_oldwhatami_parser()
+    return parser
+
+
+# Deprecated, use oldid2what
+OLD_WHATID_PARSER = _ThreadDefault('OLD_WHATID_PARSER', _old_whatid_parser, 'oldid2what')
 
 
 def oldid2what(oldwhatid):
@@ -454,15 +468,13 @@ def oldid2what(oldwhatid):
     ...
     ValueError: whatid defines out ambiguously ("acc" and "vel")
     """
-    global OLD_WHATID_PARSER
-    if OLD_WHATID_PARSER is None:
-        OLD_WHATID_PARSER = build_oldwhatami_parser()
+    parser = _old_whatid_parser()
     out = None
     if oldwhatid.startswith('out='):
         out, _, oldwhatid = oldwhatid.partition('#')
         out = out[4:]
 
-    what = id2what(oldwhatid, parser=OLD_WHATID_PARSER)
+    what = id2what(oldwhatid, parser=parser)
 
     if out is not None:
         if 'out' in what.conf:
@@ -479,6 +491,7 @@ def id2whatami4(oldwhatid):
     >>> print(id2whatami4("velocity"))
     velocity
     """
+    from arpeggio import NoMatch
     try:
         return oldid2what(oldwhatid).id()
     except NoMatch: